@@ -0,0 +1,77 @@
+"""
+版元ドットコムの書籍詳細ページの抽出処理のベンチマーク。
+
+fixtures/hanmoto/*.html を各バックエンドで解析し、1ページあたりの解析時間を表示します。
+あわせて、すべてのバックエンドの抽出結果がBeautifulSoupでの結果と一致することを確認します。
+
+fixtures/hanmoto/*.html は、版元ドットコムの書籍詳細ページの構造（book-ccode-num、book-contents）を
+真似て作った合成のページで、実際に保存したページではありません。
+実際のページでの速度や抽出結果は、保存したページをこのディレクトリに置いて確認してください。
+
+使い方::
+
+    python benchmarks/bench_extractor.py [--repeat 200]
+"""
+
+from pathlib import Path
+import argparse
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "fetch_book_feeds"))
+
+from extractor import BACKENDS  # noqa: E402
+
+
+FIXTURES = Path(__file__).parent / "fixtures" / "hanmoto"
+
+
+def load_pages():
+    return {
+        p.name: p.read_text(encoding="utf-8") for p in sorted(FIXTURES.glob("*.html"))
+    }
+
+
+def check_results(pages):
+    """各バックエンドの結果がbs4と一致するか確認し、不一致の一覧を返す関数。"""
+    mismatches = []
+    for name, html in pages.items():
+        expected = BACKENDS["bs4"](html)
+        for backend, func in BACKENDS.items():
+            result = func(html)
+            if result != expected:
+                mismatches.append((name, backend, expected, result))
+    return mismatches
+
+
+def bench(pages, repeat: int):
+    """バックエンドごとに1ページあたりの平均解析時間（ミリ秒）を計測する関数。"""
+    results = {}
+    for backend, func in BACKENDS.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for html in pages.values():
+                func(html)
+        elapsed = time.perf_counter() - start
+        results[backend] = elapsed / (repeat * len(pages)) * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    pages = load_pages()
+    mismatches = check_results(pages)
+    for name, backend, expected, result in mismatches:
+        print(f"MISMATCH {name} {backend}: expected={expected} result={result}")
+    results = bench(pages, args.repeat)
+    baseline = results["bs4"]
+    print(f"{'backend':<8} {'ms/page':>10} {'speedup':>8}")
+    for backend, ms in results.items():
+        print(f"{backend:<8} {ms:>10.3f} {baseline / ms:>7.1f}x")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
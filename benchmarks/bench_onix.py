@@ -0,0 +1,69 @@
+"""
+OpenBDのレスポンスの解析処理のベンチマーク。
+
+fixtures/openbd/*.json を、従来の実装（json + main.parse_openbd）と
+onixモジュールの実装（orjson + onix.parse_record）でデコード・解析し、
+1秒あたりの処理レコード数を表示します。あわせて両者の結果が一致することを確認します。
+
+fixtures/openbd/response.json は、OpenBDのレスポンスの構造に合わせて作った合成のデータで
+（ISBNは9784000000000からの連番、本文は仮の文章）、実際に記録したレスポンスではありません。
+
+使い方::
+
+    python benchmarks/bench_onix.py [--repeat 50]
+"""
+
+from pathlib import Path
+import argparse
+import json
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "fetch_book_feeds"))
+
+from main import parse_openbd  # noqa: E402
+from onix import loads, orjson, parse_record  # noqa: E402
+
+
+FIXTURES = Path(__file__).parent / "fixtures" / "openbd"
+
+
+def parse_legacy(data: bytes):
+    return [parse_openbd(d) for d in json.loads(data) if d is not None]
+
+
+def parse_fast(data: bytes):
+    return [parse_record(d) for d in loads(data) if d is not None]
+
+
+def bench(func, responses, repeat: int):
+    """funcで全レスポンスをrepeat回解析し、1秒あたりのレコード数を返す関数。"""
+    count = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for data in responses:
+            count += len(func(data))
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    responses = [p.read_bytes() for p in sorted(FIXTURES.glob("*.json"))]
+    mismatches = sum(parse_legacy(data) != parse_fast(data) for data in responses)
+    if mismatches:
+        print(f"MISMATCH in {mismatches} responses")
+    legacy = bench(parse_legacy, responses, args.repeat)
+    fast = bench(parse_fast, responses, args.repeat)
+    decoder = "orjson" if orjson is not None else "json"
+    print(f"{'implementation':<28} {'records/sec':>12} {'speedup':>8}")
+    print(f"{'json + parse_openbd':<28} {legacy:>12.0f} {1:>7.1f}x")
+    print(
+        f"{decoder + ' + onix.parse_record':<28} {fast:>12.0f} {fast / legacy:>7.1f}x"
+    )
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
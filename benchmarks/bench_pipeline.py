@@ -0,0 +1,256 @@
+"""
+fetch_book_feedsの処理全体（フィード取得 → 追加情報の取得 → 保存）のベンチマーク。
+
+版元ドットコムのRSS、OpenBD API、版元ドットコムの書籍詳細ページを返すローカルのHTTPサーバーを立て、
+main.pyの関数をそのまま実行します。ネットワークには接続しません。
+返すページとレスポンスはfixtures以下の合成のデータです（bench_extractor.py、bench_onix.pyを参照）。
+件数ごとに別プロセスで実行し、段階ごとの経過時間、外部リクエスト数、ピークRSS、
+1秒あたりの処理件数を表示します。
+
+使い方::
+
+    python benchmarks/bench_pipeline.py [--sizes 200 2000 20000] [--latency 0.05]
+"""
+
+from datetime import date, timedelta
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs
+from xml.sax.saxutils import escape
+import argparse
+import collections
+import datetime as dt
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+ROOT = Path(__file__).parent
+FIXTURES = ROOT / "fixtures"
+TARGET_DATE = date(2025, 1, 2)
+
+
+def load_openbd_templates():
+    """OpenBDの合成のレスポンスから、ISBNを差し替えられるテンプレートを作る関数。"""
+    records = json.loads((FIXTURES / "openbd" / "response.json").read_text())
+    templates = []
+    for record in records:
+        if record is None:
+            templates.append(None)
+            continue
+        isbn = record["onix"]["RecordReference"]
+        templates.append(json.dumps(record, ensure_ascii=False).replace(isbn, "{isbn}"))
+    return templates
+
+
+def make_feed(size: int, base_url: str) -> bytes:
+    """size件のエントリーを含むRSSフィードを作る関数。"""
+    published = format_datetime(
+        dt.datetime.combine(TARGET_DATE, dt.time(), dt.timezone(timedelta(hours=9)))
+    )
+    items = []
+    for i in range(size):
+        isbn = f"978{i:010d}"
+        link = f"{base_url}/bd/isbn/{isbn}"
+        title = escape(f"本{i} - 著者{i % 97}(著/文) | 出版社{i % 13}")
+        items.append(
+            f"<item><title>{title}</title><link>{link}</link>"
+            f"<guid>{link}</guid><pubDate>{published}</pubDate></item>"
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>'
+        "<title>版元ドットコム</title>" + "".join(items) + "</channel></rss>"
+    ).encode("utf-8")
+
+
+class StandIn:
+    """版元ドットコムとOpenBDの代わりになるローカルのHTTPサーバー。
+
+    :param int size: フィードに含めるエントリー数
+    :param float latency: 1リクエストごとに待つ秒数
+    """
+
+    def __init__(self, size: int, latency: float):
+        self.latency = latency
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+        self.templates = load_openbd_templates()
+        self.pages = [
+            p.read_bytes() for p in sorted((FIXTURES / "hanmoto").glob("*.html"))
+        ]
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.feed = make_feed(size, self.base_url)
+
+    def count(self, kind: str):
+        with self.lock:
+            self.counts[kind] += 1
+
+    def openbd(self, isbns):
+        records = []
+        for isbn in isbns:
+            template = self.templates[int(isbn) % len(self.templates)]
+            records.append(
+                None if template is None else template.replace("{isbn}", isbn)
+            )
+        return ("[" + ",".join(r or "null" for r in records) + "]").encode("utf-8")
+
+    def handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body: bytes, content_type: str):
+                time.sleep(stand_in.latency)
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.startswith("/ci/bd/search/"):
+                    stand_in.count("rss")
+                    self.reply(stand_in.feed, "application/rss+xml")
+                elif self.path.startswith("/bd/isbn/"):
+                    stand_in.count("hanmoto")
+                    isbn = self.path.rstrip("/").split("/")[-1]
+                    page = stand_in.pages[int(isbn) % len(stand_in.pages)]
+                    self.reply(page, "text/html; charset=utf-8")
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                length = int(self.headers["Content-Length"])
+                form = parse_qs(self.rfile.read(length).decode("utf-8"))
+                stand_in.count("openbd")
+                isbns = form["isbn"][0].split(",")
+                self.reply(stand_in.openbd(isbns), "application/json")
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_child(size: int, latency: float, hanmoto_rate: float) -> dict:
+    """1つの件数についてベンチマークを実行し、結果を辞書で返す関数。"""
+    stand_in = StandIn(size, latency)
+    stand_in.start()
+    storage_dir = tempfile.mkdtemp()
+    os.environ.update(
+        HANMOTO_BASE_URL=stand_in.base_url,
+        OPENBD_URL=f"{stand_in.base_url}/v1/get",
+        HANMOTO_RATE=str(hanmoto_rate),
+        LOCAL_STORAGE_DIR=storage_dir,
+    )
+    sys.path.insert(0, str(ROOT.parent / "fetch_book_feeds"))
+    import main
+    from enrich_cache import EnrichmentCache
+
+    main.get_today = lambda: TARGET_DATE
+    stages = {}
+
+    def measure(name, func):
+        before = dict(stand_in.counts)
+        start = time.perf_counter()
+        value = func()
+        elapsed = time.perf_counter() - start
+        requests = {k: v - before.get(k, 0) for k, v in stand_in.counts.items()}
+        stages[name] = dict(
+            seconds=elapsed,
+            records_per_sec=size / elapsed if elapsed else 0,
+            requests={k: v for k, v in requests.items() if v},
+            peak_rss_mb=peak_rss_mb(),
+        )
+        return value
+
+    entries = measure("feed", lambda: list(main.fetch_feed_by_date(TARGET_DATE)))
+    records = measure(
+        "enrich",
+        lambda: list(main.handle_entries_in_batches(entries, EnrichmentCache())),
+    )
+    measure(
+        "save",
+        lambda: main.save_partition("bucket", TARGET_DATE.isoformat(), records),
+    )
+    del entries, records
+    measure(
+        "fetch_and_save",
+        lambda: main.fetch_and_save(TARGET_DATE, "bucket", use_cache=False, force=True),
+    )
+    stand_in.stop()
+    return dict(size=size, stages=stages)
+
+
+def print_report(results):
+    header = f"{'size':>6} {'stage':<15} {'wall[s]':>9} {'rec/s':>10} {'peakRSS[MB]':>12}  requests"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        for name, stage in result["stages"].items():
+            requests = ", ".join(
+                f"{k}={v}" for k, v in sorted(stage["requests"].items())
+            )
+            print(
+                f"{result['size']:>6} {name:<15} {stage['seconds']:>9.2f} "
+                f"{stage['records_per_sec']:>10.0f} {stage['peak_rss_mb']:>12.1f}  {requests}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200, 2000, 20000])
+    parser.add_argument("--latency", type=float, default=0.05, help="秒/リクエスト")
+    parser.add_argument(
+        "--hanmoto-rate",
+        type=float,
+        default=1000,
+        help="書籍詳細ページの取得レート(req/s)。本番の既定値は1.0",
+    )
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        result = run_child(args.child, args.latency, args.hanmoto_rate)
+        print(json.dumps(result))
+        return
+    results = []
+    for size in args.sizes:
+        # ピークRSSを件数ごとに測るため、別プロセスで実行する
+        output = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--child",
+                str(size),
+                "--latency",
+                str(args.latency),
+                "--hanmoto-rate",
+                str(args.hanmoto_rate),
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Cloud Functionsのコールドスタート時のモジュール読み込み時間のベンチマーク。
+
+関数のディレクトリごとに新しいプロセスで ``python -X importtime -c "import main"`` を実行し、
+main.pyの読み込みにかかった時間と、時間のかかったモジュールを表示します。
+クライアントの作成や実際の処理までの時間は、各関数が最初のリクエストの後に
+``{"startup": {...}}`` としてログに出力します（startup.py）。
+
+使い方::
+
+    python benchmarks/bench_startup.py [--repeat 5] [--top 10]
+"""
+
+from pathlib import Path
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+ROOT = Path(__file__).parent.parent
+FUNCTIONS = ("fetch_book_feeds", "categorize", "book_post")
+
+
+def import_times(function: str):
+    """main.pyを読み込み、main.pyが直接読み込んだモジュールごとの累積読み込み時間(秒)を返す関数。"""
+    env = dict(os.environ, PROJECT_NAME=os.environ.get("PROJECT_NAME", "bench"))
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT / function,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    times = {}
+    children = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        seconds = int(cumulative) / 1e6
+        # 子のモジュールは親より先に出力される
+        if depth == 1:
+            children[name.strip()] = seconds
+        elif depth == 0:
+            if name.strip() == "main":
+                times = dict(children, main=seconds)
+            children = {}
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    for function in FUNCTIONS:
+        runs = [import_times(function) for _ in range(args.repeat)]
+        median = {
+            name: statistics.median(run.get(name, 0.0) for run in runs)
+            for name in runs[0]
+        }
+        print(f"{function}: import main {median.get('main', 0.0) * 1000:.0f}ms")
+        modules = sorted(
+            ((t, name) for name, t in median.items() if name != "main"), reverse=True
+        )
+        for t, name in modules[: args.top]:
+            print(f"  {t * 1000:8.1f}ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -28,15 +28,4 @@ FROM `peak-bit-229907.book_feed.external_categorized` AS c
 LEFT JOIN base USING (isbn)
 WHERE
     date BETWEEN @start_date AND @end_date
-  AND
-    (STRPOS(c.genre, "ホラー") > 0
-     OR
-     STRPOS(c.genre, "SF") > 0
-     OR
-     STRPOS(c.genre, "ファンタジー") > 0 AND SUBSTR(c_code, 3, 2) = "97"
-     OR
-     STRPOS(c.genre, "ミステリ") > 0
-     OR
-     base.publisher IN ("早川書房", "東京創元社", "国書刊行会")
-    )
 ORDER BY publish_date
\ No newline at end of file
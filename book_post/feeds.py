@@ -0,0 +1,124 @@
+"""
+投稿先（フィード）の設定を扱うモジュール。
+
+フィードごとに、対象の書籍の条件、投稿先のフックURL、投稿する時刻をfeeds.jsonに書きます。
+1回の実行で候補を1度だけ読み込み、1冊ずつ全フィードの条件を調べて振り分けます。
+
+条件（filter）は節のリストで、いずれかの節に一致すれば対象になります。
+節の中の条件はすべて満たす必要があります。
+
+- genre: ジャンルにいずれかの文字列を含む
+- publisher: 出版社がいずれかに一致する
+- c_code_content: Cコードの3〜4桁目（内容）がいずれかに一致する
+"""
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+import json
+import os
+
+from post_queue import DEFAULT_WEIGHTS
+
+
+FEEDS_PATH = Path(os.environ.get("FEEDS_PATH", Path(__file__).parent / "feeds.json"))
+
+
+def as_list(value) -> List:
+    return value if isinstance(value, list) else [value]
+
+
+def match_clause(book: Dict, clause: Dict) -> bool:
+    """書籍が節の条件をすべて満たすかを返す関数。"""
+    if "genre" in clause:
+        genre = book.get("genre") or ""
+        if not any(g in genre for g in as_list(clause["genre"])):
+            return False
+    if "publisher" in clause:
+        if book.get("publisher") not in as_list(clause["publisher"]):
+            return False
+    if "c_code_content" in clause:
+        c_code = book.get("c_code") or ""
+        if c_code[2:4] not in as_list(clause["c_code_content"]):
+            return False
+    return True
+
+
+class Feed:
+    """1つの投稿先の設定。
+
+    :param str name: フィード名
+    :param filter: 対象の書籍の条件。省略した場合はすべての書籍
+    :param str post_url_env: フックURLを持つ環境変数名
+    :param str post_url: フックURL。post_url_envより優先する
+    :param random_hours: randomモードで投稿する時刻（時）のリスト。省略した場合は毎回
+    :param bool today: todayモードで投稿するか
+    :param dict weights: ジャンル・出版社ごとの重み
+    :param str posted_collection: 投稿済みの書籍を記録するコレクション名
+    :param str queue_collection: 投稿の順番を保存するコレクション名
+    """
+
+    def __init__(
+        self,
+        name: str,
+        filter: Optional[List[Dict]] = None,
+        post_url_env: str = "POST_URL",
+        post_url: Optional[str] = None,
+        random_hours: Optional[List[int]] = None,
+        today: bool = True,
+        weights: Optional[Dict] = None,
+        posted_collection: Optional[str] = None,
+        queue_collection: Optional[str] = None,
+    ):
+        self.name = name
+        self.filter = filter
+        self.post_url_env = post_url_env
+        self._post_url = post_url
+        self.random_hours = random_hours
+        self.today = today
+        self.weights = DEFAULT_WEIGHTS if weights is None else weights
+        self.posted_collection = posted_collection or f"new_books_{name}"
+        self.queue_collection = queue_collection or f"post_queue_{name}"
+
+    @property
+    def post_url(self) -> Optional[str]:
+        """フックURL。post_urlもpost_url_envの環境変数もない場合はNone"""
+        return self._post_url or os.environ.get(self.post_url_env)
+
+    def matches(self, book: Dict) -> bool:
+        """書籍がこのフィードの対象かを返す関数。"""
+        if not self.filter:
+            return True
+        return any(match_clause(book, clause) for clause in self.filter)
+
+    def is_due(self, mode: str, hour: int) -> bool:
+        """指定したモードと時刻に投稿するかを返す関数。"""
+        if mode == "today":
+            return self.today
+        return self.random_hours is None or hour in self.random_hours
+
+
+def load_feeds(path: Path = FEEDS_PATH) -> List[Feed]:
+    """フィードの設定を読み込む関数。
+
+    :param path: 設定ファイルのパス
+    :return: フィードのリスト
+    :rtype: list
+    """
+    with path.open() as fp:
+        return [Feed(**config) for config in json.load(fp)]
+
+
+def split_by_feed(books: Iterable[Dict], feeds: List[Feed]) -> Dict[str, List[Dict]]:
+    """書籍を1冊ずつ全フィードの条件と照らし合わせ、フィードごとに振り分ける関数。
+
+    :param books: 書籍のリスト
+    :param feeds: フィードのリスト
+    :return: フィード名をキー、対象の書籍のリストを値とする辞書
+    :rtype: dict
+    """
+    groups = {feed.name: [] for feed in feeds}
+    for book in books:
+        for feed in feeds:
+            if feed.matches(book):
+                groups[feed.name].append(book)
+    return groups
@@ -0,0 +1,145 @@
+"""
+randomモードで投稿する書籍の、1日分の順番をMongoDBに保存するモジュール。
+
+その日の最初の実行で、まだ投稿していない候補を（ジャンルや出版社の重み付きで）並べ替えて保存し、
+以降の実行は先頭から1件ずつfind_one_and_updateで取り出します。
+順番は最後まで保存できた時点で完了の印を付け、印がなければ次の実行で保存し直します。
+取り出しは1件ずつアトミックに行うため、同時に実行されたり再実行されたりしても同じ本を二重に投稿しません。
+並べ替えは日付をシードにしているので、同じ候補からは同じ順番になります。
+"""
+
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, List, Optional
+import json
+import os
+import random
+
+
+# {"genre": {"SF": 2.0}, "publisher": {"早川書房": 1.5}}のような重み。指定がなければ1
+DEFAULT_WEIGHTS = json.loads(os.environ.get("POST_QUEUE_WEIGHTS", "{}"))
+# その日の順番を最後まで保存したことを表すドキュメントの位置
+MARKER_POSITION = -1
+DUPLICATE_KEY = 11000
+
+
+def weight(book: Dict, weights: Dict) -> float:
+    """書籍の重みを計算する関数。ジャンルと出版社の重みを掛け合わせる。"""
+    value = 1.0
+    for key in ("genre", "publisher"):
+        value *= weights.get(key, {}).get(book.get(key), 1.0)
+    return value
+
+
+def weighted_shuffle(books: List[Dict], weights: Dict, seed: str) -> List[Dict]:
+    """重みが大きい書籍ほど前に来やすいように並べ替える関数（Efraimidis-Spirakis法）。
+
+    :param books: 書籍のリスト
+    :param dict weights: ジャンル・出版社ごとの重み
+    :param str seed: 乱数のシード
+    :return: 並べ替えた書籍のリスト
+    :rtype: list
+    """
+    rng = random.Random(seed)
+    keyed = []
+    for book in books:
+        w = weight(book, weights)
+        if w <= 0:
+            continue
+        keyed.append((rng.random() ** (1 / w), book))
+    keyed.sort(key=lambda x: x[0], reverse=True)
+    return [book for _, book in keyed]
+
+
+class PostQueue:
+    """日付ごとの投稿の順番を保持するコレクションを扱うクラス。
+
+    :param collection: pymongoのコレクション
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def ensure_indexes(self):
+        """必要なインデックスを作成する関数。すでにあれば何もしない。"""
+        self.collection.create_index([("date", 1), ("position", 1)], unique=True)
+        self.collection.create_index([("date", 1), ("claimed", 1), ("position", 1)])
+        self.collection.create_index("expire_at", expireAfterSeconds=0)
+
+    def exists(self, target_date: date) -> bool:
+        """その日の順番が最後まで保存されているかを返す関数。"""
+        query = {"date": target_date.isoformat(), "position": MARKER_POSITION}
+        return self.collection.find_one(query) is not None
+
+    def build(self, target_date: date, books: List[Dict]) -> int:
+        """その日の順番を保存する関数。
+
+        同時に実行されたり、途中で失敗した後に再実行されたりしても同じ結果になるよう、
+        すでに保存されている位置は飛ばし、最後に完了の印を保存します。
+
+        :param target_date: 日付
+        :param books: 並べ替え済みの書籍のリスト
+        :return: 新しく保存した件数
+        :rtype: int
+        """
+        from pymongo.errors import BulkWriteError
+
+        # 翌々日の0時(UTC)を過ぎたら消す
+        expire_at = datetime.combine(
+            target_date + timedelta(days=2), time(), tzinfo=timezone.utc
+        )
+        documents = [
+            dict(
+                date=target_date.isoformat(),
+                position=i,
+                isbn=book["isbn"],
+                book=book,
+                claimed=False,
+                expire_at=expire_at,
+            )
+            for i, book in enumerate(books)
+        ]
+        inserted = len(documents)
+        if documents:
+            try:
+                self.collection.insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                errors = e.details["writeErrors"]
+                if any(error["code"] != DUPLICATE_KEY for error in errors):
+                    raise
+                inserted -= len(errors)
+        # 完了の印。claimedをTrueにしておき、取り出しの対象にしない
+        self.collection.update_one(
+            {"date": target_date.isoformat(), "position": MARKER_POSITION},
+            {
+                "$setOnInsert": {
+                    "claimed": True,
+                    "count": len(documents),
+                    "expire_at": expire_at,
+                }
+            },
+            upsert=True,
+        )
+        return inserted
+
+    def claim(self, target_date: date) -> Optional[Dict]:
+        """まだ取り出していない先頭の書籍を、取り出し済みにして返す関数。
+
+        :param target_date: 日付
+        :return: 書籍。残っていない場合はNone
+        """
+        document = self.collection.find_one_and_update(
+            {"date": target_date.isoformat(), "claimed": False},
+            {"$set": {"claimed": True, "claimed_at": datetime.now(timezone.utc)}},
+            sort=[("position", 1)],
+        )
+        return document["book"] if document else None
+
+    def peek(self, target_date: date) -> Optional[Dict]:
+        """まだ取り出していない先頭の書籍を、取り出さずに返す関数。"""
+        documents = self.collection.find(
+            {"date": target_date.isoformat(), "claimed": False},
+            sort=[("position", 1)],
+            limit=1,
+        )
+        document = next(iter(documents), None)
+        return document["book"] if document else None
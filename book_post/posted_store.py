@@ -0,0 +1,110 @@
+"""
+投稿済みの書籍をMongoDBに記録するモジュール。
+
+コレクションはISBNのユニークインデックスとpublish_dateのインデックスを持ち、
+1冊ずつupsertで追加します。発売日を過ぎた書籍はTTLインデックス（expire_at）で自動的に消え、
+TTLの反映を待たずに参照されないよう、publish_dateの範囲指定でも削除します。
+ユニークインデックスがなかった頃に重複して記録されたISBNは、インデックスの作成時に1件にまとめます。
+"""
+
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterable, Set
+
+
+DUPLICATE_KEY = 11000
+
+
+class PostedStore:
+    """投稿済みの書籍のコレクションを扱うクラス。
+
+    :param collection: pymongoのコレクション
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def ensure_indexes(self):
+        """必要なインデックスを作成する関数。すでにあれば何もしない。
+
+        ISBNが重複していてユニークインデックスを作れない場合は、重複を削除してから作り直す。
+        """
+        from pymongo.errors import OperationFailure
+
+        try:
+            self.collection.create_index("isbn", unique=True)
+        except OperationFailure as e:
+            if e.code != DUPLICATE_KEY:
+                raise
+            print("removed duplicated isbn", self.remove_duplicates())
+            self.collection.create_index("isbn", unique=True)
+        self.collection.create_index("publish_date")
+        self.collection.create_index("expire_at", expireAfterSeconds=0)
+
+    def remove_duplicates(self) -> int:
+        """同じISBNのドキュメントを、最初の1件を残して削除する関数。
+
+        :return: 削除した件数
+        :rtype: int
+        """
+        seen = set()
+        duplicates = []
+        cursor = self.collection.find({}, {"_id": 1, "isbn": 1}, sort=[("_id", 1)])
+        for document in cursor:
+            if document.get("isbn") in seen:
+                duplicates.append(document["_id"])
+            else:
+                seen.add(document.get("isbn"))
+        if not duplicates:
+            return 0
+        result = self.collection.delete_many({"_id": {"$in": duplicates}})
+        return result.deleted_count
+
+    def posted_isbns(self, isbns: Iterable[str]) -> Set[str]:
+        """指定したISBNのうち、投稿済みのものを返す関数。
+
+        :param isbns: 調べるISBN
+        :return: 投稿済みのISBNの集合
+        :rtype: set
+        """
+        cursor = self.collection.find(
+            {"isbn": {"$in": list(isbns)}}, {"isbn": 1, "_id": 0}
+        )
+        return {d["isbn"] for d in cursor}
+
+    def mark_posted(self, book: Dict) -> bool:
+        """書籍を投稿済みとして記録する関数。
+
+        :param dict book: isbn, publish_date, titleを含む書籍
+        :return: 新しく記録した場合はTrue、すでに記録されていた場合はFalse
+        :rtype: bool
+        """
+        publish_date = date.fromisoformat(book["publish_date"])
+        # 発売日の翌日0時(UTC)を過ぎたら消す
+        expire_at = datetime.combine(
+            publish_date + timedelta(days=1), time(), tzinfo=timezone.utc
+        )
+        result = self.collection.update_one(
+            {"isbn": book["isbn"]},
+            {
+                "$setOnInsert": {
+                    "isbn": book["isbn"],
+                    "publish_date": book["publish_date"],
+                    "title": book["title"],
+                    "expire_at": expire_at,
+                }
+            },
+            upsert=True,
+        )
+        return result.upserted_id is not None
+
+    def expire(self, today: date) -> int:
+        """発売日が今日より前の書籍を削除する関数。
+
+        :param today: 今日の日付
+        :return: 削除した件数
+        :rtype: int
+        """
+        result = self.collection.delete_many(
+            {"publish_date": {"$lt": today.isoformat()}}
+        )
+        return result.deleted_count
@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+
+DUPLICATE_KEY = 11000
+
+
+class FakeCollection:
+    """テスト用に、PostedStoreとPostQueueが使う操作だけを実装したインメモリのコレクション。"""
+
+    def __init__(self, documents=()):
+        self.documents = []
+        self.indexes = []
+        self.next_id = 1
+        for document in documents:
+            self.add(document)
+
+    def add(self, document):
+        document = dict(document, _id=self.next_id)
+        self.next_id += 1
+        self.documents.append(document)
+        return document
+
+    def create_index(self, key, **kwargs):
+        """単一のキーのユニークインデックスは、既存のドキュメントが重複していればエラーにする。"""
+        if kwargs.get("unique") and isinstance(key, str):
+            values = [d.get(key) for d in self.documents]
+            if len(values) != len(set(values)):
+                raise DuplicateKeyError("E11000 duplicate key error", DUPLICATE_KEY)
+        self.indexes.append((key, kwargs))
+
+    @staticmethod
+    def matches(document, query):
+        for key, condition in query.items():
+            value = document.get(key)
+            if isinstance(condition, dict):
+                if "$in" in condition and value not in condition["$in"]:
+                    return False
+                if "$lt" in condition and not (
+                    value is not None and value < condition["$lt"]
+                ):
+                    return False
+            elif value != condition:
+                return False
+        return True
+
+    def find(self, query, projection=None, sort=None, limit=0):
+        documents = self.documents
+        if sort:
+            for key, direction in reversed(sort):
+                documents = sorted(
+                    documents, key=lambda d: d[key], reverse=direction < 0
+                )
+        found = 0
+        for document in documents:
+            if limit and found >= limit:
+                return
+            if self.matches(document, query):
+                found += 1
+                if projection:
+                    yield {
+                        k: document[k]
+                        for k, v in projection.items()
+                        if v and k in document
+                    }
+                else:
+                    yield dict(document)
+
+    def find_one(self, query):
+        return next(self.find(query), None)
+
+    def insert_many(self, documents, ordered=True):
+        """PostQueueのユニークインデックス（date, position）だけを再現する。"""
+        errors = []
+        for i, document in enumerate(documents):
+            key = {"date": document.get("date"), "position": document.get("position")}
+            if self.find_one(key) is not None:
+                errors.append(dict(index=i, code=11000))
+                if ordered:
+                    break
+                continue
+            self.add(document)
+        if errors:
+            raise BulkWriteError(dict(writeErrors=errors))
+
+    def find_one_and_update(self, query, update, sort=None):
+        for document in self.find(query, sort=sort, limit=1):
+            for stored in self.documents:
+                if stored == document:
+                    stored.update(update.get("$set", {}))
+                    return document
+        return None
+
+    def update_one(self, query, update, upsert=False):
+        for document in self.documents:
+            if self.matches(document, query):
+                document.update(update.get("$set", {}))
+                return SimpleNamespace(upserted_id=None, modified_count=1)
+        if not upsert:
+            return SimpleNamespace(upserted_id=None, modified_count=0)
+        document = dict(query)
+        document.update(update.get("$setOnInsert", {}))
+        document.update(update.get("$set", {}))
+        document = self.add(document)
+        return SimpleNamespace(upserted_id=document["_id"], modified_count=0)
+
+    def delete_many(self, query):
+        before = len(self.documents)
+        self.documents = [d for d in self.documents if not self.matches(d, query)]
+        return SimpleNamespace(deleted_count=before - len(self.documents))
@@ -0,0 +1,44 @@
+import json
+
+from feeds import Feed, load_feeds, split_by_feed
+
+
+def test_default_feed_matches_previous_query():
+    [feed] = load_feeds()
+    assert "new_books" == feed.posted_collection
+    assert feed.matches(dict(genre="SF・ホラー", publisher="A", c_code="0193"))
+    assert feed.matches(dict(genre="ファンタジー", publisher="A", c_code="0197"))
+    assert not feed.matches(dict(genre="ファンタジー", publisher="A", c_code="0193"))
+    assert feed.matches(dict(genre="一般", publisher="早川書房", c_code="0193"))
+    assert not feed.matches(dict(genre=None, publisher="A", c_code=None))
+
+
+def test_split_by_feed(tmp_path):
+    path = tmp_path / "feeds.json"
+    path.write_text(
+        json.dumps(
+            [
+                dict(name="mystery", filter=[dict(genre=["ミステリ", "推理"])]),
+                dict(name="all", random_hours=[9], today=False),
+            ]
+        )
+    )
+    feeds = load_feeds(path)
+    books = [dict(isbn="1", genre="ミステリ"), dict(isbn="2", genre="SF")]
+    groups = split_by_feed(books, feeds)
+    assert ["1"] == [b["isbn"] for b in groups["mystery"]]
+    assert ["1", "2"] == [b["isbn"] for b in groups["all"]]
+    assert feeds[1].is_due("random", 9) and not feeds[1].is_due("random", 10)
+    assert not feeds[1].is_due("today", 9)
+    assert feeds[0].is_due("random", 10)
+
+
+def test_post_url(monkeypatch):
+    monkeypatch.setenv("MYSTERY_POST_URL", "https://example.com/hook")
+    assert (
+        "https://example.com/hook"
+        == Feed("m", post_url_env="MYSTERY_POST_URL").post_url
+    )
+    assert "https://a/hook" == Feed("m", post_url="https://a/hook").post_url
+    monkeypatch.delenv("MISSING_POST_URL", raising=False)
+    assert Feed("m", post_url_env="MISSING_POST_URL").post_url is None
@@ -0,0 +1,162 @@
+from datetime import date
+from types import SimpleNamespace
+
+import pandas as pd
+
+import main
+from fake_mongo import FakeCollection
+from feeds import Feed
+from post_queue import PostQueue
+from posted_store import PostedStore
+
+
+def make_books(isbns):
+    return pd.DataFrame(
+        dict(
+            isbn=isbns,
+            publish_date=["2099-01-01"] * len(isbns),
+            title=[f"本{i}" for i in isbns],
+            author_full=["著者"] * len(isbns),
+            genre=["SF"] * len(isbns),
+            publisher=["出版社"] * len(isbns),
+            description=["説明"] * len(isbns),
+            link=["https://example.com"] * len(isbns),
+        )
+    )
+
+
+class Request:
+    def __init__(self, data):
+        self.data = data
+
+    def get_json(self):
+        return self.data
+
+
+def use_fake_mongo(monkeypatch):
+    stores, queues = {}, {}
+    monkeypatch.setattr(
+        main,
+        "get_posted_store",
+        lambda name: stores.setdefault(name, PostedStore(FakeCollection())),
+    )
+    monkeypatch.setattr(
+        main,
+        "get_post_queue",
+        lambda name: queues.setdefault(name, PostQueue(FakeCollection())),
+    )
+    return stores, queues
+
+
+def test_get_random_book(monkeypatch):
+    stores, queues = use_fake_mongo(monkeypatch)
+    monkeypatch.setattr(main, "fetch_new_books", lambda s, e: make_books(["1", "2"]))
+    feed = Feed("sf", filter=[dict(genre="SF")])
+    dry_run = main.get_random_book_posts([feed], enable_update=False)
+    assert 0 == len(queues["post_queue_sf"].collection.documents)
+    first = main.get_random_book_posts([feed], enable_update=True)
+    assert dry_run == first
+    second = main.get_random_book_posts([feed], enable_update=True)
+    assert "本1" in first[0][1] + second[0][1]
+    assert "本2" in first[0][1] + second[0][1]
+    assert [(feed, "")] == main.get_random_book_posts([feed], enable_update=True)
+    assert 2 == len(stores["new_books_sf"].collection.documents)
+    # 2冊分と、完了の印
+    assert 3 == len(queues["post_queue_sf"].collection.documents)
+
+
+def test_get_random_book_skips_posted(monkeypatch):
+    stores, queues = use_fake_mongo(monkeypatch)
+    today = date(2025, 1, 1)
+    feed = Feed("sf")
+    books = make_books(["1", "2"]).to_dict(orient="records")
+    main.get_post_queue(feed.queue_collection).build(today, books)
+    main.get_posted_store(feed.posted_collection).mark_posted(books[0])
+    assert "2" == main.get_random_book(feed, None, today)["isbn"]
+    assert main.get_random_book(feed, None, today) is None
+
+
+def test_run_request_fans_out(monkeypatch, tmp_path):
+    use_fake_mongo(monkeypatch)
+    token = tmp_path / "token"
+    token.write_text("secret")
+    monkeypatch.setenv("SECRET_TOKEN_PATH", str(token))
+    books = make_books(["1", "2", "3"])
+    books["genre"] = ["SF", "ミステリ", "一般"]
+    calls = []
+    monkeypatch.setattr(main, "fetch_new_books", lambda s, e: calls.append(s) or books)
+    monkeypatch.setattr(
+        main,
+        "feeds",
+        [
+            Feed("sf", filter=[dict(genre="SF")], post_url="https://sf/hook"),
+            Feed("mystery", filter=[dict(genre="ミステリ")], post_url="https://m/hook"),
+            Feed("later", post_url="https://later/hook", random_hours=[]),
+        ],
+    )
+    posts = []
+
+    def post(url, headers, json):
+        posts.append((url, json))
+        return SimpleNamespace(content=b"ok")
+
+    monkeypatch.setattr(main.requests, "post", post)
+    assert "OK" == main.run_request(Request(dict(mode="random")))
+    assert 1 == len(calls)
+    assert ["https://sf/hook", "https://m/hook"] == [url for url, _ in posts]
+    assert "本1" in posts[0][1]["content"] and "本2" in posts[1][1]["content"]
+
+
+def test_run_request_isolates_feed_failures(monkeypatch, tmp_path):
+    stores, queues = use_fake_mongo(monkeypatch)
+    token = tmp_path / "token"
+    token.write_text("secret")
+    monkeypatch.setenv("SECRET_TOKEN_PATH", str(token))
+    monkeypatch.delenv("MISSING_POST_URL", raising=False)
+    monkeypatch.setattr(main, "fetch_new_books", lambda s, e: make_books(["1"]))
+    monkeypatch.setattr(
+        main,
+        "feeds",
+        [
+            Feed("missing", post_url_env="MISSING_POST_URL"),
+            Feed("broken", post_url="https://broken/hook"),
+            Feed("ok", post_url="https://ok/hook"),
+        ],
+    )
+    posts = []
+
+    def post(url, headers, json):
+        if url == "https://broken/hook":
+            raise main.requests.ConnectionError("connection refused")
+        posts.append(url)
+        return SimpleNamespace(content=b"ok")
+
+    monkeypatch.setattr(main.requests, "post", post)
+    assert "OK" == main.run_request(Request(dict(mode="random")))
+    assert ["https://ok/hook"] == posts
+    # フックURLのないフィードからは書籍を取り出さない
+    assert "post_queue_missing" not in queues
+    assert "new_books_missing" not in stores
+    assert 1 == len(stores["new_books_ok"].collection.documents)
+
+
+def test_load_candidates_snapshot(monkeypatch, tmp_path):
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path))
+    calls = []
+
+    def fetch_new_books(start, end):
+        calls.append((start, end))
+        df = make_books(["1", "2"])
+        df.loc[0, "publish_date"] = start.isoformat()
+        df.loc[1, "description"] = None
+        return df
+
+    monkeypatch.setattr(main, "fetch_new_books", fetch_new_books)
+    monkeypatch.setattr(main, "get_today", lambda: date(2025, 1, 1))
+    first = main.load_candidates(date(2025, 1, 1), "bucket")
+    second = main.load_candidates(date(2025, 1, 1), "bucket")
+    assert [(date(2025, 1, 1), date(2025, 3, 2))] == calls
+    assert list(first.columns) == list(second.columns)
+    assert pd.isna(second["description"][1])
+    [(_, post)] = main.get_todays_book_posts([Feed("all")], "bucket")
+    assert "本1" in post and "本2" not in post
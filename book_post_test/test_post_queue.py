@@ -0,0 +1,69 @@
+from datetime import date
+
+from fake_mongo import FakeCollection
+from post_queue import PostQueue, weight, weighted_shuffle
+
+
+def test_weighted_shuffle_is_repeatable():
+    books = [dict(isbn=str(i), genre="SF", publisher="出版社") for i in range(20)]
+    first = weighted_shuffle(books, {}, seed="2025-01-01")
+    assert first == weighted_shuffle(books, {}, seed="2025-01-01")
+    assert sorted(b["isbn"] for b in first) == sorted(b["isbn"] for b in books)
+    assert first != weighted_shuffle(books, {}, seed="2025-01-02")
+
+
+def test_weighted_shuffle_weights():
+    weights = {"genre": {"SF": 100.0, "ミステリー": 0}, "publisher": {"A": 2.0}}
+    assert 200.0 == weight(dict(genre="SF", publisher="A"), weights)
+    books = [dict(isbn=str(i), genre="一般", publisher="B") for i in range(10)]
+    books.append(dict(isbn="sf", genre="SF", publisher="B"))
+    books.append(dict(isbn="mystery", genre="ミステリー", publisher="B"))
+    shuffled = weighted_shuffle(books, weights, seed="2025-01-01")
+    assert "sf" == shuffled[0]["isbn"]
+    assert "mystery" not in [b["isbn"] for b in shuffled]
+
+
+def test_claim_in_order():
+    queue = PostQueue(FakeCollection())
+    today = date(2025, 1, 1)
+    assert not queue.exists(today)
+    assert 2 == queue.build(today, [dict(isbn="2"), dict(isbn="1")])
+    assert queue.exists(today)
+    assert "2" == queue.peek(today)["isbn"]
+    assert "2" == queue.claim(today)["isbn"]
+    assert "1" == queue.claim(today)["isbn"]
+    assert queue.claim(today) is None
+    assert queue.peek(today) is None
+    assert queue.claim(date(2025, 1, 2)) is None
+
+
+def test_build_twice_on_same_day():
+    queue = PostQueue(FakeCollection())
+    today = date(2025, 1, 1)
+    books = [dict(isbn="1"), dict(isbn="2"), dict(isbn="3")]
+    # 途中で失敗した保存の続きを、同時に実行された別の保存が完了させる
+    queue.collection.insert_many(
+        [
+            dict(
+                date=today.isoformat(),
+                position=0,
+                isbn="1",
+                book=books[0],
+                claimed=False,
+            )
+        ]
+    )
+    assert not queue.exists(today)
+    assert 2 == queue.build(today, books)
+    assert 0 == queue.build(today, books)
+    assert queue.exists(today)
+    assert ["1", "2", "3"] == [queue.claim(today)["isbn"] for _ in range(3)]
+    assert queue.claim(today) is None
+
+
+def test_build_empty_day():
+    queue = PostQueue(FakeCollection())
+    today = date(2025, 1, 1)
+    assert 0 == queue.build(today, [])
+    assert queue.exists(today)
+    assert queue.claim(today) is None
@@ -0,0 +1,43 @@
+from datetime import date
+
+from fake_mongo import FakeCollection
+from posted_store import PostedStore
+
+
+def book(isbn, publish_date):
+    return dict(isbn=isbn, publish_date=publish_date, title=f"本{isbn}", genre="SF")
+
+
+def test_posted_store():
+    collection = FakeCollection()
+    store = PostedStore(collection)
+    store.ensure_indexes()
+    assert ("isbn", {"unique": True}) in collection.indexes
+    assert store.mark_posted(book("1", "2025-01-01"))
+    assert not store.mark_posted(book("1", "2025-01-01"))
+    assert store.mark_posted(book("2", "2025-01-03"))
+    assert {"1"} == store.posted_isbns(["1", "3"])
+    assert "expire_at" in collection.documents[0]
+    assert 1 == store.expire(date(2025, 1, 2))
+    assert set() == store.posted_isbns(["1"])
+    assert {"2"} == store.posted_isbns(["2"])
+
+
+def test_ensure_indexes_removes_duplicates():
+    # ユニークインデックスがなかった頃に、同じISBNが二重に記録されている
+    collection = FakeCollection(
+        [
+            dict(isbn="1", publish_date="2025-01-01", title="本1"),
+            dict(isbn="2", publish_date="2025-01-01", title="本2"),
+            dict(isbn="1", publish_date="2025-01-01", title="本1"),
+            dict(isbn="1", publish_date="2025-01-01", title="本1"),
+        ]
+    )
+    store = PostedStore(collection)
+    store.ensure_indexes()
+    assert ("isbn", {"unique": True}) in collection.indexes
+    assert [1, 2] == [d["_id"] for d in collection.documents]
+    # 2回目以降は何もしない
+    store.ensure_indexes()
+    assert 2 == len(collection.documents)
+    assert not store.mark_posted(book("1", "2025-01-01"))
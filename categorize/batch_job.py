@@ -0,0 +1,157 @@
+"""
+OpenAIのBatch APIで大量の書籍をまとめて分類するためのモジュール。
+
+リクエストをJSONLにまとめて1つのバッチジョブとして送り、完了後に結果をまとめて受け取ります。
+環境変数BATCH_BACKEND_DIRを指定すると、OpenAIの代わりにローカルのディレクトリを使う
+スタンドインで動作し、ネットワークに接続せずに一連の流れを確認できます。
+"""
+
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+import json
+import os
+import re
+import uuid
+
+
+ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+# 結果を取り出せる状態。expiredでも完了した分の結果は取得できる
+DONE_STATUSES = {"completed", "expired"}
+FAILED_STATUSES = {"failed", "cancelled"}
+
+
+def request_line(custom_id: str, body: Dict) -> Dict:
+    """Batch APIの入力ファイルの1行を作る関数。
+
+    :param str custom_id: 結果と対応づけるためのID
+    :param dict body: chat.completions.createに渡す引数
+    :return: 入力ファイルの1行分の辞書
+    :rtype: dict
+    """
+    return {"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": body}
+
+
+def response_content(line: Dict) -> Optional[str]:
+    """Batch APIの出力ファイルの1行から、モデルの応答を取り出す関数。
+
+    :param dict line: 出力ファイルの1行分の辞書
+    :return: 応答のテキスト。エラーの場合はNone
+    """
+    response = line.get("response")
+    if line.get("error") or not response or response.get("status_code") != 200:
+        return None
+    return response["body"]["choices"][0]["message"]["content"]
+
+
+class OpenAIBatchBackend:
+    """OpenAIのBatch APIを使うバックエンド。
+
+    :param client: OpenAIのクライアント
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, lines: List[Dict]) -> str:
+        """入力ファイルをアップロードしてバッチジョブを作成する関数。
+
+        :param lines: request_lineで作った入力の各行
+        :return: バッチID
+        :rtype: str
+        """
+        data = "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines)
+        input_file = self.client.files.create(
+            file=("batch.jsonl", data.encode("utf-8")), purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=ENDPOINT,
+            completion_window=COMPLETION_WINDOW,
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        """バッチジョブの状態を返す関数。
+
+        :param str batch_id: バッチID
+        :return: validating, in_progress, completed, failedなどの状態
+        :rtype: str
+        """
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> Iterator[Dict]:
+        """バッチジョブの出力ファイルを1行ずつ返す関数。
+
+        :param str batch_id: バッチID
+        :yield: 出力ファイルの1行分の辞書
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        if not batch.output_file_id:
+            return
+        text = self.client.files.content(batch.output_file_id).text
+        for line in text.splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def default_responder(body: Dict) -> str:
+    """ローカルのスタンドインで、すべての書籍を「その他」に分類した応答を返す関数。"""
+    prompt = body["messages"][-1]["content"]
+    numbers = re.findall(r"^(\d+)\. ", prompt, flags=re.MULTILINE)
+    items = [{"number": int(n), "genre": "その他"} for n in numbers]
+    return json.dumps({"items": items}, ensure_ascii=False)
+
+
+class LocalBatchBackend:
+    """ローカルのディレクトリをBatch APIの代わりに使うバックエンド。
+
+    状態を初めて確認した時点で、responderで全リクエストの応答を作ってジョブを完了させます。
+
+    :param str root: ジョブを保存するディレクトリ
+    :param responder: リクエストのbodyを受け取り、応答のテキストを返す関数
+    """
+
+    def __init__(self, root: str, responder: Callable[[Dict], str] = default_responder):
+        self.root = Path(root)
+        self.responder = responder
+
+    def submit(self, lines: List[Dict]) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex}"
+        job_dir = self.root / batch_id
+        job_dir.mkdir(parents=True)
+        with (job_dir / "input.jsonl").open("w", encoding="utf-8") as fp:
+            for line in lines:
+                fp.write(json.dumps(line, ensure_ascii=False) + "\n")
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        job_dir = self.root / batch_id
+        output = job_dir / "output.jsonl"
+        if not output.exists():
+            tmp = job_dir / "output.jsonl.tmp"
+            with (job_dir / "input.jsonl").open(encoding="utf-8") as src, tmp.open(
+                "w", encoding="utf-8"
+            ) as dst:
+                for line in src:
+                    request = json.loads(line)
+                    content = self.responder(request["body"])
+                    response = {
+                        "status_code": 200,
+                        "body": {"choices": [{"message": {"content": content}}]},
+                    }
+                    result = dict(
+                        custom_id=request["custom_id"], response=response, error=None
+                    )
+                    dst.write(json.dumps(result, ensure_ascii=False) + "\n")
+            os.replace(tmp, output)
+        return "completed"
+
+    def results(self, batch_id: str) -> Iterator[Dict]:
+        output = self.root / batch_id / "output.jsonl"
+        if not output.exists():
+            return
+        with output.open(encoding="utf-8") as fp:
+            for line in fp:
+                if line.strip():
+                    yield json.loads(line)
@@ -0,0 +1,292 @@
+"""
+GCSへの読み書きを行うモジュール。
+
+JSONLのレコードをgzip圧縮しながらGCSのresumable uploadに直接書き込みます。
+一時ファイルを経由せず、メモリ上のバッファもチャンクサイズ分に抑えられます。
+環境変数LOCAL_STORAGE_DIRを指定すると、GCSの代わりにローカルのディレクトリを使います。
+google.cloud.storageは、GCSに初めてアクセスする時点で読み込みます。
+"""
+
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+import gzip
+import hashlib
+import json
+import os
+
+from startup import timed
+
+
+# resumable uploadのチャンクサイズ。256KBの倍数である必要がある
+CHUNK_SIZE = int(os.environ.get("GCS_CHUNK_SIZE", str(1024 * 1024)))
+storage_client = None
+
+
+def get_storage_client():
+    """GCSのクライアントを取得する関数。初回呼び出し時に作成する。
+
+    :return: 共有のクライアント
+    :rtype: google.cloud.storage.Client
+    """
+    global storage_client
+    if storage_client is None:
+        with timed("import:google.cloud.storage"):
+            from google.cloud import storage
+        with timed("client:storage"):
+            storage_client = storage.Client(project=os.environ["PROJECT_NAME"])
+    return storage_client
+
+
+class GCSStorage:
+    """GCSのバケットを読み書きするバックエンド。
+
+    :param str bucket_name: GCSバケット名
+    """
+
+    def __init__(self, bucket_name: str):
+        self.bucket_name = bucket_name
+
+    def blob(self, path: str):
+        # get_bucketはメタデータを取得するAPI呼び出しになるので、bucketで参照だけ作る
+        return get_storage_client().bucket(self.bucket_name).blob(path)
+
+    def open_write(self, path: str, content_encoding: Optional[str] = "gzip"):
+        """データを書き込むためのファイルオブジェクトを開く関数。
+
+        :param str path: バケット内のパス
+        :param content_encoding: オブジェクトに設定するContent-Encoding
+        :return: 書き込み用のファイルオブジェクト
+        """
+        blob = self.blob(path)
+        blob.content_encoding = content_encoding
+        return blob.open("wb", chunk_size=CHUNK_SIZE, ignore_flush=True)
+
+    def abort(self, fileobj):
+        """書き込みを中断する関数。
+
+        BlobWriterはガベージコレクションの際にcloseされ、そこでアップロードが確定してしまうため、
+        terminateでresumable uploadを取り消してから閉じます。
+
+        :param fileobj: open_writeで開いたファイルオブジェクト
+        """
+        fileobj.terminate()
+
+    def open_read(self, path: str):
+        """gzip圧縮されたままのデータを少しずつ読み込むファイルオブジェクトを開く関数。
+
+        :param str path: バケット内のパス
+        :return: 読み込み用のファイルオブジェクト。ファイルが存在しない場合はNone
+        """
+        from google.api_core.exceptions import NotFound
+
+        blob = self.blob(path)
+        try:
+            blob.reload()
+        except NotFound:
+            return None
+        return blob.open("rb", chunk_size=CHUNK_SIZE, raw_download=True)
+
+    def read_text(self, path: str) -> str:
+        """ファイルをダウンロードしてテキストとして返す関数。
+
+        :param str path: バケット内のパス
+        :return: ファイルの内容。ファイルが存在しない場合は空文字列
+        :rtype: str
+        """
+        from google.api_core.exceptions import NotFound
+
+        blob = self.blob(path)
+        blob.content_encoding = "gzip"
+        try:
+            return blob.download_as_text()
+        except NotFound:
+            return ""
+
+
+class LocalStorage:
+    """ローカルのディレクトリをGCSのバケットの代わりに使うバックエンド。
+
+    :param str root: 保存先のルートディレクトリ
+    :param str bucket_name: バケット名。root以下のディレクトリ名として使う
+    """
+
+    def __init__(self, root: str, bucket_name: str):
+        self.root = Path(root) / bucket_name
+
+    def open_write(self, path: str, content_encoding: Optional[str] = "gzip"):
+        """書き込み用のファイルを開く関数。closeした時点で指定のパスに移動する。
+
+        :param str path: バケット内のパス
+        :param content_encoding: ローカルでは使わない（GCSStorageとの互換のため）
+        :return: 書き込み用のファイルオブジェクト
+        """
+        target = self.root / path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        return _AtomicFile(target)
+
+    def abort(self, fileobj):
+        """書き込みを中断し、書きかけのファイルを削除する関数。
+
+        :param fileobj: open_writeで開いたファイルオブジェクト
+        """
+        fileobj.discard()
+
+    def open_read(self, path: str):
+        """gzip圧縮されたファイルを読み込むファイルオブジェクトを開く関数。
+
+        :param str path: バケット内のパス
+        :return: 読み込み用のファイルオブジェクト。ファイルが存在しない場合はNone
+        """
+        target = self.root / path
+        if not target.exists():
+            return None
+        return target.open("rb")
+
+    def read_text(self, path: str) -> str:
+        """gzip圧縮されたファイルを展開してテキストとして返す関数。
+
+        :param str path: バケット内のパス
+        :return: ファイルの内容。ファイルが存在しない場合は空文字列
+        :rtype: str
+        """
+        target = self.root / path
+        if not target.exists():
+            return ""
+        with gzip.open(target, "rt", encoding="utf-8") as f:
+            return f.read()
+
+
+class _AtomicFile:
+    """一時ファイルに書き込み、closeした時点で本来のパスに移動するファイル。"""
+
+    def __init__(self, target: Path):
+        self.target = target
+        self.tmp = target.with_name(target.name + ".tmp")
+        self.fp = self.tmp.open("wb")
+
+    def write(self, data: bytes) -> int:
+        return self.fp.write(data)
+
+    def flush(self):
+        self.fp.flush()
+
+    def close(self):
+        self.fp.close()
+        os.replace(self.tmp, self.target)
+
+    def discard(self):
+        self.fp.close()
+        self.tmp.unlink()
+
+
+def get_storage(bucket_name: str):
+    """バケット名に対応するストレージのバックエンドを返す関数。
+
+    :param str bucket_name: GCSバケット名
+    :return: LOCAL_STORAGE_DIRが設定されていればLocalStorage、そうでなければGCSStorage
+    """
+    local_dir = os.environ.get("LOCAL_STORAGE_DIR")
+    if local_dir:
+        return LocalStorage(local_dir, bucket_name)
+    return GCSStorage(bucket_name)
+
+
+def iter_jsonl(storage, path: str) -> Iterator[Dict]:
+    """gzip圧縮されたJSONLファイルを少しずつ読み込み、1行ずつ辞書として返す関数。
+
+    ファイル全体をメモリに載せずに読み込みます。
+
+    :param storage: 読み込み元のバックエンド
+    :param str path: バケット内のパス
+    :yield: 各行の辞書。ファイルが存在しない場合は何も返さない
+    """
+    raw = storage.open_read(path)
+    if raw is None:
+        return
+    with raw, gzip.GzipFile(fileobj=raw, mode="rb") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class GzipWriter:
+    """データをgzip圧縮しながらストレージに書き込むライター。
+
+    最初の書き込みまでアップロードを開始しないため、何も書き込まなければファイルは作成されません。
+    withブロック内で例外が発生した場合は書き込みを中断し、書きかけのファイルを残しません。
+
+    :param storage: 書き込み先のバックエンド
+    :param str path: バケット内のパス
+    """
+
+    def __init__(self, storage, path: str):
+        self.storage = storage
+        self.path = path
+        self.sink = None
+        self.gzip_file: Optional[gzip.GzipFile] = None
+
+    def write(self, data: bytes):
+        """データを書き込む関数。
+
+        :param bytes data: 書き込むデータ
+        """
+        if self.gzip_file is None:
+            self.sink = self.storage.open_write(self.path)
+            self.gzip_file = gzip.GzipFile(fileobj=self.sink, mode="wb")
+        self.gzip_file.write(data)
+
+    def close(self):
+        """書き込みを確定する関数。"""
+        if self.gzip_file is not None:
+            self.gzip_file.close()
+            self.sink.close()
+            self.gzip_file = None
+
+    def abort(self):
+        """書き込みを中断する関数。"""
+        if self.gzip_file is not None:
+            self.storage.abort(self.sink)
+            # GzipFileもcloseの際に終端を書き込むので、書き込み先を外しておく
+            self.gzip_file.fileobj = None
+            self.gzip_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class JsonlGzipWriter(GzipWriter):
+    """辞書を1行ずつJSONLとしてgzip圧縮しながら書き込むライター。
+
+    書き込んだ内容（圧縮前）のSHA-256ハッシュも計算します。
+    storageにNoneを渡すと、件数とハッシュ値の計算だけを行います。
+    """
+
+    def __init__(self, storage, path: str):
+        super().__init__(storage, path)
+        self.count = 0
+        self.sha256 = hashlib.sha256()
+
+    def write_record(self, record: Dict):
+        """レコードを1行書き込む関数。
+
+        :param dict record: 書き込むレコード
+        """
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        self.sha256.update(line)
+        if self.storage is not None:
+            self.write(line)
+        self.count += 1
+
+    def hexdigest(self) -> str:
+        """これまでに書き込んだ内容のハッシュ値を返す関数。
+
+        :return: SHA-256の16進数文字列
+        :rtype: str
+        """
+        return self.sha256.hexdigest()
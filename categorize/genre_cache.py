@@ -0,0 +1,113 @@
+"""
+分類済みのジャンルをISBNごとにキャッシュするモジュール。
+
+キーはISBNと、タイトル・説明・レーベルから計算したハッシュ値の組です。
+書籍の内容が変わらない限り、同じISBNをもう一度OpenAI APIに送らないようにします。
+キャッシュはgzip圧縮したJSONとしてGCSに保存し、1回の実行につき1度だけ読み込みます。
+"""
+
+from typing import Dict, Optional
+import hashlib
+import json
+import os
+import time
+
+
+CACHE_PATH = "categorize_cache/genres.json.gz"
+# ジャンルの一覧やモデルを変えたときは、バージョンを上げてキャッシュを作り直す
+CACHE_VERSION = 1
+DAY = 24 * 60 * 60
+DEFAULT_TTL = float(os.environ.get("GENRE_CACHE_TTL_DAYS", "365")) * DAY
+
+
+def _text(value) -> str:
+    # BigQueryやpandasから来る欠損値(None, NaN)は空文字列として扱う
+    return value if isinstance(value, str) else ""
+
+
+def content_hash(title, description, label) -> str:
+    """分類に使う項目からハッシュ値を計算する関数。
+
+    :param title: タイトル
+    :param description: 書籍の説明
+    :param label: レーベル
+    :return: SHA-256の16進数文字列の先頭16文字
+    :rtype: str
+    """
+    data = json.dumps([_text(title), _text(description), _text(label)])
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+
+class GenreCache:
+    """ISBNをキーとして、内容のハッシュ値とジャンルを保持するキャッシュ。
+
+    :param entries: ISBNをキー、[ハッシュ値, ジャンル, 保存時刻]を値とする辞書
+    :param float ttl: エントリーの有効期間（秒）
+    """
+
+    def __init__(self, entries: Dict = None, ttl: float = DEFAULT_TTL):
+        self.entries = entries or {}
+        self.ttl = ttl
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, isbn: str, digest: str, now: float = None) -> Optional[str]:
+        """キャッシュからジャンルを取得する関数。
+
+        :param str isbn: ISBN
+        :param str digest: content_hashで計算したハッシュ値
+        :return: ジャンル。キャッシュにない場合や内容が変わった場合はNone
+        """
+        now = time.time() if now is None else now
+        entry = self.entries.get(isbn)
+        if entry is None or entry[0] != digest or now - entry[2] >= self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def put(self, isbn: str, digest: str, genre: str, now: float = None):
+        """キャッシュにジャンルを保存する関数。
+
+        :param str isbn: ISBN
+        :param str digest: content_hashで計算したハッシュ値
+        :param str genre: 分類したジャンル
+        """
+        now = time.time() if now is None else now
+        self.entries[isbn] = [digest, genre, now]
+        self.dirty = True
+
+    def dumps(self) -> str:
+        """期限切れのエントリーを除いてJSON文字列に変換する関数。
+
+        :return: JSON文字列
+        :rtype: str
+        """
+        now = time.time()
+        entries = {k: v for k, v in self.entries.items() if now - v[2] < self.ttl}
+        return json.dumps(
+            dict(version=CACHE_VERSION, entries=entries),
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def loads(cls, text: str, **kwargs) -> "GenreCache":
+        """JSON文字列からキャッシュを復元する関数。
+
+        空文字列やバージョンが異なる場合は空のキャッシュを返します。
+
+        :param str text: dumpsで作成したJSON文字列
+        :return: 復元したキャッシュ
+        :rtype: GenreCache
+        """
+        if not text:
+            return cls(**kwargs)
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            return cls(**kwargs)
+        if data.get("version") != CACHE_VERSION:
+            return cls(**kwargs)
+        return cls(data["entries"], **kwargs)
@@ -0,0 +1,322 @@
+"""
+OpenAI APIでの分類を並列に実行するモジュール。
+
+書籍ごとのプロンプトのトークン数を見積もってバッチを作り、
+1分あたりのリクエスト数・トークン数の上限を守りながら、複数のバッチを同時に送ります。
+レート制限のエラーが返ってきた場合は、すべてのワーカーをしばらく止めてから再試行します。
+タイムアウトやサーバーエラーなど一時的なエラーも再試行し、続く場合はそのバッチを失敗として扱います。
+結果の件数が合わないなど不正な応答だったバッチは、半分に分けて1件になるまで送り直します。
+"""
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+import os
+import random
+import threading
+import time
+
+import pandas as pd
+
+from metering import BudgetExceeded
+from prompt import DESCRIPTION_TOKENS
+
+
+DEFAULT_WORKERS = int(os.environ.get("CATEGORIZE_WORKERS", "4"))
+DEFAULT_RPM = float(os.environ.get("OPENAI_RPM", "500"))
+DEFAULT_TPM = float(os.environ.get("OPENAI_TPM", "200000"))
+# 1バッチのプロンプトの見積もりトークン数と件数の上限
+DEFAULT_BATCH_TOKENS = int(os.environ.get("CATEGORIZE_BATCH_TOKENS", "3000"))
+DEFAULT_BATCH_ITEMS = int(os.environ.get("CATEGORIZE_BATCH_ITEMS", "10"))
+DEFAULT_RETRIES = int(os.environ.get("CATEGORIZE_RETRIES", "5"))
+DEFAULT_BACKOFF = float(os.environ.get("CATEGORIZE_BACKOFF", "2"))
+# 不正な応答だったバッチを分割して送り直すリクエスト数の、1回の実行あたりの上限
+DEFAULT_RETRY_BUDGET = int(os.environ.get("CATEGORIZE_RETRY_BUDGET", "100"))
+# システムプロンプトとJSONスキーマの分、1件あたりの出力の分の見積もり
+PROMPT_OVERHEAD_TOKENS = 400
+COMPLETION_TOKENS_PER_ITEM = 20
+
+
+class RateLimiter:
+    """1分あたりのリクエスト数とトークン数を制限する、スレッドセーフなリミッター。
+
+    :param float rpm: 1分あたりのリクエスト数の上限
+    :param float tpm: 1分あたりのトークン数の上限
+    """
+
+    def __init__(self, rpm: float = DEFAULT_RPM, tpm: float = DEFAULT_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        """リクエスト1回分とtokens分の枠を取得する。枠がなければ補充されるまで待機する。
+
+        :param int tokens: リクエストで使う見積もりトークン数
+        """
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                elapsed = now - self.updated_at
+                self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+                self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+                self.updated_at = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.requests >= 1 and self.tokens >= tokens:
+                        self.requests -= 1
+                        self.tokens -= tokens
+                        return
+                    wait = max(
+                        (1 - self.requests) * 60 / self.rpm,
+                        (tokens - self.tokens) * 60 / self.tpm,
+                    )
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """すべての呼び出し元をseconds秒間待たせる関数。
+
+        :param float seconds: 待たせる秒数
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def estimate_tokens(df: pd.DataFrame) -> pd.Series:
+    """書籍ごとのプロンプトのトークン数を見積もる関数。
+
+    日本語は1文字がおおよそ1トークン以下になるため、文字数を上限の見積もりとして使います。
+
+    :param df: 分類する書籍のDataFrame
+    :return: 書籍ごとの見積もりトークン数
+    :rtype: pandas.Series
+    """
+    chars = 0
+    for column in ("authors", "title", "publisher", "label"):
+        chars = chars + df[column].fillna("").astype(str).str.len()
+    description = df["description"].fillna("").astype(str).str.len()
+    return chars + description.clip(upper=DESCRIPTION_TOKENS) + 10
+
+
+def make_batches(
+    tokens: List[int],
+    max_tokens: int = DEFAULT_BATCH_TOKENS,
+    max_items: int = DEFAULT_BATCH_ITEMS,
+) -> List[List[int]]:
+    """見積もりトークン数が上限を超えないように、書籍を先頭から順にバッチに分ける関数。
+
+    :param tokens: 書籍ごとの見積もりトークン数
+    :param int max_tokens: 1バッチのトークン数の上限
+    :param int max_items: 1バッチの件数の上限
+    :return: バッチごとの位置のリスト
+    :rtype: list
+    """
+    batches = []
+    current = []
+    total = 0
+    for i, t in enumerate(tokens):
+        if current and (total + t > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current = []
+            total = 0
+        current.append(i)
+        total += t
+    if current:
+        batches.append(current)
+    return batches
+
+
+def estimate_request(target: pd.DataFrame) -> Tuple[int, int]:
+    """1バッチのリクエストのプロンプトと出力のトークン数を見積もる関数。
+
+    :param target: バッチのDataFrame
+    :return: (プロンプトのトークン数, 出力のトークン数)
+    :rtype: tuple
+    """
+    prompt_tokens = int(estimate_tokens(target).sum()) + PROMPT_OVERHEAD_TOKENS
+    return prompt_tokens, COMPLETION_TOKENS_PER_ITEM * len(target)
+
+
+def is_rate_limit(e: Exception) -> bool:
+    """例外がレート制限によるものかどうかを判定する関数。"""
+    return (
+        getattr(e, "status_code", None) == 429 or type(e).__name__ == "RateLimitError"
+    )
+
+
+# タイムアウトや接続エラーなど、送り直せば成功しうるAPIのエラー（openaiの例外クラス名）
+TRANSIENT_ERRORS = {"APITimeoutError", "APIConnectionError", "InternalServerError"}
+TRANSIENT_STATUS = {408, 409, 500, 502, 503, 504}
+
+
+def is_transient(e: Exception) -> bool:
+    """例外が一時的なAPIのエラーかどうかを判定する関数。"""
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    if getattr(e, "status_code", None) in TRANSIENT_STATUS:
+        return True
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(e).__mro__)
+
+
+class ClassificationEngine:
+    """バッチを並列に分類するエンジン。
+
+    :param classify: バッチのDataFrameを受け取り、APIの結果を返す関数（do_openai_api）
+    :param check: APIの結果とバッチを受け取り、ジャンルのリストを返す関数（check_result）
+    :param limiter: リクエスト数・トークン数のリミッター
+    :param int workers: 同時に送るリクエスト数
+    :param int max_tokens: 1バッチのトークン数の上限
+    :param int max_items: 1バッチの件数の上限
+    :param int retries: レート制限や一時的なエラーの際の再試行回数
+    :param float backoff: 再試行の前に待つ秒数の基準値
+    :param int retry_budget: 不正な応答だったバッチを分割して送り直すリクエスト数の上限
+    """
+
+    def __init__(
+        self,
+        classify: Callable,
+        check: Callable,
+        limiter: Optional[RateLimiter] = None,
+        workers: int = DEFAULT_WORKERS,
+        max_tokens: int = DEFAULT_BATCH_TOKENS,
+        max_items: int = DEFAULT_BATCH_ITEMS,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        retry_budget: int = DEFAULT_RETRY_BUDGET,
+    ):
+        self.classify = classify
+        self.check = check
+        self.limiter = limiter or RateLimiter()
+        self.workers = workers
+        self.max_tokens = max_tokens
+        self.max_items = max_items
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_budget = retry_budget
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.stopped = False
+
+    @property
+    def requests(self) -> int:
+        return self.counts["requests"]
+
+    @property
+    def rate_limited(self) -> int:
+        return self.counts["rate_limited"]
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.counts[name] += n
+
+    def take_retries(self, n: int) -> bool:
+        """分割して送り直すためのリクエストをn回分、上限から確保する関数。
+
+        :param int n: 確保するリクエスト数
+        :return: 確保できた場合はTrue
+        :rtype: bool
+        """
+        with self.lock:
+            if self.retry_budget < n:
+                return False
+            self.retry_budget -= n
+            return True
+
+    def classify_once(self, target: pd.DataFrame) -> Optional[List[str]]:
+        """バッチを1回分類する関数。
+
+        レート制限やタイムアウトなど一時的なエラーの場合は、待ってから再試行します。
+        再試行しても失敗した場合は、不正な応答と同じく失敗として扱います。
+        それ以外の例外はそのまま送出します。
+
+        :param target: 分類するバッチ
+        :return: ジャンルのリスト。応答が不正な場合や、APIのエラーが続いた場合はNone
+        """
+        tokens = sum(estimate_request(target))
+        for attempt in range(self.retries + 1):
+            if self.stopped:
+                return None
+            self.limiter.acquire(tokens)
+            self.count("requests")
+            try:
+                raw_result = self.classify(target)
+            except BudgetExceeded as e:
+                print("budget exceeded", e)
+                self.stopped = True
+                return None
+            except Exception as e:
+                rate_limited = is_rate_limit(e)
+                if not rate_limited and not is_transient(e):
+                    raise
+                self.count("rate_limited" if rate_limited else "api_error")
+                if attempt == self.retries:
+                    print("giving up after", attempt + 1, "attempts:", repr(e))
+                    return None
+                wait = self.backoff * 2**attempt * (1 + random.random())
+                print(repr(e), "waiting", round(wait, 1), "seconds")
+                if rate_limited:
+                    self.limiter.pause(wait)
+                else:
+                    time.sleep(wait)
+                continue
+            if raw_result is None:
+                self.count("unparsable")
+                return None
+            try:
+                result = self.check(raw_result, target)
+            except AssertionError as e:
+                print(e)
+                self.count("mismatched")
+                return None
+            self.count("succeeded")
+            return result
+
+    def run_batch(
+        self, target: pd.DataFrame
+    ) -> List[Tuple[pd.DataFrame, Optional[List[str]]]]:
+        """1つのバッチを分類する関数。
+
+        応答が不正な場合はバッチを半分に分けて、それぞれを送り直します。
+        1件でも不正な場合や、送り直す上限に達した場合は、その書籍を諦めます。
+        トークン数・費用の上限に達した後は、残りのバッチを送らずに諦めます。
+
+        :param target: 分類するバッチ
+        :return: (バッチの一部, ジャンルのリストまたはNone)のリスト
+        :rtype: list
+        """
+        result = self.classify_once(target) if not self.stopped else None
+        if result is not None:
+            return [(target, result)]
+        if self.stopped:
+            self.count("budget_skipped", len(target))
+            return [(target, None)]
+        if len(target) == 1 or not self.take_retries(2):
+            self.count("dropped", len(target))
+            return [(target, None)]
+        self.count("split")
+        half = len(target) // 2
+        return self.run_batch(target.iloc[:half]) + self.run_batch(target.iloc[half:])
+
+    def run(self, df: pd.DataFrame) -> List[Tuple[pd.DataFrame, Optional[List[str]]]]:
+        """DataFrameをバッチに分けて並列に分類する関数。
+
+        :param df: 分類する書籍のDataFrame
+        :return: (バッチ, ジャンルのリストまたはNone)のリスト。バッチの順序は入力と同じ
+        :rtype: list
+        """
+        tokens = estimate_tokens(df).tolist()
+        batches = make_batches(tokens, self.max_tokens, self.max_items)
+        print("batches", len(batches), "items", len(df))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(self.run_batch, df.iloc[positions].copy())
+                for positions in batches
+            ]
+            results = [r for future in futures for r in future.result()]
+        print("classification", dict(self.counts))
+        return results
@@ -0,0 +1,303 @@
+"""
+OpenAI APIに送る前に、ジャンルが明らかな書籍をローカルで分類するモジュール。
+
+レーベル・出版社・キーワードのルール（rules.json）で決まる書籍はそのジャンルにし、
+残りは過去の分類結果で学習したナイーブベイズ分類器で判定します。
+確信度がしきい値未満の書籍だけをOpenAI APIに送ります。
+学習にはOpenAI APIで分類した書籍だけを使い、その結果と一致しないルールは使いません。
+"""
+
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import math
+import os
+import re
+
+
+RULES_PATH = Path(__file__).parent / "rules.json"
+MODEL_PATH = "categorize_model/local_model.json.gz"
+MODEL_VERSION = 1
+DEFAULT_THRESHOLD = float(os.environ.get("CATEGORIZE_LOCAL_THRESHOLD", "0.95"))
+# ルールを使い続けるのに必要な、OpenAI APIの結果との一致率と件数
+RULE_MIN_AGREEMENT = float(os.environ.get("CATEGORIZE_RULE_MIN_AGREEMENT", "0.9"))
+RULE_MIN_SUPPORT = 5
+# 学習に使う説明の文字数
+DESCRIPTION_CHARS = 300
+KEYWORD_SEPARATOR = re.compile(r"[;,、；，\s]+")
+
+
+def _text(value) -> str:
+    return value if isinstance(value, str) else ""
+
+
+def load_rules(path: Path = RULES_PATH) -> Dict:
+    with path.open(encoding="utf-8") as fp:
+        return json.load(fp)
+
+
+class RuleClassifier:
+    """レーベル、出版社、キーワードの対応表でジャンルを決める分類器。
+
+    レーベル、出版社、キーワードの順に確認し、最初に一致したジャンルを返します。
+
+    :param dict rules: label, publisher, keywordごとの{値: ジャンル}の辞書
+    :param disabled: 使わないルールのキー（"label:創元推理文庫"の形式）
+    """
+
+    def __init__(self, rules: Dict, disabled: Iterable[str] = ()):
+        self.label = rules.get("label", {})
+        self.publisher = rules.get("publisher", {})
+        self.keyword = rules.get("keyword", {})
+        self.disabled = set(disabled)
+
+    def matches(self, label, publisher, keywords) -> List[Tuple[str, str]]:
+        """一致するすべてのルールを(キー, ジャンル)のリストで返す関数。使わないルールも含む。"""
+        result = []
+        if _text(label) in self.label:
+            result.append(("label:" + label, self.label[label]))
+        if _text(publisher) in self.publisher:
+            result.append(("publisher:" + publisher, self.publisher[publisher]))
+        for keyword in KEYWORD_SEPARATOR.split(_text(keywords)):
+            if keyword in self.keyword:
+                result.append(("keyword:" + keyword, self.keyword[keyword]))
+        return result
+
+    def classify(self, label, publisher, keywords) -> Optional[str]:
+        for key, genre in self.matches(label, publisher, keywords):
+            if key not in self.disabled:
+                return genre
+        return None
+
+    def measure(self, rows: Iterable[Dict]) -> Dict[str, Dict]:
+        """正解のジャンル(genre)付きの書籍で、ルールごとの件数と一致件数を数える関数。
+
+        :param rows: genreを含む書籍の辞書
+        :return: {ルールのキー: {support: 件数, agreed: 一致件数}}の辞書
+        :rtype: dict
+        """
+        stats = defaultdict(Counter)
+        for row in rows:
+            for key, genre in self.matches(
+                row.get("label"), row.get("publisher"), row.get("keywords")
+            ):
+                stats[key]["support"] += 1
+                if genre == row["genre"]:
+                    stats[key]["agreed"] += 1
+        return {key: dict(c) for key, c in stats.items()}
+
+
+def gate_rules(
+    stats: Dict[str, Dict],
+    min_agreement: float = RULE_MIN_AGREEMENT,
+    min_support: int = RULE_MIN_SUPPORT,
+) -> List[str]:
+    """一致率がmin_agreement未満のルールのキーを返す関数。
+
+    件数がmin_support未満のルールは判断できないため、rules.jsonのまま使う。
+    ルールが有効な間はその書籍をOpenAI APIに送らないので、
+    一致率はキャッシュを使わないバックフィルの結果で測る。
+    """
+    return sorted(
+        key
+        for key, s in stats.items()
+        if s["support"] >= min_support
+        and s.get("agreed", 0) / s["support"] < min_agreement
+    )
+
+
+def features(title, description, label, publisher) -> List[str]:
+    """書籍の特徴量（文字bigramと、レーベル・出版社そのもの）を返す関数。"""
+    tokens = []
+    for text in (_text(title), _text(description)[:DESCRIPTION_CHARS]):
+        text = re.sub(r"\s+", "", text)
+        tokens.extend(text[i : i + 2] for i in range(len(text) - 1))
+    if _text(label):
+        tokens.append("label:" + label)
+    if _text(publisher):
+        tokens.append("publisher:" + publisher)
+    return tokens
+
+
+class NaiveBayes:
+    """多項分布のナイーブベイズ分類器。
+
+    :param classes: ジャンルのリスト
+    :param priors: ジャンルごとの事前確率の対数
+    :param tokens: {特徴量: ジャンルごとの尤度の対数}の辞書。学習データにない特徴量は無視する
+    """
+
+    def __init__(
+        self,
+        classes: List[str],
+        priors: List[float],
+        tokens: Dict[str, List[float]],
+    ):
+        self.classes = classes
+        self.priors = priors
+        self.tokens = tokens
+
+    @classmethod
+    def fit(
+        cls,
+        samples: Iterable[Tuple[List[str], str]],
+        alpha: float = 1.0,
+        min_count: int = 3,
+    ) -> "NaiveBayes":
+        """(特徴量, ジャンル)の組から学習する関数。
+
+        :param samples: (特徴量のリスト, ジャンル)の組
+        :param float alpha: スムージングの係数
+        :param int min_count: 使う特徴量の最小出現回数。モデルを小さく保つため
+        """
+        class_counts = Counter()
+        counts = defaultdict(Counter)
+        for tokens, genre in samples:
+            class_counts[genre] += 1
+            counts[genre].update(tokens)
+        total = Counter()
+        for c in counts.values():
+            total.update(c)
+        vocab = [t for t, n in total.items() if n >= min_count]
+        classes = sorted(class_counts)
+        n = sum(class_counts.values())
+        priors = [math.log(class_counts[c] / n) for c in classes]
+        denominators = {
+            c: sum(counts[c][t] for t in vocab) + alpha * len(vocab) for c in classes
+        }
+        tokens = {
+            t: [
+                round(math.log((counts[c][t] + alpha) / denominators[c]), 4)
+                for c in classes
+            ]
+            for t in vocab
+        }
+        return cls(classes, priors, tokens)
+
+    def predict(self, tokens: List[str]) -> Tuple[str, float]:
+        """最も確率の高いジャンルとその確率を返す関数。"""
+        scores = list(self.priors)
+        for token in tokens:
+            likelihood = self.tokens.get(token)
+            if likelihood is None:
+                continue
+            for i, value in enumerate(likelihood):
+                scores[i] += value
+        best = max(range(len(scores)), key=scores.__getitem__)
+        total = sum(math.exp(s - scores[best]) for s in scores)
+        return self.classes[best], 1 / total
+
+    def to_dict(self) -> Dict:
+        return dict(
+            classes=self.classes,
+            priors=self.priors,
+            tokens=self.tokens,
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "NaiveBayes":
+        return cls(data["classes"], data["priors"], data["tokens"])
+
+
+class LocalClassifier:
+    """ルールと学習済みモデルを組み合わせた分類器。
+
+    :param rules: ルールの分類器
+    :param model: 学習済みモデル。まだ学習していない場合はNone
+    :param float threshold: モデルの結果を採用する確率のしきい値
+    """
+
+    def __init__(
+        self,
+        rules: RuleClassifier,
+        model: Optional[NaiveBayes] = None,
+        threshold: float = DEFAULT_THRESHOLD,
+    ):
+        self.rules = rules
+        self.model = model
+        self.threshold = threshold
+        self.counts = Counter()
+
+    def classify_row(self, row: Dict) -> Tuple[Optional[str], Optional[str]]:
+        """1冊を分類する関数。
+
+        :param dict row: title, description, label, publisher, keywordsを含む辞書
+        :return: (ジャンル, 判定方法(rule, model))。判定できない場合は(None, None)
+        """
+        genre = self.rules.classify(
+            row.get("label"), row.get("publisher"), row.get("keywords")
+        )
+        if genre:
+            return genre, "rule"
+        if self.model is None:
+            return None, None
+        tokens = features(
+            row.get("title"),
+            row.get("description"),
+            row.get("label"),
+            row.get("publisher"),
+        )
+        genre, probability = self.model.predict(tokens)
+        if probability >= self.threshold:
+            return genre, "model"
+        return None, None
+
+    def classify(self, df) -> Tuple[List[Optional[str]], List[Optional[str]]]:
+        """DataFrameの書籍を分類し、ジャンルと判定方法のリストを返す関数。"""
+        columns = ("title", "description", "label", "publisher", "keywords")
+        rows = zip(*(df[c] if c in df else [None] * len(df) for c in columns))
+        results = [self.classify_row(dict(zip(columns, row))) for row in rows]
+        return [g for g, _ in results], [s for _, s in results]
+
+    def evaluate(self, rows: Iterable[Dict]) -> Dict:
+        """正解のジャンル(genre)付きの書籍で、ローカルで判定できた割合と一致率を計算する関数。
+
+        :param rows: genreを含む書籍の辞書
+        :return: 件数、判定方法ごとのローカルで判定できた割合とOpenAI APIの結果との一致率
+        :rtype: dict
+        """
+        counts = Counter()
+        for row in rows:
+            counts["total"] += 1
+            genre, source = self.classify_row(row)
+            if source is None:
+                continue
+            counts[source] += 1
+            if genre == row["genre"]:
+                counts[source + "_agreed"] += 1
+        total = counts["total"]
+        result = dict(total=total)
+        for source in ("rule", "model"):
+            resolved = counts[source]
+            result[f"{source}_share"] = resolved / total if total else 0.0
+            result[f"{source}_agreement"] = (
+                counts[source + "_agreed"] / resolved if resolved else None
+            )
+        return result
+
+    def model_dumps(self, metrics: Dict = None) -> str:
+        return json.dumps(
+            dict(
+                version=MODEL_VERSION,
+                model=self.model.to_dict(),
+                disabled_rules=sorted(self.rules.disabled),
+                metrics=metrics,
+            ),
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def loads(cls, text: str, rules: RuleClassifier, **kwargs) -> "LocalClassifier":
+        """保存したモデルを読み込む関数。モデルがない場合はルールだけの分類器を返す。
+
+        学習時に一致率が低かったルールは使わない。
+        """
+        model = None
+        if text:
+            data = json.loads(text)
+            if data.get("version") == MODEL_VERSION:
+                model = NaiveBayes.from_dict(data["model"])
+            rules.disabled.update(data.get("disabled_rules", []))
+        return cls(rules, model, **kwargs)
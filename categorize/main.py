@@ -1,39 +1,109 @@
 from datetime import date, datetime, timedelta
-from google.cloud import bigquery
-from google.cloud import secretmanager
-from google.cloud import storage
-from openai import OpenAI
 import functions_framework
-import gzip
+import hashlib
 import json
 import os
 import pandas as pd
 import pytz
-import tempfile
+import time
+import uuid
 
+from batch_job import (
+    DONE_STATUSES,
+    FAILED_STATUSES,
+    LocalBatchBackend,
+    OpenAIBatchBackend,
+    request_line,
+    response_content,
+)
+from gcs_io import GzipWriter, JsonlGzipWriter, get_storage, iter_jsonl
+from genre_cache import CACHE_PATH, GenreCache, content_hash
+from llm_engine import (
+    ClassificationEngine,
+    estimate_request,
+    estimate_tokens,
+    make_batches,
+)
+from local_classifier import (
+    MODEL_PATH,
+    LocalClassifier,
+    NaiveBayes,
+    RuleClassifier,
+    features,
+    gate_rules,
+    load_rules,
+)
+from metering import MeteredClient, estimate_batch_cost, start_run, within_budget
+from prompt import SYSTEM_PROMPT, build_books
+from series_index import INDEX_PATH, SeriesIndex
+from startup import mark, report, timed
 
-PROJECT_NAME = os.environ["PROJECT_NAME"]
-bigquery_client = bigquery.Client(PROJECT_NAME)
-secret_manager_client = secretmanager.SecretManagerServiceClient()
-storage_client = storage.Client(project=PROJECT_NAME)
+
+PROJECT_NAME = os.environ.get("PROJECT_NAME")
+# クライアントは使う時点で作成する（コールドスタートで使わないクライアントを作らないため）
+bigquery_client = None
+secret_manager_client = None
 openai_client = None
-SQL = """SELECT isbn, raw_title, authors, title, publisher, description, label
-FROM book_feed.external_new_books
+# external_new_books_parquetを指定するとParquetのパーティションから読み込む
+NEW_BOOKS_TABLE = os.environ.get("NEW_BOOKS_TABLE", "external_new_books")
+BATCH_POLL_INTERVAL = float(os.environ.get("BATCH_POLL_INTERVAL", "30"))
+# 入力の読み込み元。gcsはnew_booksのパーティションを直接読み、bigqueryは外部テーブルにクエリする
+INPUT_SOURCE = os.environ.get("CATEGORIZE_SOURCE", "gcs")
+# 分類結果の判定方法（source列）。ローカルの分類器の結果はrule, modelになる
+# キャッシュにはOpenAI APIの結果だけが入るので、キャッシュの結果もllmとする
+SOURCE_LLM = "llm"
+SOURCE_SERIES = "series_index"
+# バケットのライフサイクル（terraform/resource/main.tf）で消えずに残っている日数
+RETENTION_DAYS = 50
+COLUMNS = [
+    "isbn",
+    "raw_title",
+    "authors",
+    "title",
+    "publisher",
+    "description",
+    "label",
+    "keywords",
+    "series",
+]
+SQL = f"""SELECT isbn, raw_title, authors, title, publisher, description, label, keywords, series
+FROM book_feed.{NEW_BOOKS_TABLE}
 WHERE
   SUBSTR(c_code, 1, 1)!="9" AND SUBSTR(c_code, 3, 2) IN ("93", "97") AND description != ""
   AND date=@date
 """
 
 
-def upload_gcs(bucket_name: str, path: str, local_path):
-    project = os.environ["PROJECT_NAME"]
-    bucket = storage_client.get_bucket(bucket_name)
-    blob = bucket.blob(path)
-    blob.content_encoding = "gzip"
-    blob.upload_from_filename(local_path)
+def fetch(target_date: date, bucket_name: str = None):
+    if INPUT_SOURCE == "bigquery" or bucket_name is None:
+        return fetch_bigquery(target_date)
+    return fetch_gcs(target_date, bucket_name)
+
 
+def fetch_gcs(target_date: date, bucket_name: str):
+    path = f"new_books/date={target_date.isoformat()}/hanmoto.jsonl.gz"
+    df = pd.DataFrame.from_records(iter_jsonl(get_storage(bucket_name), path))
+    # 古いパーティションにない列や、空のパーティションでも同じ列を返す
+    df = df.reindex(columns=COLUMNS + ["c_code"])
+    return filter_novels(df)[COLUMNS].reset_index(drop=True)
+
+
+def filter_novels(df):
+    # SQLのWHERE句と同じ条件。BigQueryと同じく、NULLの行は条件を満たさないものとする
+    c_code = df["c_code"].astype("string")
+    description = df["description"].astype("string")
+    mask = (
+        (c_code.str[:1] != "9")
+        & c_code.str[2:4].isin(["93", "97"])
+        & (description != "")
+    )
+    return df[mask.fillna(False).astype(bool)]
 
-def fetch(target_date: date):
+
+def fetch_bigquery(target_date: date):
+    from google.cloud import bigquery
+
+    bigquery_client = get_bigquery_client()
     job_config = bigquery.QueryJobConfig(
         query_parameters=[bigquery.ScalarQueryParameter("date", "DATE", target_date)]
     )
@@ -72,48 +142,30 @@ def schema():
     }
 
 
-def do_openai_api(df):
-    system_prompt = """タスク
-- これらの小説を以下のカテゴリーに分類し、JSONで返しなさい
+# 毎回同じ内容を送るため、一度だけ作る
+RESPONSE_FORMAT = schema()
 
-カテゴリは以下から選びなさい。
-ミステリ、ライトノベル、ホラー、SF、ファンタジー、時代小説、戦争もの、児童向け、恋愛小説、官能小説、純文学、その他
 
-## OUTPUT FORMAT
-[
-    {"number": 1, "genre": "ミステリ"},
-    {"number": 2, "genre": "ライトノベル"},
-]
-"""
-    lines = []
-    for i, row in df.iterrows():
-        author = row["authors"]
-        title = row["title"]
-        publisher = row["publisher"]
-        description = row["description"].replace("\n", "\\n")[:500]
-        if row["label"]:
-            label = f"({row['label']})"
-        else:
-            label = ""
-        line = f"{i + 1}. {author}『{title}』{label}{publisher}"
-        line += f'\n    "{description}"'
-        lines.append(line)
-    books = "\n".join(lines)
-    prompt = f"# BOOKS\n{books}"
+def build_request(df):
     messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": prompt},
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": build_books(df)},
     ]
-    args = dict(
+    return dict(
         model="gpt-4.1-mini",
         temperature=0.6,
-        timeout=60,
         messages=messages,
-        response_format=schema(),
+        response_format=RESPONSE_FORMAT,
     )
+
+
+def do_openai_api(df):
+    args = build_request(df)
     openai_client = get_openai_client()
-    completion = openai_client.chat.completions.create(**args)
-    print(prompt)
+    completion = openai_client.chat.completions.create(
+        timeout=60, batch_size=len(df), **args
+    )
+    print(args["messages"][-1]["content"])
     print(completion.choices[0].message.content)
     return parse_json(completion.choices[0].message.content)
 
@@ -125,20 +177,64 @@ def parse_json(result):
         return None
 
 
-def categorize(df):
-    unit = 5
-    dfs = []
-    for i in range(0, len(df), unit):
-        target = df.loc[i : i + unit - 1].copy()
-        raw_result = do_openai_api(target)
-        try:
-            result = check_result(raw_result, target)
-        except AssertionError as e:
-            print(e)
+def split_cached(df, cache, use_cache=True):
+    df = df.reset_index(drop=True)
+    digests = [
+        content_hash(title, description, label)
+        for title, description, label in zip(
+            df["title"], df["description"], df["label"]
+        )
+    ]
+    if use_cache:
+        df["genre"] = [cache.get(isbn, d) for isbn, d in zip(df["isbn"], digests)]
+    else:
+        df["genre"] = None
+    hit = df["genre"].notna().to_numpy()
+    print("cache", "hits", int(hit.sum()), "misses", int((~hit).sum()))
+    misses = df[~hit].drop(columns="genre").reset_index(drop=True)
+    miss_digests = [d for d, h in zip(digests, hit) if not h]
+    return df[hit], misses, miss_digests
+
+
+def categorize(df, cache=None, engine=None, local=None, index=None):
+    if cache is None:
+        cache = GenreCache()
+    if engine is None:
+        engine = ClassificationEngine(do_openai_api, check_result)
+    hits, misses, miss_digests = split_cached(df, cache)
+    dfs = [hits.assign(source=SOURCE_LLM)]
+    if index is not None and len(misses) > 0:
+        # 既刊のジャンルが安定しているシリーズの新刊は、そのジャンルにする
+        series = misses["series"] if "series" in misses else [None] * len(misses)
+        genres = [index.lookup(s, label) for s, label in zip(series, misses["label"])]
+        resolved = misses.assign(genre=genres, source=SOURCE_SERIES)
+        resolved = resolved[resolved["genre"].notna()]
+        index.hits += len(resolved)
+        dfs.append(resolved)
+        misses = misses.drop(index=resolved.index)
+    if local is not None and len(misses) > 0:
+        # ローカルで判定できた書籍はOpenAI APIに送らない。indexはmiss_digestsの位置のまま残す
+        genres, sources = local.classify(misses)
+        resolved = misses.assign(genre=genres, source=sources)
+        resolved = resolved[resolved["source"].notna()]
+        local.counts.update(resolved["source"])
+        local.counts["total"] += len(misses)
+        dfs.append(resolved)
+        misses = misses.drop(index=resolved.index)
+    classified = []
+    for target, result in engine.run(misses):
+        if result is None:
             continue
+        target = target.copy()
         target["genre"] = result
-        dfs.append(target)
-    return pd.concat(dfs, axis=0)
+        target["source"] = SOURCE_LLM
+        for i, isbn, genre in zip(target.index, target["isbn"], result):
+            cache.put(isbn, miss_digests[i], genre)
+        classified.append(target)
+    if index is not None and classified:
+        # OpenAI APIで分類した書籍だけを加える（キャッシュやインデックスの結果は数え直さない）
+        index.update(pd.concat(classified, axis=0))
+    return pd.concat(dfs + classified, axis=0)
 
 
 def check_result(result, target):
@@ -152,36 +248,367 @@ def check_result(result, target):
 
 def fetch_secret_version(key):
     name = f"projects/{PROJECT_NAME}/secrets/{key}/versions/latest"
-    response = secret_manager_client.access_secret_version(request={"name": name})
+    response = get_secret_manager_client().access_secret_version(request={"name": name})
     return response.payload.data.decode("UTF-8")
 
 
+def get_bigquery_client():
+    global bigquery_client
+    if bigquery_client is None:
+        with timed("import:google.cloud.bigquery"):
+            from google.cloud import bigquery
+        with timed("client:bigquery"):
+            bigquery_client = bigquery.Client(PROJECT_NAME)
+    return bigquery_client
+
+
+def get_secret_manager_client():
+    global secret_manager_client
+    if secret_manager_client is None:
+        with timed("import:google.cloud.secretmanager"):
+            from google.cloud import secretmanager
+        with timed("client:secretmanager"):
+            secret_manager_client = secretmanager.SecretManagerServiceClient()
+    return secret_manager_client
+
+
 def get_openai_client():
     global openai_client
     if openai_client is None:
+        with timed("import:openai"):
+            from openai import OpenAI
         api_key = open(os.environ["SECRET_KEY_PATH"]).read()
-        openai_client = OpenAI(api_key=api_key)
+        with timed("client:openai"):
+            openai_client = MeteredClient(OpenAI(api_key=api_key))
     return openai_client
 
 
+def load_genre_cache(bucket_name: str):
+    return GenreCache.loads(get_storage(bucket_name).read_text(CACHE_PATH))
+
+
+def save_genre_cache(bucket_name: str, cache):
+    if not cache.dirty:
+        return
+    with GzipWriter(get_storage(bucket_name), CACHE_PATH) as writer:
+        writer.write(cache.dumps().encode("utf-8"))
+
+
 def categorize_date(target_date: date, bucket_name: str):
     date_str = target_date.isoformat()
-    df = fetch(target_date)
+    df = fetch(target_date, bucket_name)
     if len(df) == 0:
         print("no data")
         return dict(count=0, date=date_str)
-    df = categorize(df)
+    meter = start_run()
+    cache = load_genre_cache(bucket_name)
+    engine = ClassificationEngine(do_openai_api, check_result)
+    local = load_local_classifier(bucket_name)
+    index = load_series_index(bucket_name)
+    df = categorize(df, cache, engine, local, index)
+    save_genre_cache(bucket_name, cache)
+    save_series_index(bucket_name, index)
+    save_categorized(bucket_name, date_str, df)
+    return dict(
+        count=len(df),
+        date=date_str,
+        cache_hits=cache.hits,
+        cache_misses=cache.misses,
+        classification=dict(engine.counts),
+        local=dict(local.counts),
+        series_index=index.hits,
+        llm=meter.summary(),
+    )
+
+
+def load_series_index(bucket_name: str):
+    return SeriesIndex.loads(get_storage(bucket_name).read_text(INDEX_PATH))
+
+
+def save_series_index(bucket_name: str, index):
+    if not index.dirty:
+        return
+    with GzipWriter(get_storage(bucket_name), INDEX_PATH) as writer:
+        writer.write(index.dumps().encode("utf-8"))
+
+
+def load_local_classifier(bucket_name: str):
+    rules = RuleClassifier(load_rules())
+    return LocalClassifier.loads(get_storage(bucket_name).read_text(MODEL_PATH), rules)
+
+
+def is_holdout(isbn: str, ratio: float) -> bool:
+    digest = hashlib.md5(isbn.encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) / 0xFFFFFFFF < ratio
+
+
+def iter_training_rows(start_date: date, end_date: date, bucket_name: str):
+    """過去の分類結果と書籍データをISBNで結合し、ジャンル付きの書籍を返す。
+
+    ルールやモデル自身の結果で学習しないよう、OpenAI APIで分類した書籍（source列がllm）だけを返す。
+    source列のない古い分類結果は使わない。
+    """
+    storage = get_storage(bucket_name)
+    target_date = start_date
+    while target_date <= end_date:
+        date_str = target_date.isoformat()
+        target_date += timedelta(days=1)
+        path = f"categorized/date={date_str}/novel.jsonl.gz"
+        genres = {
+            r["isbn"]: r["genre"]
+            for r in iter_jsonl(storage, path)
+            if r.get("source") == SOURCE_LLM
+        }
+        if not genres:
+            continue
+        path = f"new_books/date={date_str}/hanmoto.jsonl.gz"
+        for book in iter_jsonl(storage, path):
+            if book["isbn"] in genres:
+                yield dict(book, genre=genres.pop(book["isbn"]))
+
+
+def train_local_model(
+    start_date: date, end_date: date, bucket_name: str, holdout: float = 0.1
+):
+    """過去の分類結果でローカルの分類器を学習し、ホールドアウトでの評価とともに保存する。
+
+    OpenAI APIの結果との一致率が低いルールは、以降の分類で使わないようにモデルと一緒に保存する。
+    """
+    train = []
+    test = []
+    for row in iter_training_rows(start_date, end_date, bucket_name):
+        (test if is_holdout(row["isbn"], holdout) else train).append(row)
+    if not train:
+        return dict(status="no_data", train=0)
+    model = NaiveBayes.fit(
+        (
+            features(r["title"], r["description"], r["label"], r["publisher"]),
+            r["genre"],
+        )
+        for r in train
+    )
+    rules = RuleClassifier(load_rules())
+    rule_stats = rules.measure(train + test)
+    rules.disabled.update(gate_rules(rule_stats))
+    local = LocalClassifier(rules, model)
+    metrics = dict(
+        train=len(train),
+        holdout=local.evaluate(test),
+        rules=rule_stats,
+        disabled_rules=sorted(rules.disabled),
+    )
+    with GzipWriter(get_storage(bucket_name), MODEL_PATH) as writer:
+        writer.write(local.model_dumps(metrics).encode("utf-8"))
+    print("local model", metrics)
+    return dict(status="trained", **metrics)
+
+
+def save_categorized(bucket_name: str, date_str: str, df):
+    df = df.copy()
     df["book_type"] = "novel"
-    df = df[["isbn", "raw_title", "book_type", "genre"]]
-    tmp = tempfile.NamedTemporaryFile("wb")
-    # df.to_csv("result.csv", index=False)
-    with gzip.open(tmp.name, "wb") as fp:
-        df.to_json(fp, orient="records", lines=True)
-    tmp.flush()
-    tmp.seek(0)
+    if "source" not in df:
+        df["source"] = None
+    df = df[["isbn", "raw_title", "book_type", "genre", "source"]]
     remote_path = f"categorized/date={date_str}/novel.jsonl.gz"
-    upload_gcs(bucket_name, remote_path, tmp.name)
-    return dict(count=len(df), date=date_str)
+    with JsonlGzipWriter(get_storage(bucket_name), remote_path) as writer:
+        for record in df.to_dict(orient="records"):
+            writer.write_record(record)
+
+
+def get_batch_backend():
+    local_dir = os.environ.get("BATCH_BACKEND_DIR")
+    if local_dir:
+        return LocalBatchBackend(local_dir)
+    return OpenAIBatchBackend(get_openai_client())
+
+
+def get_batch_job_path(batch_id: str):
+    return f"categorize_batches/{batch_id}.json.gz"
+
+
+def submit_backfill(
+    start_date: date, end_date: date, bucket_name: str, use_cache: bool = False
+):
+    """期間内の書籍をまとめてBatch APIで分類するジョブを作成する。
+
+    ジャンルの一覧やモデルを変えた後の再分類を想定し、既定ではキャッシュを使わない。
+    結果と書籍を対応づける情報は categorize_batches/<バッチID>.json.gz に保存する。
+    送る前にトークン数と費用を見積もり、上限を超える日付以降はジョブに含めない（trimmed_from）。
+    """
+    cache = load_genre_cache(bucket_name)
+    job = dict(dates={}, requests={})
+    lines = []
+    estimated_tokens = 0
+    estimated_cost = 0.0
+    target_date = start_date
+    while target_date <= end_date:
+        date_str = target_date.isoformat()
+        df = fetch(target_date, bucket_name)
+        target_date += timedelta(days=1)
+        if len(df) == 0:
+            continue
+        hits, misses, miss_digests = split_cached(df, cache, use_cache)
+        date_lines = []
+        date_requests = {}
+        date_tokens = 0
+        date_cost = 0.0
+        tokens = estimate_tokens(misses).tolist()
+        for n, positions in enumerate(make_batches(tokens)):
+            target = misses.iloc[positions]
+            custom_id = f"{date_str}-{n}"
+            body = build_request(target)
+            prompt_tokens, completion_tokens = estimate_request(target)
+            date_tokens += prompt_tokens + completion_tokens
+            date_cost += estimate_batch_cost(
+                body["model"], prompt_tokens, completion_tokens
+            )
+            date_lines.append(request_line(custom_id, body))
+            date_requests[custom_id] = dict(
+                date=date_str,
+                isbn=target["isbn"].tolist(),
+                raw_title=target["raw_title"].tolist(),
+                digest=[miss_digests[i] for i in positions],
+            )
+        if not within_budget(
+            estimated_tokens + date_tokens, estimated_cost + date_cost
+        ):
+            job["trimmed_from"] = date_str
+            print("over budget, trimmed from", date_str)
+            break
+        estimated_tokens += date_tokens
+        estimated_cost += date_cost
+        job["dates"][date_str] = (
+            hits[["isbn", "raw_title", "genre"]]
+            .assign(source=SOURCE_LLM)
+            .to_dict(orient="records")
+        )
+        job["requests"].update(date_requests)
+        lines.extend(date_lines)
+    estimate = dict(
+        estimated_tokens=estimated_tokens,
+        estimated_cost_usd=round(estimated_cost, 6),
+        trimmed_from=job.get("trimmed_from"),
+    )
+    if not job["dates"]:
+        status = "over_budget" if "trimmed_from" in job else "empty"
+        return dict(status=status, requests=0, **estimate)
+    backend = get_batch_backend()
+    batch_id = backend.submit(lines) if lines else f"batch_cached_{uuid.uuid4().hex}"
+    job["batch_id"] = batch_id
+    with GzipWriter(get_storage(bucket_name), get_batch_job_path(batch_id)) as writer:
+        writer.write(json.dumps(job, ensure_ascii=False).encode("utf-8"))
+    print("submitted", batch_id, "requests", len(lines), estimate)
+    return dict(batch_id=batch_id, status="submitted", requests=len(lines), **estimate)
+
+
+def poll_backfill(batch_id: str, bucket_name: str, wait: float = 0):
+    """バッチジョブの完了を最大wait秒待ち、完了していれば結果をパーティションに保存する。"""
+    text = get_storage(bucket_name).read_text(get_batch_job_path(batch_id))
+    if not text:
+        return dict(batch_id=batch_id, status="not_found")
+    job = json.loads(text)
+    backend = get_batch_backend()
+    if not job["requests"]:
+        return dict(
+            batch_id=batch_id,
+            status="completed",
+            **finish_backfill(job, [], bucket_name),
+        )
+    deadline = time.monotonic() + wait
+    while True:
+        status = backend.status(batch_id)
+        if status in DONE_STATUSES or status in FAILED_STATUSES:
+            break
+        if time.monotonic() >= deadline:
+            break
+        time.sleep(BATCH_POLL_INTERVAL)
+    if status not in DONE_STATUSES:
+        return dict(batch_id=batch_id, status=status)
+    result = finish_backfill(job, backend.results(batch_id), bucket_name)
+    return dict(batch_id=batch_id, status=status, **result)
+
+
+def restore_unanswered(bucket_name: str, date_str: str, requests, cache):
+    """結果が得られなかった書籍について、保存済みのパーティションかキャッシュのジャンルを使う。
+
+    パーティションは上書きされるため、これらの書籍の以前の分類が失われないようにする。
+    """
+    path = f"categorized/date={date_str}/novel.jsonl.gz"
+    existing = {r["isbn"]: r for r in iter_jsonl(get_storage(bucket_name), path)}
+    rows = []
+    for request in requests:
+        for isbn, raw_title, digest in zip(
+            request["isbn"], request["raw_title"], request["digest"]
+        ):
+            if isbn in existing:
+                genre = existing[isbn]["genre"]
+                source = existing[isbn].get("source")
+            else:
+                genre = cache.get(isbn, digest)
+                source = SOURCE_LLM
+            if genre is not None:
+                rows.append(
+                    dict(isbn=isbn, raw_title=raw_title, genre=genre, source=source)
+                )
+    return pd.DataFrame(rows, columns=["isbn", "raw_title", "genre", "source"])
+
+
+def finish_backfill(job, results, bucket_name: str):
+    cache = load_genre_cache(bucket_name)
+    frames = {d: [pd.DataFrame(rows)] for d, rows in job["dates"].items()}
+    failed = 0
+    answered = 0
+    succeeded = set()
+    for line in results:
+        request = job["requests"].get(line["custom_id"])
+        if request is None:
+            continue
+        answered += 1
+        target = pd.DataFrame(
+            dict(isbn=request["isbn"], raw_title=request["raw_title"])
+        )
+        content = response_content(line)
+        raw_result = parse_json(content) if content is not None else None
+        if raw_result is None:
+            failed += 1
+            continue
+        try:
+            result = check_result(raw_result, target)
+        except AssertionError as e:
+            print(e)
+            failed += 1
+            continue
+        target["genre"] = result
+        target["source"] = SOURCE_LLM
+        for isbn, digest, genre in zip(request["isbn"], request["digest"], result):
+            cache.put(isbn, digest, genre)
+        frames[request["date"]].append(target)
+        succeeded.add(line["custom_id"])
+    unanswered = {}
+    for custom_id, request in job["requests"].items():
+        if custom_id not in succeeded:
+            unanswered.setdefault(request["date"], []).append(request)
+    restored = 0
+    for date_str, requests in unanswered.items():
+        df = restore_unanswered(bucket_name, date_str, requests, cache)
+        frames[date_str].append(df)
+        restored += len(df)
+    save_genre_cache(bucket_name, cache)
+    count = 0
+    for date_str, dfs in frames.items():
+        df = pd.concat(dfs, axis=0)
+        if len(df) == 0:
+            continue
+        save_categorized(bucket_name, date_str, df)
+        count += len(df)
+    # 出力ファイルに含まれないリクエストも失敗として数える
+    missing = len(job["requests"]) - answered
+    return dict(
+        count=count,
+        dates=len(frames),
+        failed_requests=failed + missing,
+        restored=restored,
+    )
 
 
 def get_today():
@@ -191,9 +618,56 @@ def get_today():
 
 @functions_framework.http
 def handle_request(request):
+    mark("first_request")
+    try:
+        return run_request(request)
+    finally:
+        mark("first_response")
+        report()
+
+
+def run_request(request):
     bucket_name = os.environ.get("BUCKET_NAME")
     json_data = request.get_json()
     print(json_data)
+    mode = json_data.get("mode", "daily")
+    if mode == "backfill":
+        today = get_today()
+        start_days = json_data.get("start_days", 0)
+        end_days = json_data.get("end_days", start_days)
+        if start_days > end_days:
+            return "start_days must be less than or equal to end_days", 400
+        result = submit_backfill(
+            today + timedelta(days=start_days),
+            today + timedelta(days=end_days),
+            bucket_name,
+            use_cache=json_data.get("use_cache", False),
+        )
+        if "batch_id" in result:
+            result = poll_backfill(
+                result["batch_id"], bucket_name, wait=json_data.get("wait", 0)
+            )
+        return dict(result="ok", **result)
+    if mode == "backfill_status":
+        result = poll_backfill(
+            json_data["batch_id"], bucket_name, wait=json_data.get("wait", 0)
+        )
+        return dict(result="ok", **result)
+    if mode == "train_local":
+        today = get_today()
+        start_days = json_data.get("start_days", -RETENTION_DAYS)
+        end_days = json_data.get("end_days", -1)
+        if start_days > end_days:
+            return "start_days must be less than or equal to end_days", 400
+        result = train_local_model(
+            today + timedelta(days=start_days),
+            today + timedelta(days=end_days),
+            bucket_name,
+            holdout=json_data.get("holdout", 0.1),
+        )
+        return dict(result="ok", **result)
+    if mode != "daily":
+        return "Invalid mode", 400
     days = json_data.get("days", 0)
     target_date = get_today() + timedelta(days=days)
     result = categorize_date(target_date, bucket_name)
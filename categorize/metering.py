@@ -0,0 +1,206 @@
+"""
+OpenAI APIの呼び出しごとの時間、トークン数、費用を記録するモジュール。
+
+MeteredClientでOpenAIのクライアントを包み、呼び出しごとに構造化したログを出力して、
+実行全体の集計をMeterに溜めます。トークン数や費用の上限を超えた場合は、
+以降の呼び出しをBudgetExceededで止めます。
+Batch APIのジョブは、送る前に見積もったトークン数と費用で上限を確かめます（within_budget）。
+"""
+
+from collections import Counter
+from typing import Dict, Optional
+import json
+import os
+import threading
+import time
+
+from prompt import usage_record
+
+
+DEFAULT_TOKEN_BUDGET = int(os.environ.get("CATEGORIZE_TOKEN_BUDGET", "0"))
+DEFAULT_COST_BUDGET = float(os.environ.get("CATEGORIZE_COST_BUDGET_USD", "0"))
+# 100万トークンあたりのドル（入力, キャッシュ済みの入力, 出力）
+PRICES = {
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+}
+
+
+# Batch APIの料金は通常の半額
+BATCH_DISCOUNT = 0.5
+
+
+class BudgetExceeded(Exception):
+    """実行あたりのトークン数・費用の上限に達したことを表す例外。"""
+
+
+def cost(model: str, usage: Dict) -> float:
+    """1回の呼び出しの費用（ドル）を計算する関数。料金が不明なモデルは0とする。"""
+    prices = PRICES.get(model)
+    if prices is None or "prompt_tokens" not in usage:
+        return 0.0
+    input_price, cached_price, output_price = prices
+    cached = usage["cached_tokens"]
+    return (
+        (usage["prompt_tokens"] - cached) * input_price
+        + cached * cached_price
+        + usage["completion_tokens"] * output_price
+    ) / 1e6
+
+
+def estimate_batch_cost(model: str, prompt_tokens: int, completion_tokens: int):
+    """Batch APIで1リクエストを送る場合の費用（ドル）を見積もる関数。"""
+    usage = dict(
+        prompt_tokens=prompt_tokens,
+        cached_tokens=0,
+        completion_tokens=completion_tokens,
+    )
+    return cost(model, usage) * BATCH_DISCOUNT
+
+
+def within_budget(
+    tokens: int,
+    cost_usd: float,
+    token_budget: Optional[int] = None,
+    cost_budget: Optional[float] = None,
+) -> bool:
+    """見積もったトークン数と費用が、実行あたりの上限に収まるかを返す関数。
+
+    :param int tokens: 見積もったトークン数
+    :param float cost_usd: 見積もった費用（ドル）
+    :param token_budget: トークン数の上限。省略した場合はCATEGORIZE_TOKEN_BUDGET
+    :param cost_budget: 費用の上限。省略した場合はCATEGORIZE_COST_BUDGET_USD
+    :return: 上限に収まる場合はTrue
+    :rtype: bool
+    """
+    token_budget = DEFAULT_TOKEN_BUDGET if token_budget is None else token_budget
+    cost_budget = DEFAULT_COST_BUDGET if cost_budget is None else cost_budget
+    if token_budget and tokens > token_budget:
+        return False
+    return not (cost_budget and cost_usd > cost_budget)
+
+
+class Meter:
+    """実行全体のAPI呼び出しを集計するクラス。
+
+    :param int token_budget: トークン数の上限。0なら上限なし
+    :param float cost_budget: 費用（ドル）の上限。0なら上限なし
+    """
+
+    def __init__(
+        self,
+        token_budget: int = DEFAULT_TOKEN_BUDGET,
+        cost_budget: float = DEFAULT_COST_BUDGET,
+    ):
+        self.token_budget = token_budget
+        self.cost_budget = cost_budget
+        self.totals = Counter()
+        self.latencies = []
+        self.lock = threading.Lock()
+
+    def exceeded(self) -> bool:
+        tokens = self.totals["prompt_tokens"] + self.totals["completion_tokens"]
+        if self.token_budget and tokens >= self.token_budget:
+            return True
+        return bool(self.cost_budget and self.totals["cost_usd"] >= self.cost_budget)
+
+    def check(self):
+        """上限に達していればBudgetExceededを送出する関数。"""
+        with self.lock:
+            if self.exceeded():
+                self.totals["budget_rejected"] += 1
+                raise BudgetExceeded(json.dumps(self.summary_unlocked()))
+
+    def record(self, record: Dict):
+        """1回の呼び出しの記録をログに出力し、集計に加える関数。"""
+        print(json.dumps({"llm_call": record}, ensure_ascii=False))
+        with self.lock:
+            self.totals["calls"] += 1
+            if "error" in record:
+                self.totals["errors"] += 1
+            for key in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+                self.totals[key] += record.get(key, 0)
+            self.totals["retries"] += record.get("retries", 0)
+            self.totals["cost_usd"] += record.get("cost_usd", 0.0)
+            self.latencies.append(record["latency"])
+
+    def summary_unlocked(self) -> Dict:
+        latencies = sorted(self.latencies)
+        summary = dict(self.totals)
+        summary["cost_usd"] = round(summary.get("cost_usd", 0.0), 6)
+        if latencies:
+            summary["latency_total"] = round(sum(latencies), 3)
+            summary["latency_p50"] = round(latencies[len(latencies) // 2], 3)
+            summary["latency_max"] = round(latencies[-1], 3)
+        summary["budget_exceeded"] = self.exceeded()
+        return summary
+
+    def summary(self) -> Dict:
+        """実行全体の集計を返す関数。
+
+        :return: 呼び出し回数、トークン数、費用、レイテンシ、上限に達したかどうか
+        :rtype: dict
+        """
+        with self.lock:
+            return self.summary_unlocked()
+
+
+current = Meter()
+
+
+def start_run(**kwargs) -> Meter:
+    """実行ごとの集計を新しく始める関数。
+
+    :return: この実行のMeter
+    :rtype: Meter
+    """
+    global current
+    current = Meter(**kwargs)
+    return current
+
+
+class _Completions:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, batch_size: Optional[int] = None, **kwargs):
+        meter = current
+        meter.check()
+        model = kwargs.get("model")
+        record = dict(model=model, batch_size=batch_size)
+        start = time.perf_counter()
+        try:
+            raw = self.client.chat.completions.with_raw_response.create(**kwargs)
+            completion = raw.parse()
+        except Exception as e:
+            record.update(latency=time.perf_counter() - start, error=type(e).__name__)
+            meter.record(record)
+            raise
+        record["latency"] = round(time.perf_counter() - start, 3)
+        record["retries"] = getattr(raw, "retries_taken", 0)
+        record.update(usage_record(completion, batch_size))
+        record["cost_usd"] = cost(model, record)
+        meter.record(record)
+        return completion
+
+
+class _Chat:
+    def __init__(self, client):
+        self.completions = _Completions(client)
+
+
+class MeteredClient:
+    """chat.completions.createの呼び出しを記録する、OpenAIのクライアントのラッパー。
+
+    createにはbatch_sizeを追加で渡せます。その他の属性は元のクライアントのものを返します。
+
+    :param client: OpenAIのクライアント
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.chat = _Chat(client)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
@@ -0,0 +1,119 @@
+"""
+OpenAI APIに送るプロンプトを組み立てるモジュール。
+
+システムプロンプトとJSONスキーマは毎回同じバイト列になるよう定数にして先頭に置き、
+プロバイダー側のプロンプトキャッシュが効くようにします。書籍ごとの行は後ろにまとめ、
+説明は定型文を取り除いてから、1冊あたりのトークン数の上限で切り詰めます。
+"""
+
+import os
+import re
+
+import pandas as pd
+
+
+SYSTEM_PROMPT = """タスク
+- これらの小説を以下のカテゴリーに分類し、JSONで返しなさい
+
+カテゴリは以下から選びなさい。
+ミステリ、ライトノベル、ホラー、SF、ファンタジー、時代小説、戦争もの、児童向け、恋愛小説、官能小説、純文学、その他
+
+## OUTPUT FORMAT
+[
+    {"number": 1, "genre": "ミステリ"},
+    {"number": 2, "genre": "ライトノベル"},
+]
+"""
+# 1冊あたりの説明の見積もりトークン数の上限
+DESCRIPTION_TOKENS = int(os.environ.get("CATEGORIZE_DESCRIPTION_TOKENS", "300"))
+# 出版社の紹介文によく付いている、分類の役に立たない定型文
+BOILERPLATE = [
+    re.compile(p)
+    for p in (
+        r"https?://\S+",
+        r"※[^\n]*",
+        r"【(?:著者|作者|訳者)[^】]*】.*",
+        r"(?:著者|作者)(?:略歴|紹介)[：:].*",
+        r"【[^】]*(?:電子|特典|初回|限定|重版|受賞)[^】]*】",
+        r"(?:本書|この作品)は[^。]*(?:電子書籍|単行本|文庫化|加筆修正)[^。]*。",
+    )
+]
+SPACES = re.compile(r"\s+")
+
+
+def token_cost(text: str) -> float:
+    """テキストのトークン数を見積もる関数。
+
+    日本語などASCII以外の文字は1文字1トークン、ASCIIの文字は4文字1トークンとして数えます。
+    """
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (len(text) - ascii_chars) + ascii_chars / 4
+
+
+def truncate_tokens(text: str, budget: int = DESCRIPTION_TOKENS) -> str:
+    """見積もりトークン数がbudgetを超えないようにテキストを切り詰める関数。"""
+    if len(text) <= budget:
+        return text
+    cost = 0.0
+    for i, char in enumerate(text):
+        cost += 0.25 if char.isascii() else 1
+        if cost > budget:
+            return text[:i]
+    return text
+
+
+def clean_descriptions(descriptions: pd.Series, budget: int = DESCRIPTION_TOKENS):
+    """説明から定型文を取り除き、空白をまとめて、トークン数の上限で切り詰める関数。
+
+    :param descriptions: 説明のSeries
+    :param int budget: 1冊あたりの見積もりトークン数の上限
+    :return: 整形した説明のSeries
+    :rtype: pandas.Series
+    """
+    cleaned = descriptions.fillna("").astype(str)
+    for pattern in BOILERPLATE:
+        cleaned = cleaned.str.replace(pattern, "", regex=True)
+    cleaned = cleaned.str.replace(SPACES, " ", regex=True).str.strip()
+    return cleaned.map(lambda text: truncate_tokens(text, budget))
+
+
+def build_books(df: pd.DataFrame) -> str:
+    """書籍の一覧のプロンプトを作る関数。
+
+    番号はDataFrameのindex + 1です。
+
+    :param df: 分類する書籍のDataFrame
+    :return: ユーザーメッセージの本文
+    :rtype: str
+    """
+    label = df["label"].fillna("").astype(str)
+    label = ("(" + label + ")").where(label != "", "")
+    lines = (
+        pd.Series(df.index + 1, index=df.index).astype(str)
+        + ". "
+        + df["authors"].fillna("").astype(str)
+        + "『"
+        + df["title"].fillna("").astype(str)
+        + "』"
+        + label
+        + df["publisher"].fillna("").astype(str)
+        + '\n    "'
+        + clean_descriptions(df["description"])
+        + '"'
+    )
+    return "# BOOKS\n" + "\n".join(lines)
+
+
+def usage_record(completion, batch_size: int) -> dict:
+    """APIの応答から、プロンプト・キャッシュ済み・出力のトークン数を取り出す関数。"""
+    usage = completion.usage
+    if usage is None:
+        return dict(batch_size=batch_size)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    return dict(
+        batch_size=batch_size,
+        prompt_tokens=usage.prompt_tokens,
+        cached_tokens=cached,
+        completion_tokens=usage.completion_tokens,
+    )
@@ -0,0 +1,108 @@
+"""
+シリーズとレーベルごとに、分類済みの巻のジャンルの分布を保持するモジュール。
+
+同じシリーズの既刊のジャンルが安定していれば、新刊もそのジャンルとして扱い、
+OpenAI APIに送らないようにします。シリーズが未知の場合は、レーベルの分布を使います。
+インデックスは{名前: {ジャンル: 冊数}}だけのgzip圧縮したJSONで、起動時にすぐ読み込めます。
+"""
+
+from typing import Dict, Optional
+import json
+import os
+
+
+INDEX_PATH = "categorize_cache/series_index.json.gz"
+INDEX_VERSION = 1
+# ジャンルを決めるのに必要な冊数と、最も多いジャンルの割合
+SERIES_MIN_COUNT = int(os.environ.get("SERIES_MIN_COUNT", "2"))
+SERIES_MIN_SHARE = float(os.environ.get("SERIES_MIN_SHARE", "0.9"))
+LABEL_MIN_COUNT = int(os.environ.get("LABEL_MIN_COUNT", "20"))
+LABEL_MIN_SHARE = float(os.environ.get("LABEL_MIN_SHARE", "0.95"))
+
+
+def _key(value) -> Optional[str]:
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    return value or None
+
+
+def dominant(distribution: Dict[str, int], min_count: int, min_share: float):
+    """分布の中で最も多いジャンルが条件を満たせば、そのジャンルを返す関数。
+
+    :param distribution: {ジャンル: 冊数}の辞書
+    :param int min_count: 必要な冊数
+    :param float min_share: 最も多いジャンルが占めるべき割合
+    :return: ジャンル。条件を満たさない場合はNone
+    """
+    total = sum(distribution.values())
+    if total < min_count:
+        return None
+    genre, count = max(distribution.items(), key=lambda x: x[1])
+    if count / total < min_share:
+        return None
+    return genre
+
+
+class SeriesIndex:
+    """シリーズとレーベルごとのジャンルの分布。
+
+    :param series: {シリーズ名: {ジャンル: 冊数}}の辞書
+    :param labels: {レーベル名: {ジャンル: 冊数}}の辞書
+    """
+
+    def __init__(self, series: Dict = None, labels: Dict = None):
+        self.series = series or {}
+        self.labels = labels or {}
+        self.dirty = False
+        self.hits = 0
+
+    def lookup(self, series, label) -> Optional[str]:
+        """シリーズ、レーベルの順に既刊のジャンルを調べる関数。
+
+        :param series: シリーズ名
+        :param label: レーベル名
+        :return: ジャンル。決められない場合はNone
+        """
+        key = _key(series)
+        if key in self.series:
+            return dominant(self.series[key], SERIES_MIN_COUNT, SERIES_MIN_SHARE)
+        key = _key(label)
+        if key in self.labels:
+            return dominant(self.labels[key], LABEL_MIN_COUNT, LABEL_MIN_SHARE)
+        return None
+
+    def add(self, series, label, genre: str):
+        """分類した1冊を分布に加える関数。"""
+        for index, key in ((self.series, _key(series)), (self.labels, _key(label))):
+            if key is None:
+                continue
+            distribution = index.setdefault(key, {})
+            distribution[genre] = distribution.get(genre, 0) + 1
+            self.dirty = True
+
+    def update(self, df):
+        """分類したDataFrame（series, label, genre列を持つ）を分布に加える関数。"""
+        series = df["series"] if "series" in df else [None] * len(df)
+        for s, label, genre in zip(series, df["label"], df["genre"]):
+            self.add(s, label, genre)
+
+    def dumps(self) -> str:
+        return json.dumps(
+            dict(version=INDEX_VERSION, series=self.series, labels=self.labels),
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def loads(cls, text: str) -> "SeriesIndex":
+        """JSON文字列からインデックスを復元する関数。空やバージョン違いの場合は空のインデックスを返す。"""
+        if not text:
+            return cls()
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            return cls()
+        if data.get("version") != INDEX_VERSION:
+            return cls()
+        return cls(data["series"], data["labels"])
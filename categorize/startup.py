@@ -0,0 +1,48 @@
+"""
+Cloud Functionsの起動時間を計測するモジュール。
+
+main.pyで最初に読み込み、モジュールの読み込みやクライアントの作成にかかった時間と、
+インスタンスの起動から最初のリクエストの処理を終えるまでの時間を記録します。
+記録はインスタンスごとに一度だけ、最初のリクエストの後にログへ出力します。
+"""
+
+from contextlib import contextmanager
+from typing import Dict
+import json
+import time
+
+
+STARTED_AT = time.perf_counter()
+timings: Dict[str, float] = {}
+reported = False
+
+
+@contextmanager
+def timed(name: str):
+    """withブロックの実行時間を記録する関数。
+
+    :param str name: 記録する項目名（import:モジュール名、client:クライアント名など）
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def mark(name: str):
+    """インスタンスの起動からの経過時間を記録する関数。同じ項目は最初の1回だけ記録する。
+
+    :param str name: 記録する項目名
+    """
+    if name not in timings:
+        timings[name] = time.perf_counter() - STARTED_AT
+
+
+def report():
+    """記録した時間をJSONでログに出力する関数。インスタンスごとに最初の1回だけ出力する。"""
+    global reported
+    if reported:
+        return
+    reported = True
+    print(json.dumps({"startup": {k: round(v, 4) for k, v in timings.items()}}))
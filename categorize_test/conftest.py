@@ -0,0 +1,36 @@
+from pathlib import Path
+import sys
+
+import pandas as pd
+import pytest
+
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "categorize"))
+
+
+@pytest.fixture
+def make_df():
+    """書籍のDataFrameを作る関数を返す。
+
+    isbnsに件数を渡すと978から始まる連番のISBNを使う。
+    labelとseriesには、全行で共通の値か行ごとの値のリストを渡す。
+    """
+
+    def factory(isbns, description="説明", label=None, series=None):
+        if isinstance(isbns, int):
+            isbns = [f"978{i:010d}" for i in range(isbns)]
+        n = len(isbns)
+        columns = dict(
+            isbn=list(isbns),
+            raw_title=[f"本{isbn}" for isbn in isbns],
+            authors=["著者"] * n,
+            title=[f"本{isbn}" for isbn in isbns],
+            publisher=["出版社"] * n,
+            description=[description] * n,
+            label=label if isinstance(label, list) else [label] * n,
+        )
+        if series is not None:
+            columns["series"] = series if isinstance(series, list) else [series] * n
+        return pd.DataFrame(columns)
+
+    return factory
@@ -0,0 +1,120 @@
+from datetime import date
+import gzip
+import json
+
+
+import main
+import metering
+from batch_job import LocalBatchBackend, default_responder
+
+
+def read_partition(root, date_str):
+    path = root / "bucket" / f"categorized/date={date_str}/novel.jsonl.gz"
+    with gzip.open(path, "rt") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_default_responder(make_df):
+    body = main.build_request(make_df(["1-0", "1-1", "1-2"]))
+    result = json.loads(default_responder(body))
+    assert [1, 2, 3] == [item["number"] for item in result["items"]]
+
+
+def test_backfill(monkeypatch, tmp_path, make_df):
+    sizes = {1: 3, 2: 0, 3: 12}
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path))
+    monkeypatch.setenv("BATCH_BACKEND_DIR", str(tmp_path / "batches"))
+    monkeypatch.setattr(
+        main,
+        "fetch",
+        lambda d, bucket_name: make_df([f"{d.day}-{i}" for i in range(sizes[d.day])]),
+    )
+
+    submitted = main.submit_backfill(date(2025, 1, 1), date(2025, 1, 3), "bucket")
+    assert "submitted" == submitted["status"]
+    assert 3 == submitted["requests"]
+
+    result = main.poll_backfill(submitted["batch_id"], "bucket")
+    assert "completed" == result["status"]
+    assert 15 == result["count"]
+    assert 0 == result["failed_requests"]
+    records = read_partition(tmp_path, "2025-01-03")
+    assert 12 == len(records)
+    assert {"その他"} == {r["genre"] for r in records}
+    assert not (tmp_path / "bucket" / "categorized/date=2025-01-02").exists()
+
+    # キャッシュを使う場合は、すべてキャッシュから埋まるのでリクエストを送らない
+    again = main.submit_backfill(
+        date(2025, 1, 1), date(2025, 1, 3), "bucket", use_cache=True
+    )
+    assert 0 == again["requests"]
+    result = main.poll_backfill(again["batch_id"], "bucket")
+    assert 15 == result["count"]
+
+
+def test_backfill_failed_request(monkeypatch, tmp_path, make_df):
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path))
+    monkeypatch.setattr(
+        main,
+        "fetch",
+        lambda d, bucket_name: make_df([f"{d.day}-{i}" for i in range(2)]),
+    )
+    # 2件に対して1件分しか返ってこない
+    backend = LocalBatchBackend(
+        tmp_path / "batches",
+        responder=lambda body: '{"items": [{"number": 1, "genre": "SF"}]}',
+    )
+    monkeypatch.setattr(main, "get_batch_backend", lambda: backend)
+    submitted = main.submit_backfill(date(2025, 1, 1), date(2025, 1, 1), "bucket")
+    result = main.poll_backfill(submitted["batch_id"], "bucket")
+    assert 1 == result["failed_requests"]
+    assert 0 == result["count"]
+
+
+def test_backfill_keeps_previous_genres(monkeypatch, tmp_path, make_df):
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "fetch", lambda d, bucket_name: make_df(["1", "2"]))
+    main.save_categorized(
+        "bucket",
+        "2025-01-01",
+        make_df(["1", "2"]).assign(genre=["ホラー", "SF"]),
+    )
+    # 2件に対して1件分しか返ってこないので、どちらの結果も使えない
+    backend = LocalBatchBackend(
+        tmp_path / "batches",
+        responder=lambda body: '{"items": [{"number": 1, "genre": "SF"}]}',
+    )
+    monkeypatch.setattr(main, "get_batch_backend", lambda: backend)
+    submitted = main.submit_backfill(date(2025, 1, 1), date(2025, 1, 1), "bucket")
+    result = main.poll_backfill(submitted["batch_id"], "bucket")
+    assert 2 == result["restored"]
+    rows = read_partition(tmp_path, "2025-01-01")
+    assert {"1": "ホラー", "2": "SF"} == {r["isbn"]: r["genre"] for r in rows}
+
+
+def test_backfill_budget(monkeypatch, tmp_path, make_df):
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path))
+    monkeypatch.setenv("BATCH_BACKEND_DIR", str(tmp_path / "batches"))
+    monkeypatch.setattr(
+        main,
+        "fetch",
+        lambda d, bucket_name: make_df([f"{d.day}-{i}" for i in range(3)]),
+    )
+    monkeypatch.setattr(metering, "DEFAULT_TOKEN_BUDGET", 1)
+    over = main.submit_backfill(date(2025, 1, 1), date(2025, 1, 3), "bucket")
+    assert "over_budget" == over["status"]
+    assert "2025-01-01" == over["trimmed_from"]
+    assert not (tmp_path / "batches").exists()
+
+    monkeypatch.setattr(metering, "DEFAULT_TOKEN_BUDGET", 0)
+    full = main.submit_backfill(date(2025, 1, 1), date(2025, 1, 3), "bucket")
+    assert full["trimmed_from"] is None
+    assert full["estimated_cost_usd"] > 0
+
+    budget = full["estimated_tokens"] * 2 // 3
+    monkeypatch.setattr(metering, "DEFAULT_TOKEN_BUDGET", budget)
+    trimmed = main.submit_backfill(date(2025, 1, 1), date(2025, 1, 3), "bucket")
+    assert "submitted" == trimmed["status"]
+    assert "2025-01-03" == trimmed["trimmed_from"]
+    assert 2 == trimmed["requests"]
+    assert trimmed["estimated_tokens"] <= budget
@@ -0,0 +1,118 @@
+import pytest
+
+from llm_engine import ClassificationEngine, RateLimiter, make_batches
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class APITimeoutError(Exception):
+    pass
+
+
+LONG = "説明" * 1000
+
+
+def check(result, target):
+    assert len(result) == len(target)
+    return result
+
+
+def test_make_batches():
+    assert [[0, 1], [2], [3, 4]] == make_batches([10, 10, 30, 5, 5], max_tokens=30)
+    assert [[0, 1], [2, 3], [4]] == make_batches([1] * 5, max_items=2)
+    assert [[0], [1]] == make_batches([100, 100], max_tokens=30)
+
+
+def test_engine_keeps_order_and_index(make_df):
+    engine = ClassificationEngine(
+        lambda df: [f"g{i}" for i in df.index], check, workers=3, max_items=2
+    )
+    results = engine.run(make_df(5, description=LONG))
+    assert [[0, 1], [2, 3], [4]] == [list(t.index) for t, _ in results]
+    assert ["g4"] == results[2][1]
+
+
+def test_engine_retries_rate_limit(make_df):
+    calls = []
+
+    def classify(df):
+        calls.append(len(df))
+        if len(calls) == 1:
+            raise RateLimitError()
+        return ["SF"] * len(df)
+
+    engine = ClassificationEngine(classify, check, backoff=0.01)
+    results = engine.run(make_df(2, description=LONG))
+    assert [["SF", "SF"]] == [r for _, r in results]
+    assert 1 == engine.rate_limited
+    assert 2 == engine.requests
+
+
+def test_engine_raises_other_errors(make_df):
+    def classify(df):
+        raise ValueError()
+
+    engine = ClassificationEngine(classify, check)
+    with pytest.raises(ValueError):
+        engine.run(make_df(1, description=LONG))
+
+
+def test_engine_survives_transient_errors(make_df):
+    def classify(df):
+        # 3番目のバッチはタイムアウトし続ける
+        if 4 in df.index:
+            raise APITimeoutError()
+        return ["SF"] * len(df)
+
+    engine = ClassificationEngine(
+        classify, check, max_items=2, retries=1, backoff=0.01, retry_budget=0
+    )
+    results = engine.run(make_df(5, description=LONG))
+    assert [["SF"] * 2, ["SF"] * 2, None] == [r for _, r in results]
+    assert 2 == engine.counts["api_error"]
+    assert 1 == engine.counts["dropped"]
+
+
+def test_rate_limiter_waits(monkeypatch):
+    limiter = RateLimiter(rpm=60, tpm=1000)
+    limiter.acquire(1000)
+    sleeps = []
+    monkeypatch.setattr(
+        "llm_engine.time.sleep",
+        lambda s: sleeps.append(s) or setattr(limiter, "tokens", 1000),
+    )
+    limiter.acquire(100)
+    assert sleeps and sleeps[0] > 0
+
+
+def test_engine_bisects_failed_batches(make_df):
+    calls = []
+
+    def classify(df):
+        calls.append(list(df.index))
+        # 3番目の書籍を含むバッチは件数が合わない応答になる
+        if 3 in df.index:
+            return ["SF"] * (len(df) - 1) if len(df) > 1 else None
+        return ["SF"] * len(df)
+
+    engine = ClassificationEngine(classify, check, max_items=4)
+    results = engine.run(make_df(4, description=LONG))
+    assert [([0, 1], ["SF"] * 2), ([2], ["SF"]), ([3], None)] == [
+        (list(t.index), r) for t, r in results
+    ]
+    assert 1 == engine.counts["dropped"]
+    assert 1 == engine.counts["unparsable"]
+    assert 2 == engine.counts["mismatched"]
+    assert 2 == engine.counts["split"]
+
+
+def test_engine_retry_budget(make_df):
+    engine = ClassificationEngine(
+        lambda df: None, check, max_tokens=100000, max_items=8, retry_budget=2
+    )
+    results = engine.run(make_df(8, description=LONG))
+    assert [4, 4] == [len(t) for t, r in results if r is None]
+    assert 3 == engine.requests
+    assert 8 == engine.counts["dropped"]
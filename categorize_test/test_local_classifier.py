@@ -0,0 +1,182 @@
+from datetime import date
+import gzip
+import json
+
+import pandas as pd
+
+import main
+from local_classifier import (
+    LocalClassifier,
+    NaiveBayes,
+    RuleClassifier,
+    features,
+    gate_rules,
+    load_rules,
+)
+
+
+RULES = RuleClassifier(
+    {
+        "label": {"創元SF文庫": "SF"},
+        "publisher": {"フランス書院": "官能小説"},
+        "keyword": {"時代小説": "時代小説"},
+    }
+)
+
+
+def make_book(isbn, title, description, label=None, publisher="出版社"):
+    return dict(
+        isbn=isbn,
+        raw_title=title,
+        authors="著者",
+        title=title,
+        publisher=publisher,
+        description=description,
+        label=label,
+        keywords="",
+    )
+
+
+def samples():
+    for i in range(20):
+        yield make_book(f"m{i}", f"殺人事件{i}", "名探偵が密室の謎を解く"), "ミステリ"
+        yield make_book(f"s{i}", f"星間航路{i}", "宇宙船が銀河を航行する"), "SF"
+
+
+def test_rules():
+    assert "SF" == RULES.classify("創元SF文庫", "東京創元社", None)
+    assert "官能小説" == RULES.classify(None, "フランス書院", "")
+    assert "時代小説" == RULES.classify(float("nan"), "出版社", "歴史;時代小説")
+    assert RULES.classify("", "出版社", "歴史") is None
+
+
+def test_rule_gating():
+    rules = RuleClassifier({"label": {"創元推理文庫": "ミステリ"}, "publisher": {"東京創元社": "SF"}})
+    rows = [
+        dict(label="創元推理文庫", publisher="東京創元社", genre=genre)
+        for genre in ["ミステリ"] * 6 + ["SF"] * 3 + ["ホラー"]
+    ]
+    stats = rules.measure(rows)
+    assert {"support": 10, "agreed": 6} == stats["label:創元推理文庫"]
+    assert {"support": 10, "agreed": 3} == stats["publisher:東京創元社"]
+    assert ["label:創元推理文庫", "publisher:東京創元社"] == gate_rules(stats)
+    # 件数が足りないルールはそのまま使う
+    assert [] == gate_rules(stats, min_support=11)
+
+    rules.disabled.add("label:創元推理文庫")
+    assert "SF" == rules.classify("創元推理文庫", "東京創元社", None)
+    rules.disabled.add("publisher:東京創元社")
+    assert rules.classify("創元推理文庫", "東京創元社", None) is None
+
+
+def test_load_rules():
+    rules = load_rules()
+    assert "SF" == rules["label"]["創元SF文庫"]
+
+
+def test_naive_bayes():
+    model = NaiveBayes.fit(
+        (features(b["title"], b["description"], b["label"], b["publisher"]), g)
+        for b, g in samples()
+    )
+    genre, probability = model.predict(features("密室の謎", "名探偵", None, None))
+    assert "ミステリ" == genre
+    assert probability > 0.9
+    restored = NaiveBayes.from_dict(json.loads(json.dumps(model.to_dict())))
+    assert ("ミステリ", probability) == restored.predict(
+        features("密室の謎", "名探偵", None, None)
+    )
+
+
+def test_categorize_with_local(monkeypatch):
+    calls = []
+
+    def do_openai_api(df):
+        calls.append(list(df["isbn"]))
+        return {"items": [{"number": 1, "genre": "その他"}] * len(df)}
+
+    monkeypatch.setattr(main, "do_openai_api", do_openai_api)
+    df = pd.DataFrame(
+        [
+            make_book("1", "本1", "説明", label="創元SF文庫"),
+            make_book("2", "本2", "説明"),
+            make_book("3", "本3", "説明", publisher="フランス書院"),
+        ]
+    )
+    local = LocalClassifier(RULES)
+    result = main.categorize(df, local=local)
+    assert [["2"]] == calls
+    assert {"1": "SF", "2": "その他", "3": "官能小説"} == dict(
+        zip(result["isbn"], result["genre"])
+    )
+    assert {"rule": 2, "total": 3} == dict(local.counts)
+    assert {"1": "rule", "2": "llm", "3": "rule"} == dict(
+        zip(result["isbn"], result["source"])
+    )
+
+
+def write_jsonl(path, records):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, "wt") as f:
+        for r in records:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+
+def test_train_local_model(monkeypatch, tmp_path):
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path))
+    books = list(samples())
+    # ルールやシリーズの索引で決めた書籍と、source列のない古い結果は学習に使わない
+    others = [
+        (make_book("r1", "本", "説明", label="創元SF文庫"), "SF", "rule"),
+        (make_book("i1", "本", "説明"), "SF", "series_index"),
+        (make_book("o1", "本", "説明"), "SF", None),
+    ]
+    root = tmp_path / "bucket"
+    write_jsonl(
+        root / "new_books/date=2025-01-01/hanmoto.jsonl.gz",
+        [b for b, _ in books] + [b for b, _, _ in others],
+    )
+    rows = [
+        dict(isbn=b["isbn"], raw_title=b["raw_title"], genre=g, source="llm")
+        for b, g in books
+    ]
+    rows += [
+        dict(isbn=b["isbn"], raw_title=b["raw_title"], genre=g, source=s)
+        for b, g, s in others
+    ]
+    rows.append(dict(isbn="o1", raw_title="本", genre="SF"))
+    write_jsonl(root / "categorized/date=2025-01-01/novel.jsonl.gz", rows)
+    result = main.train_local_model(
+        date(2025, 1, 1), date(2025, 1, 2), "bucket", holdout=0.2
+    )
+    assert "trained" == result["status"]
+    assert 40 == result["train"] + result["holdout"]["total"]
+    local = main.load_local_classifier("bucket")
+    assert local.model is not None
+    genre, source = local.classify_row(make_book("x", "密室の殺人事件", "名探偵が謎を解く"))
+    assert ("ミステリ", "model") == (genre, source)
+
+
+def test_train_local_model_disables_rules(monkeypatch, tmp_path):
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "load_rules", lambda: {"label": {"創元推理文庫": "ミステリ"}})
+    # 創元推理文庫にはSFやホラーも含まれる
+    books = [
+        (make_book(f"b{i}", f"本{i}", "説明", label="創元推理文庫"), genre)
+        for i, genre in enumerate(["ミステリ"] * 5 + ["SF"] * 3 + ["ホラー"] * 2)
+    ]
+    root = tmp_path / "bucket"
+    write_jsonl(
+        root / "new_books/date=2025-01-01/hanmoto.jsonl.gz", [b for b, _ in books]
+    )
+    write_jsonl(
+        root / "categorized/date=2025-01-01/novel.jsonl.gz",
+        [
+            dict(isbn=b["isbn"], raw_title=b["raw_title"], genre=g, source="llm")
+            for b, g in books
+        ],
+    )
+    result = main.train_local_model(date(2025, 1, 1), date(2025, 1, 1), "bucket")
+    assert ["label:創元推理文庫"] == result["disabled_rules"]
+    local = main.load_local_classifier("bucket")
+    assert local.rules.classify("創元推理文庫", "東京創元社", None) is None
@@ -0,0 +1,80 @@
+from datetime import date
+import gzip
+import json
+
+import main
+from genre_cache import GenreCache
+
+
+def fake_openai(calls):
+    def do_openai_api(df):
+        calls.append(list(df["isbn"]))
+        return {
+            "items": [
+                {"number": i + 1, "genre": f"SF{isbn[-1]}"}
+                for i, isbn in enumerate(df["isbn"])
+            ]
+        }
+
+    return do_openai_api
+
+
+def test_categorize_uses_cache(monkeypatch, make_df):
+    calls = []
+    monkeypatch.setattr(main, "do_openai_api", fake_openai(calls))
+    cache = GenreCache()
+    first = main.categorize(make_df(7), cache)
+    assert 7 == sum(len(c) for c in calls)
+    assert 7 == len(first)
+
+    calls.clear()
+    second = main.categorize(make_df(8), cache)
+    assert [["9780000000007"]] == calls
+    assert 8 == len(second)
+    genres = dict(zip(second["isbn"], second["genre"]))
+    assert "SF3" == genres["9780000000003"]
+    assert "SF7" == genres["9780000000007"]
+
+
+def test_categorize_description_changed(monkeypatch, make_df):
+    calls = []
+    monkeypatch.setattr(main, "do_openai_api", fake_openai(calls))
+    cache = GenreCache()
+    main.categorize(make_df(3), cache)
+    calls.clear()
+    main.categorize(make_df(3, description="新しい説明"), cache)
+    assert 1 == len(calls)
+
+
+def test_genre_cache_save_and_load(monkeypatch, tmp_path):
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path))
+    cache = GenreCache()
+    cache.put("9780000000001", "abc", "SF")
+    main.save_genre_cache("bucket", cache)
+    loaded = main.load_genre_cache("bucket")
+    assert "SF" == loaded.get("9780000000001", "abc")
+    assert loaded.get("9780000000001", "def") is None
+
+
+def test_fetch_gcs(monkeypatch, tmp_path):
+    books = [
+        dict(isbn="1", c_code="0093", description="説明"),
+        dict(isbn="2", c_code="0097", description="説明", series="シリーズ"),
+        dict(isbn="3", c_code="9093", description="説明"),
+        dict(isbn="4", c_code="0095", description="説明"),
+        dict(isbn="5", c_code="0093", description=""),
+        dict(isbn="6", c_code=None, description="説明"),
+        dict(isbn="7", c_code="", description="説明"),
+        dict(isbn="8", c_code="C0093", description="説明"),
+    ]
+    path = tmp_path / "bucket" / "new_books/date=2025-01-01/hanmoto.jsonl.gz"
+    path.parent.mkdir(parents=True)
+    with gzip.open(path, "wt") as f:
+        for book in books:
+            f.write(json.dumps(dict(book, title="本", label=None)) + "\n")
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path))
+    df = main.fetch(date(2025, 1, 1), "bucket")
+    assert main.COLUMNS == list(df.columns)
+    assert ["1", "2"] == list(df["isbn"])
+    assert "シリーズ" == df["series"][1]
+    assert 0 == len(main.fetch(date(2025, 1, 2), "bucket"))
@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import metering
+from llm_engine import ClassificationEngine
+from metering import (
+    BudgetExceeded,
+    MeteredClient,
+    cost,
+    estimate_batch_cost,
+    start_run,
+    within_budget,
+)
+
+
+class FakeRaw:
+    retries_taken = 1
+
+    def parse(self):
+        usage = SimpleNamespace(
+            prompt_tokens=1000,
+            completion_tokens=100,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=500),
+        )
+        return SimpleNamespace(usage=usage)
+
+
+def fake_client():
+    create = lambda **kwargs: FakeRaw()  # noqa: E731
+    raw = SimpleNamespace(create=create)
+    completions = SimpleNamespace(with_raw_response=raw)
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions), files="files")
+
+
+def test_cost():
+    usage = dict(prompt_tokens=1000, cached_tokens=500, completion_tokens=100)
+    assert pytest.approx((500 * 0.4 + 500 * 0.1 + 100 * 1.6) / 1e6) == cost(
+        "gpt-4.1-mini", usage
+    )
+    assert 0.0 == cost("unknown", usage)
+
+
+def test_within_budget():
+    assert within_budget(100, 1.0, token_budget=0, cost_budget=0)
+    assert within_budget(100, 1.0, token_budget=100, cost_budget=1.0)
+    assert not within_budget(101, 1.0, token_budget=100, cost_budget=0)
+    assert not within_budget(100, 1.5, token_budget=0, cost_budget=1.0)
+    assert 0.5 * cost(
+        "gpt-4.1", dict(prompt_tokens=1000, cached_tokens=0, completion_tokens=100)
+    ) == estimate_batch_cost("gpt-4.1", 1000, 100)
+
+
+def test_metered_client_budget():
+    meter = start_run(token_budget=2000)
+    client = MeteredClient(fake_client())
+    assert "files" == client.files
+    client.chat.completions.create(model="gpt-4.1-mini", batch_size=5)
+    client.chat.completions.create(model="gpt-4.1-mini", batch_size=5)
+    with pytest.raises(BudgetExceeded):
+        client.chat.completions.create(model="gpt-4.1-mini", batch_size=5)
+    summary = meter.summary()
+    assert 2 == summary["calls"]
+    assert 2000 == summary["prompt_tokens"]
+    assert 2 == summary["retries"]
+    assert summary["budget_exceeded"]
+    assert metering.current is meter
+
+
+def test_engine_stops_on_budget():
+    calls = []
+
+    def classify(df):
+        calls.append(len(df))
+        if len(calls) > 1:
+            raise BudgetExceeded()
+        return ["SF"] * len(df)
+
+    df = pd.DataFrame(
+        dict(
+            isbn=[str(i) for i in range(6)],
+            authors="著者",
+            title="本",
+            publisher="出版社",
+            description="説明",
+            label=None,
+        )
+    )
+    engine = ClassificationEngine(classify, lambda r, t: r, workers=1, max_items=2)
+    results = engine.run(df)
+    assert [["SF", "SF"], None, None] == [r for _, r in results]
+    assert 4 == engine.counts["budget_skipped"]
+    assert 0 == engine.counts["split"]
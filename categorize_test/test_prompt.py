@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+from prompt import build_books, clean_descriptions, truncate_tokens, usage_record
+
+
+def test_build_books():
+    df = pd.DataFrame(
+        dict(
+            authors=["著者A", "著者B"],
+            title=["本A", "本B"],
+            publisher=["出版社A", "出版社B"],
+            description=["説明\nA", "説明B"],
+            label=["レーベル", None],
+        ),
+        index=[5, 6],
+    )
+    assert (
+        '# BOOKS\n6. 著者A『本A』(レーベル)出版社A\n    "説明 A"\n' '7. 著者B『本B』出版社B\n    "説明B"'
+    ) == build_books(df)
+
+
+def test_clean_descriptions():
+    descriptions = pd.Series(
+        [
+            "【電子書籍限定特典付き】宇宙の物語。※画像は実際と異なります\n詳しくは https://example.com",
+            "密室の謎。【著者紹介】1980年生まれ。",
+            None,
+        ]
+    )
+    assert ["宇宙の物語。 詳しくは", "密室の謎。", ""] == list(clean_descriptions(descriptions))
+
+
+def test_truncate_tokens():
+    assert "あ" * 10 == truncate_tokens("あ" * 20, 10)
+    assert "a" * 40 == truncate_tokens("a" * 50, 10)
+    assert "短い" == truncate_tokens("短い", 10)
+
+
+def test_usage_record():
+    usage = SimpleNamespace(
+        prompt_tokens=1200,
+        completion_tokens=50,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=1024),
+    )
+    assert dict(
+        batch_size=5, prompt_tokens=1200, cached_tokens=1024, completion_tokens=50
+    ) == usage_record(SimpleNamespace(usage=usage), 5)
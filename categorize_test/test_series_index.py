@@ -0,0 +1,40 @@
+import main
+from series_index import SeriesIndex
+
+
+def test_lookup():
+    index = SeriesIndex()
+    index.add("シリーズA", "レーベル", "ライトノベル")
+    assert index.lookup("シリーズA", None) is None
+    index.add("シリーズA ", "レーベル", "ライトノベル")
+    assert "ライトノベル" == index.lookup("シリーズA", None)
+    index.add("シリーズB", None, "SF")
+    index.add("シリーズB", None, "ホラー")
+    assert index.lookup("シリーズB", "レーベル") is None
+    # シリーズが未知の場合は、十分な冊数があるレーベルの分布を使う
+    for _ in range(20):
+        index.add(None, "ホラー文庫", "ホラー")
+    assert "ホラー" == index.lookup("新シリーズ", "ホラー文庫")
+    assert index.lookup(None, "レーベル") is None
+    restored = SeriesIndex.loads(index.dumps())
+    assert "ホラー" == restored.lookup(float("nan"), "ホラー文庫")
+
+
+def test_categorize_with_index(monkeypatch, make_df):
+    calls = []
+
+    def do_openai_api(df):
+        calls.append(list(df["isbn"]))
+        return {"items": [{"number": 1, "genre": "ライトノベル"}] * len(df)}
+
+    monkeypatch.setattr(main, "do_openai_api", do_openai_api)
+    index = SeriesIndex()
+    main.categorize(make_df(["1", "2"], series="S"), index=index)
+    assert 1 == len(calls)
+    calls.clear()
+    result = main.categorize(make_df(["3", "4"], series=["S", "T"]), index=index)
+    assert [["4"]] == calls
+    assert 1 == index.hits
+    assert {"3": "ライトノベル", "4": "ライトノベル"} == dict(zip(result["isbn"], result["genre"]))
+    # インデックスで決めた巻は分布に加えない
+    assert {"ライトノベル": 2} == index.series["S"]
@@ -0,0 +1,157 @@
+"""
+OpenBDと版元ドットコムから取得した追加情報をISBNごとにキャッシュするモジュール。
+
+キャッシュはgzip圧縮したJSONとしてGCSに保存し、1回の実行につき1度だけ読み込みます。
+取得できなかったISBNも短いTTLで記録して、同じISBNへの問い合わせを繰り返さないようにします。
+"""
+
+from typing import Callable, Dict, Iterable, List
+import json
+import os
+import time
+
+
+CACHE_PATH = "enrichment_cache/cache.json.gz"
+CACHE_VERSION = 1
+DAY = 24 * 60 * 60
+DEFAULT_TTL = float(os.environ.get("ENRICHMENT_CACHE_TTL_DAYS", "7")) * DAY
+DEFAULT_NEGATIVE_TTL = (
+    float(os.environ.get("ENRICHMENT_CACHE_NEGATIVE_TTL_DAYS", "1")) * DAY
+)
+
+
+class EnrichmentCache:
+    """ソース（openbd, hanmotoなど）ごとにISBNをキーとして値を保持するキャッシュ。
+
+    値がNoneのエントリーは「取得できなかった」ことを表すネガティブキャッシュとして扱います。
+
+    :param entries: ソース名をキー、{ISBN: [保存時刻, 値]}を値とする辞書
+    :param float ttl: 値があるエントリーの有効期間（秒）
+    :param float negative_ttl: 値がNoneのエントリーの有効期間（秒）
+    """
+
+    def __init__(
+        self,
+        entries: Dict = None,
+        ttl: float = DEFAULT_TTL,
+        negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+    ):
+        self.entries = entries or {}
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def is_fresh(self, entry: List, now: float) -> bool:
+        """エントリーが有効期間内かどうかを判定する関数。"""
+        saved_at, value = entry
+        ttl = self.negative_ttl if value is None else self.ttl
+        return now - saved_at < ttl
+
+    def get(self, source: str, key: str, now: float = None):
+        """キャッシュから値を取得する関数。
+
+        :param str source: ソース名
+        :param str key: ISBN
+        :return: (ヒットしたかどうか, 値)のタプル
+        :rtype: tuple
+        """
+        now = time.time() if now is None else now
+        entry = self.entries.get(source, {}).get(key)
+        if entry is None or not self.is_fresh(entry, now):
+            return False, None
+        return True, entry[1]
+
+    def put(self, source: str, key: str, value, now: float = None):
+        """キャッシュに値を保存する関数。
+
+        :param str source: ソース名
+        :param str key: ISBN
+        :param value: 保存する値。取得できなかった場合はNone
+        """
+        now = time.time() if now is None else now
+        self.entries.setdefault(source, {})[key] = [now, value]
+        self.dirty = True
+
+    def discard(self, keys: Iterable[str]):
+        """すべてのソースから指定したISBNのエントリーを削除する関数。
+
+        :param keys: 削除するISBN
+        """
+        for values in self.entries.values():
+            for key in keys:
+                if values.pop(key, None) is not None:
+                    self.dirty = True
+
+    def lookup(self, source: str, keys: Iterable[str], fetch: Callable) -> Dict:
+        """キャッシュを参照し、ミスしたキーだけをまとめてfetchで取得する関数。
+
+        fetchの戻り値で値がNoneのキーはネガティブキャッシュし、
+        戻り値に含まれないキーは取得に失敗したものとしてキャッシュしません。
+
+        :param str source: ソース名
+        :param keys: 取得したいISBNのリスト
+        :param fetch: ISBNのリストを受け取り、ISBNをキーとした辞書を返す関数
+        :return: ISBNをキー、値を値とする辞書（値が取得できなかったISBNは含まない）
+        :rtype: dict
+        """
+        now = time.time()
+        result = {}
+        misses = []
+        for key in dict.fromkeys(keys):
+            hit, value = self.get(source, key, now)
+            if not hit:
+                misses.append(key)
+                continue
+            self.hits += 1
+            if value is not None:
+                result[key] = value
+        self.misses += len(misses)
+        if misses:
+            fetched = fetch(misses)
+            for key in misses:
+                if key not in fetched:
+                    continue
+                value = fetched[key]
+                self.put(source, key, value, now)
+                if value is not None:
+                    result[key] = value
+        return result
+
+    def dumps(self) -> str:
+        """期限切れのエントリーを除いてJSON文字列に変換する関数。
+
+        :return: JSON文字列
+        :rtype: str
+        """
+        now = time.time()
+        entries = {
+            source: {k: v for k, v in values.items() if self.is_fresh(v, now)}
+            for source, values in self.entries.items()
+        }
+        return json.dumps(
+            dict(version=CACHE_VERSION, entries=entries),
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def loads(cls, text: str, **kwargs) -> "EnrichmentCache":
+        """JSON文字列からキャッシュを復元する関数。
+
+        空文字列やバージョンが異なる場合は空のキャッシュを返します。
+
+        :param str text: dumpsで作成したJSON文字列
+        :return: 復元したキャッシュ
+        :rtype: EnrichmentCache
+        """
+        if not text:
+            return cls(**kwargs)
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            return cls(**kwargs)
+        if data.get("version") != CACHE_VERSION:
+            return cls(**kwargs)
+        return cls(data["entries"], **kwargs)
@@ -0,0 +1,183 @@
+"""
+版元ドットコムの書籍詳細ページからCコードと書籍説明を抽出するモジュール。
+
+ページ全体をBeautifulSoupで木構造にする代わりに、対象のdiv要素の開始位置を文字列検索で見つけ、
+そこから標準ライブラリのHTMLParserで必要な要素だけを読んで、見つかった時点で打ち切ります。
+抽出に失敗した場合はBeautifulSoupでの解析にフォールバックします。
+bs4はフォールバックで初めて使う時点で読み込みます。
+"""
+
+from html.parser import HTMLParser
+from typing import Callable, Dict, Optional
+import os
+import re
+
+from startup import timed
+
+
+CCODE_DIV = re.compile(r"<div\b[^>]*\bclass\s*=\s*[\"'][^\"']*\bbook-ccode-num\b")
+CONTENTS_DIV = re.compile(r"<div\b[^>]*\bclass\s*=\s*[\"'][^\"']*\bbook-contents\b")
+DEFAULT_BACKEND = os.environ.get("HANMOTO_EXTRACTOR", "scan")
+
+
+class _Stop(Exception):
+    pass
+
+
+class _TextParser(HTMLParser):
+    """divの開始タグから読み始め、対象要素のテキストを集めるパーサー。
+
+    target_tagがdivの場合は最初のdiv自身、pの場合はそのdiv内の最初のp要素のテキストを集め、
+    要素が閉じた時点で解析を打ち切ります。
+
+    :param str target_tag: テキストを集める要素のタグ名
+    """
+
+    def __init__(self, target_tag: str):
+        super().__init__(convert_charrefs=True)
+        self.target_tag = target_tag
+        self.div_depth = 0
+        self.target_depth = None
+        self.texts = []
+        self.found = False
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self.skip_depth += 1
+        if tag == self.target_tag:
+            if self.target_depth is None:
+                self.target_depth = 0
+                self.found = True
+            else:
+                self.target_depth += 1
+        if tag == "div":
+            self.div_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self.skip_depth > 0:
+            self.skip_depth -= 1
+        if tag == self.target_tag and self.target_depth is not None:
+            if self.target_depth == 0:
+                raise _Stop()
+            self.target_depth -= 1
+        if tag == "div":
+            self.div_depth -= 1
+            if self.div_depth <= 0:
+                raise _Stop()
+
+    def handle_data(self, data):
+        if self.target_depth is not None and self.skip_depth == 0:
+            self.texts.append(data)
+
+    def text(self) -> Optional[str]:
+        if not self.found:
+            return None
+        return "".join(self.texts)
+
+
+def _find_start(html: str, pattern: re.Pattern) -> Optional[int]:
+    """script要素の中を除いて、patternに最初に一致する位置を返す関数。
+
+    :param str html: ページのHTML
+    :param pattern: 検索する正規表現
+    :return: 一致した位置。見つからない場合はNone
+    """
+    pos = 0
+    while True:
+        match = pattern.search(html, pos)
+        if match is None:
+            return None
+        start = match.start()
+        if html.rfind("<script", 0, start) <= html.rfind("</script", 0, start):
+            return start
+        pos = match.end()
+
+
+def _element_text(html: str, pattern: re.Pattern, target_tag: str) -> Optional[str]:
+    """patternに一致するdivから、対象要素のテキストを抽出する関数。
+
+    :param str html: ページのHTML
+    :param pattern: 対象のdivの開始タグに一致する正規表現
+    :param str target_tag: テキストを集める要素のタグ名
+    :return: 要素のテキスト。見つからない場合はNone
+    """
+    start = _find_start(html, pattern)
+    if start is None:
+        return None
+    parser = _TextParser(target_tag)
+    chunk_size = 4096
+    try:
+        for i in range(start, len(html), chunk_size):
+            parser.feed(html[i : i + chunk_size])
+        parser.close()
+    except _Stop:
+        pass
+    return parser.text()
+
+
+def extract_scan(html: str) -> Dict:
+    """対象の要素だけを読んでCコードと書籍説明を抽出する関数。
+
+    :param str html: 書籍詳細ページのHTML
+    :return: Cコードと書籍説明を含む辞書
+    :rtype: dict
+    """
+    ccode_text = _element_text(html, CCODE_DIV, "div")
+    ccode = ccode_text.strip().split()[0][1:] if ccode_text else None
+    description_text = _element_text(html, CONTENTS_DIV, "p")
+    description = description_text.strip() if description_text is not None else None
+    return {"ccode": ccode, "description": description}
+
+
+def extract_bs4(html: str) -> Dict:
+    """BeautifulSoupでページ全体を解析してCコードと書籍説明を抽出する関数。
+
+    :param str html: 書籍詳細ページのHTML
+    :return: Cコードと書籍説明を含む辞書
+    :rtype: dict
+    """
+    with timed("import:bs4"):
+        from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+
+    # Extract C-code
+    ccode_element = soup.select_one("div.book-ccode-num")
+    ccode = ccode_element.text.strip().split()[0][1:] if ccode_element else None
+
+    # Extract description
+    description_element = soup.select_one("div.book-contents p")
+    description = description_element.text.strip() if description_element else None
+
+    return {"ccode": ccode, "description": description}
+
+
+BACKENDS: Dict[str, Callable[[str], Dict]] = {
+    "scan": extract_scan,
+    "bs4": extract_bs4,
+}
+
+
+def extract(html: str, backend: str = DEFAULT_BACKEND) -> Dict:
+    """指定したバックエンドでCコードと書籍説明を抽出する関数。
+
+    バックエンドで例外が発生した場合や、どちらの項目も見つからなかった場合は
+    BeautifulSoupでの解析にフォールバックします。
+
+    :param str html: 書籍詳細ページのHTML
+    :param str backend: 使用するバックエンド名（scan または bs4）
+    :return: Cコードと書籍説明を含む辞書
+    :rtype: dict
+    """
+    func = BACKENDS[backend]
+    if func is extract_bs4:
+        return extract_bs4(html)
+    try:
+        result = func(html)
+    except Exception as e:
+        print("Failed to extract book info with", backend, e)
+        return extract_bs4(html)
+    if result["ccode"] is None and result["description"] is None:
+        return extract_bs4(html)
+    return result
@@ -8,25 +8,48 @@ Google Cloud Storageに保存するCloud Functions用のスクリプト。
 3. 取得したデータをGCS上に日付ごとにgzip圧縮したJSONLファイルとして保存
 """
 
-from bs4 import BeautifulSoup
+from collections import defaultdict
 from datetime import date, datetime, timedelta
-from google.cloud import storage
-from typing import Dict, NamedTuple
-import feedparser
+from typing import Dict, Iterable, List, NamedTuple, Optional
 import functions_framework
-import google.api_core.exceptions
-import gzip
+import hashlib
 import json
 import os
 import pytz
-import random
-import requests
 import re
-import tempfile
-import time
+
+from crawler import HanmotoCrawler
+from enrich_cache import CACHE_PATH, EnrichmentCache
+from extractor import extract
+from gcs_io import GzipWriter, JsonlGzipWriter, get_storage, iter_jsonl
+from onix import parse_record
+from openbd import OpenBDClient
+from parquet_writer import write_parquet
+from startup import mark, report, timed
 
 
 ENABLE_CRAWLING = True
+HANMOTO_BASE_URL = os.environ.get("HANMOTO_BASE_URL", "https://www.hanmoto.com")
+# マニフェストを信用する期間。バケットのライフサイクル(50日)で消える前に保存し直す
+MANIFEST_MAX_AGE_DAYS = 30
+# 保存する形式（jsonl, parquet のカンマ区切り）。差分取得はjsonlのパーティションを読む
+OUTPUT_FORMATS = os.environ.get("OUTPUT_FORMATS", "jsonl").split(",")
+# 差分取得で変更の有無を比較する、フィード由来の項目
+FEED_FIELDS = (
+    "id",
+    "raw_title",
+    "title",
+    "authors",
+    "publisher",
+    "publish_date",
+    "link",
+)
+# 期間指定で取得する際に、1回のフィードで取得する日数
+RANGE_WINDOW_DAYS = int(os.environ.get("RANGE_WINDOW_DAYS", "7"))
+# 1回のフィードで返るエントリー数の上限。これ以上返ってきた期間は途中で切れている可能性があるので分割する
+FEED_MAX_ENTRIES = int(os.environ.get("FEED_MAX_ENTRIES", "1000"))
+crawler = None
+openbd_client = None
 
 
 class HanmotoData(NamedTuple):
@@ -96,81 +119,60 @@ class HanmotoData(NamedTuple):
         )
 
 
+def get_crawler() -> HanmotoCrawler:
+    """版元ドットコム用のクローラーを取得する関数。初回呼び出し時に作成する。
+
+    :return: 共有のクローラー
+    :rtype: HanmotoCrawler
+    """
+    global crawler
+    if crawler is None:
+        crawler = HanmotoCrawler()
+    return crawler
+
+
 def get_book_info(isbn):
     """版元ドットコムの書籍詳細ページからCコードと書籍説明を取得する関数。
     :param isbn: 書籍のISBNコード
-    :return: Cコードと書籍説明を含む辞書
+    :return: Cコードと書籍説明を含む辞書。ページが存在しない場合はNone
+    :raises FetchFailed: リトライしてもページを取得できなかった場合
     """
-    url = f"https://www.hanmoto.com/bd/isbn/{isbn}"
-    try:
-        response = requests.get(
-            url,
-            headers={
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
-            },
-        )
-        response.raise_for_status()  # Raises HTTPError for bad requests (4xx or 5xx)
-    except requests.exceptions.RequestException as e:
+    url = f"{HANMOTO_BASE_URL}/bd/isbn/{isbn}"
+    html = get_crawler().get(url)
+    if html is None:
         return None
+    return parse_book_page(html)
 
-    soup = BeautifulSoup(response.text, "html.parser")
-    return_value = {}
-
-    # Extract book title
-    # title_element = soup.select_one('h1.book-title-block span.book-title')
-    # title = title_element.text.strip() if title_element else "Title not found"
-
-    # Extract author
-    # author_elements = soup.select('div.book-authors a.book-author span.book-author-name')
-    # authors = [a.text.strip() for a in author_elements] if author_elements else ["Author not found"]
-    # author = ", ".join(authors)
 
-    # Extract publisher
-    # publisher_element = soup.select_one('div.book-publishers a.book-imprint')
-    # publisher = publisher_element.text.strip() if publisher_element else "Publisher not found"
+def parse_book_page(html: str):
+    """版元ドットコムの書籍詳細ページのHTMLからCコードと書籍説明を抽出する関数。
 
-    # Extract C-code
-    ccode_element = soup.select_one("div.book-ccode-num")
-    ccode = ccode_element.text.strip().split()[0][1:] if ccode_element else None
+    抽出方法は環境変数HANMOTO_EXTRACTORで切り替えられます（既定はscan）。
 
-    # Extract description
-    description_element = soup.select_one("div.book-contents p")
-    description = description_element.text.strip() if description_element else None
-
-    return {"ccode": ccode, "description": description}
+    :param html: 書籍詳細ページのHTML
+    :return: Cコードと書籍説明を含む辞書
+    """
+    return extract(html)
 
 
-def upload_gcs(bucket_name: str, path: str, local_path):
-    """ローカルファイルをGoogle Cloud Storageにアップロードする関数。
+def download_gcs(bucket_name: str, path: str) -> str:
+    """Google Cloud Storageからファイルをダウンロードしてテキストとして返す関数。
 
     :param bucket_name: GCSバケット名
     :param path: GCS上のファイルパス
-    :param local_path: アップロードするローカルファイルのパス
+    :return: ダウンロードしたファイルの内容（テキスト）。ファイルが存在しない場合は空文字列を返す。
     """
-    project = os.environ["PROJECT_NAME"]
-    storage_client = storage.Client(project=project)
-    bucket = storage_client.get_bucket(bucket_name)
-    blob = bucket.blob(path)
-    blob.content_encoding = "gzip"
-    blob.upload_from_filename(local_path)
+    return get_storage(bucket_name).read_text(path)
 
 
-def download_gcs(bucket_name: str, path: str) -> str:
-    """Google Cloud Storageからファイルをダウンロードしてテキストとして返す関数。
+def download_gcs_jsonl(bucket_name: str, path: str):
+    """Google Cloud Storageのgzip圧縮されたJSONLファイルを少しずつ読み込む関数。
 
     :param bucket_name: GCSバケット名
     :param path: GCS上のファイルパス
-    :return: ダウンロードしたファイルの内容（テキスト）。ファイルが存在しない場合は空文字列を返す。
+    :yield: 各行の辞書。ファイルが存在しない場合は何も返さない
     """
-    project = os.environ["PROJECT_NAME"]
-    storage_client = storage.Client(project=project)
-    bucket = storage_client.get_bucket(bucket_name)
-    blob = bucket.blob(path)
-    blob.content_encoding = "gzip"
-    try:
-        return blob.download_as_text()
-    except google.api_core.exceptions.NotFound:
-        return ""
+    yield from iter_jsonl(get_storage(bucket_name), path)
 
 
 def get_title_detail(onix):
@@ -198,6 +200,8 @@ def get_title_detail(onix):
 def parse_openbd(record):
     """OpenBDから取得した書籍レコードを解析し、必要な情報を抽出する関数。
 
+    実際の取得処理では同じ結果を返すonix.parse_recordを使います。
+
     :param record: OpenBDから取得した書籍レコード
     :return: 抽出した書籍情報を含む辞書（タイトル、説明、著者、キーワード、Cコード、レーベル、シリーズなど）
     """
@@ -235,22 +239,27 @@ def parse_openbd(record):
     )
 
 
+def get_openbd_client() -> OpenBDClient:
+    """OpenBD APIのクライアントを取得する関数。初回呼び出し時に作成する。
+
+    :return: 共有のクライアント
+    :rtype: OpenBDClient
+    """
+    global openbd_client
+    if openbd_client is None:
+        openbd_client = OpenBDClient(parse_record)
+    return openbd_client
+
+
 def fetch_openbk(isbns):
     """OpenBD APIを使用して複数のISBNコードに対応する書籍情報を取得する関数。
 
+    ISBNはチャンクに分割して並列に問い合わせ、失敗したチャンクだけをリトライします。
+
     :param isbns: 取得したい書籍のISBNコードのリスト
-    :return: ISBNコードをキー、書籍情報を値とする辞書
+    :return: ISBNコードをキー、書籍情報を値とする辞書。OpenBDに登録がないISBNの値はNone
     """
-    base_url = "https://api.openbd.jp/v1/get?isbn=" + ",".join(isbns)
-    resp = requests.get(base_url).json()
-    return_value = {}
-    for d in resp:
-        if d is None:
-            continue
-        onix = d["onix"]
-        idbn = onix["RecordReference"]
-        return_value[idbn] = parse_openbd(d)
-    return return_value
+    return get_openbd_client().fetch(isbns)
 
 
 def parse_date(date_str: str) -> str:
@@ -275,63 +284,91 @@ def parse_title(raw_title: str):
     return reg.match(raw_title).groupdict()
 
 
-def handle_entries(entries):
+def parse_entry(entry) -> HanmotoData:
+    """RSSフィードのエントリーから、追加情報を含まない書籍データを作る関数。
+
+    :param entry: RSSフィードのエントリー
+    :return: 書籍データ
+    :rtype: HanmotoData
+    """
+    raw_title = entry["title"]
+    id_ = entry["id"]
+    link = entry["link"]
+    published = entry["published"]  # 'Wed, 05 Jul 2023 00:00:00 +0900'
+    date = parse_date(published)
+    isbn = id_.split("/")[-1]
+    title = parse_title(raw_title)
+    return HanmotoData(
+        id_,
+        raw_title,
+        title["title"],
+        title["author"],
+        title["publisher"],
+        date,
+        link,
+        isbn,
+    )
+
+
+def handle_entries(entries, cache: Optional[EnrichmentCache] = None):
     """RSSフィードから取得したエントリーを処理し、書籍データを構造化する関数。
 
+    OpenBDと版元ドットコムへの問い合わせは、キャッシュにないISBNだけに対して行います。
+
     :param entries: RSSフィードから取得したエントリーのリスト
+    :param cache: 追加情報のキャッシュ。省略した場合は常に問い合わせる
     :return: 構造化された書籍データのリスト
     """
-    isbns = []
-    book_data = []
+    if cache is None:
+        cache = EnrichmentCache()
     print(len(entries))
-    for entry in entries:
-        raw_title = entry["title"]
-        id_ = entry["id"]
-        link = entry["link"]
-        published = entry["published"]  # 'Wed, 05 Jul 2023 00:00:00 +0900'
-        date = parse_date(published)
-        isbn = id_.split("/")[-1]
-        title = parse_title(raw_title)
-        data = HanmotoData(
-            id_,
-            raw_title,
-            title["title"],
-            title["author"],
-            title["publisher"],
-            date,
-            link,
-            isbn,
+    book_data = [parse_entry(entry) for entry in entries]
+    isbns = [bd.isbn for bd in book_data]
+    openbd_data = cache.lookup("openbd", isbns, fetch_openbk)
+    book_data = [
+        bd._replace(openbd=openbd_data[bd.isbn]) if bd.isbn in openbd_data else bd
+        for bd in book_data
+    ]
+    hanmotoweb_data = {}
+    if ENABLE_CRAWLING:
+        targets = [
+            bd.isbn
+            for bd in book_data
+            if bd.openbd is None
+            or not bd.openbd["description"]
+            or not bd.openbd["c_code"]
+        ]
+        hanmotoweb_data = cache.lookup(
+            "hanmoto", targets, lambda x: get_crawler().map(get_book_info, x)
+        )
+        print(
+            "Got book info from hanmoto.com:",
+            sum(1 for v in hanmotoweb_data.values() if v),
+            "/",
+            len(targets),
         )
-        book_data.append(data)
-        isbns.append(isbn)
-    openbd_data = fetch_openbk(isbns)
     return_values = []
     for bd in book_data:
-        if bd.isbn in openbd_data:
-            bd = bd._replace(openbd=openbd_data[bd.isbn])
-        if ENABLE_CRAWLING and (
-            bd.openbd is None or not bd.openbd["description"] or not bd.openbd["c_code"]
-        ):
-            from_hanmotoweb = get_book_info(bd.isbn)
-            if from_hanmotoweb:
-                print("Got book info from hanmoto.com for ISBN:", bd.isbn)
-                bd = bd._replace(from_hanmotoweb=from_hanmotoweb)
-            else:
-                print("Failed to get book info from hanmoto.com for ISBN:", bd.isbn)
-            sleep_time = random.randint(3, 10) / 10.0
-            time.sleep(sleep_time)
+        from_hanmotoweb = hanmotoweb_data.get(bd.isbn)
+        if from_hanmotoweb:
+            bd = bd._replace(from_hanmotoweb=from_hanmotoweb)
         return_values.append(bd.to_dict())
     return return_values
 
 
-def get_url(date_int: int) -> str:
+def get_url(date_int: int, end_date_int: Optional[int] = None) -> str:
     """指定された日数オフセットに基づいて版元ドットコムのRSS URL を生成する関数。
 
     :param date_int: 現在の日付からの日数オフセット（正の値は未来、負の値は過去）
+    :param end_date_int: 期間の終わりの日数オフセット。省略した場合はdate_intの1日分
     :return: 版元ドットコムのRSS URL
     """
-    day = f"{date_int}day"
-    url = f"https://www.hanmoto.com/ci/bd/search/sdate/{day}/edate/{day}/order/asc/vw/rss20/"
+    if end_date_int is None:
+        end_date_int = date_int
+    sday = f"{date_int}day"
+    eday = f"{end_date_int}day"
+    search = f"{HANMOTO_BASE_URL}/ci/bd/search"
+    url = f"{search}/sdate/{sday}/edate/{eday}/order/asc/vw/rss20/"
     return url
 
 
@@ -350,68 +387,497 @@ def fetch_feed_by_date(target_date: date):
     :param target_date: 取得したい書籍情報の日付
     :yield: RSSフィードのエントリー
     """
+    yield from fetch_feed_by_range(target_date, target_date)
+
+
+def parse_feed(url: str, **kwargs):
+    """RSSフィードを取得して解析する関数。feedparserは初回呼び出し時に読み込む。
+
+    :param str url: フィードのURL
+    :param kwargs: feedparser.parseに渡す引数（etag, modifiedなど）
+    :return: feedparserの解析結果
+    """
+    with timed("import:feedparser"):
+        import feedparser
+
+    return feedparser.parse(url, **kwargs)
+
+
+def fetch_feed_conditional(
+    target_date: date, etag: Optional[str] = None, modified: Optional[str] = None
+):
+    """ETag/Last-Modifiedを指定して、指定された日付のRSSフィードを条件付きで取得する関数。
+
+    :param target_date: 取得したい書籍情報の日付
+    :param etag: 前回取得時のETag
+    :param modified: 前回取得時のLast-Modified
+    :return: feedparserの解析結果。変更がなければstatusが304になる
+    """
     today = get_today()
     days = (target_date - today).days
     url = get_url(days)
     print(url)
-    response = feedparser.parse(url)
-    entries = response["entries"]
-    yield from entries
+    return parse_feed(url, etag=etag, modified=modified)
+
+
+def hash_entries(entries) -> str:
+    """RSSフィードのエントリー集合のハッシュ値を計算する関数。
 
+    エントリーの順序には依存しません。
+
+    :param entries: RSSフィードのエントリーのリスト
+    :return: SHA-256の16進数文字列
+    :rtype: str
+    """
+    keys = sorted((e["id"], e["title"], e["link"], e["published"]) for e in entries)
+    return hashlib.sha256(json.dumps(keys).encode("utf-8")).hexdigest()
 
-def fetch_feed(target_date: date):
+
+def fetch_window(window_start: int, window_end: int) -> List:
+    """期間のRSSフィードを取得する関数。
+
+    エントリー数がFEED_MAX_ENTRIES以上の場合は途中で切れている可能性があるため、
+    期間を半分に分けて取得し直します。1日分でも上限に達した場合は警告を出します。
+
+    :param window_start: 期間の開始の日数オフセット
+    :param window_end: 期間の終わりの日数オフセット
+    :return: RSSフィードのエントリーのリスト
+    :rtype: list
+    """
+    url = get_url(window_start, window_end)
+    print(url)
+    entries = parse_feed(url)["entries"]
+    if len(entries) < FEED_MAX_ENTRIES:
+        return entries
+    if window_start == window_end:
+        print("Feed may be truncated:", url, len(entries))
+        return entries
+    mid = (window_start + window_end) // 2
+    return fetch_window(window_start, mid) + fetch_window(mid + 1, window_end)
+
+
+def fetch_feed_by_range(start_date: date, end_date: date):
+    """指定された期間の版元ドットコムRSSフィードを取得する関数。
+
+    1回のフィードに収まらないことがあるため、期間をRANGE_WINDOW_DAYSごとに区切って取得し、
+    重複したエントリーは除外します。
+    区切った期間でも上限に達した場合は、さらに分割します（fetch_window）。
+
+    :param start_date: 期間の開始日
+    :param end_date: 期間の終了日（この日を含む）
+    :yield: RSSフィードのエントリー
+    """
+    today = get_today()
+    start = (start_date - today).days
+    end = (end_date - today).days
+    seen = set()
+    for window_start in range(start, end + 1, RANGE_WINDOW_DAYS):
+        window_end = min(window_start + RANGE_WINDOW_DAYS - 1, end)
+        for entry in fetch_window(window_start, window_end):
+            if entry["id"] in seen:
+                continue
+            seen.add(entry["id"])
+            yield entry
+
+
+def handle_entries_in_batches(entries, cache: Optional[EnrichmentCache] = None):
+    """エントリーを200件ずつバッチ処理する関数。
+
+    :param entries: RSSフィードから取得したエントリー
+    :param cache: 追加情報のキャッシュ
+    :yield: 構造化された書籍データ
+    """
+    batch = []
+    unit = 200
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= unit:
+            yield from handle_entries(batch, cache)
+            batch = []
+    if batch:
+        yield from handle_entries(batch, cache)
+
+
+def fetch_feed(target_date: date, cache: Optional[EnrichmentCache] = None):
     """指定された日付の書籍情報を取得し、バッチ処理する関数。
 
     エントリーを200件ずつバッチ処理して、メモリ使用量を抑えます。
 
     :param target_date: 取得したい書籍情報の日付
+    :param cache: 追加情報のキャッシュ
     :yield: 構造化された書籍データ
     """
-    entries = []
-    unit = 200
-    for entry in fetch_feed_by_date(target_date):
-        entries.append(entry)
-        if len(entries) >= unit:
-            yield from handle_entries(entries)
-            entries = []
-    if entries:
-        yield from handle_entries(entries)
+    yield from handle_entries_in_batches(fetch_feed_by_date(target_date), cache)
+
+
+def load_cache(bucket_name: str) -> EnrichmentCache:
+    """GCSから追加情報のキャッシュを読み込む関数。
+
+    :param bucket_name: GCSバケット名
+    :return: 読み込んだキャッシュ。存在しない場合は空のキャッシュ
+    :rtype: EnrichmentCache
+    """
+    return EnrichmentCache.loads(download_gcs(bucket_name, CACHE_PATH))
+
+
+def save_cache(bucket_name: str, cache: EnrichmentCache):
+    """追加情報のキャッシュに変更があればGCSに保存する関数。
+
+    :param bucket_name: GCSバケット名
+    :param cache: 保存するキャッシュ
+    """
+    if not cache.dirty:
+        return
+    with GzipWriter(get_storage(bucket_name), CACHE_PATH) as writer:
+        writer.write(cache.dumps().encode("utf-8"))
+
+
+def get_partition_path(date_str: str) -> str:
+    """書籍データのパーティションのパスを返す関数。
+
+    :param date_str: パーティションの日付（ISO形式の文字列）
+    :return: GCS上のパス
+    """
+    return f"new_books/date={date_str}/hanmoto.jsonl.gz"
+
+
+def get_parquet_path(date_str: str) -> str:
+    """Parquet形式のパーティションのパスを返す関数。
+
+    :param date_str: パーティションの日付（ISO形式の文字列）
+    :return: GCS上のパス
+    """
+    return f"new_books_parquet/date={date_str}/hanmoto.parquet"
+
+
+def get_manifest_path(date_str: str) -> str:
+    """パーティションのマニフェストのパスを返す関数。
+
+    BigQueryの外部テーブルから読まれないように、new_books/の外に置きます。
+
+    :param date_str: パーティションの日付（ISO形式の文字列）
+    :return: GCS上のパス
+    """
+    return f"manifests/new_books/date={date_str}.json.gz"
+
+
+def load_manifest(bucket_name: str, date_str: str) -> Dict:
+    """パーティションのマニフェストを読み込む関数。
+
+    :param bucket_name: GCSバケット名
+    :param date_str: パーティションの日付（ISO形式の文字列）
+    :return: マニフェストの辞書。存在しない場合は空の辞書
+    :rtype: dict
+    """
+    text = download_gcs(bucket_name, get_manifest_path(date_str))
+    return json.loads(text) if text else {}
+
+
+def save_manifest(bucket_name: str, date_str: str, manifest: Dict):
+    """パーティションのマニフェストを保存する関数。
 
+    :param bucket_name: GCSバケット名
+    :param date_str: パーティションの日付（ISO形式の文字列）
+    :param manifest: 保存するマニフェスト
+    """
+    path = get_manifest_path(date_str)
+    with GzipWriter(get_storage(bucket_name), path) as writer:
+        writer.write(json.dumps(manifest).encode("utf-8"))
 
-def fetch_and_save(target_date: date, bucket_name: str):
+
+def save_partition(
+    bucket_name: str, date_str: str, records, previous_hash: Optional[str] = None
+) -> Dict:
+    """書籍データを日付ごとのパーティションとしてGCSに保存する関数。
+
+    レコードはgzip圧縮しながらそのままアップロードするため、一時ファイルは作りません。
+    OUTPUT_FORMATSにparquetが含まれる場合は、Parquet形式のファイルも保存します。
+    書き込んだ内容のハッシュ値がprevious_hashと同じ場合は、アップロードを確定せずに中断します。
+
+    :param bucket_name: 保存先のGCSバケット名
+    :param date_str: パーティションの日付（ISO形式の文字列）
+    :param records: 保存する書籍データ
+    :param previous_hash: 前回保存した内容のハッシュ値
+    :return: 書籍数(count)、ハッシュ値(hash)、アップロードしたかどうか(uploaded)を含む辞書。
+        0件の場合はアップロードしない
+    :rtype: dict
+    """
+    storage = get_storage(bucket_name)
+    rows = [] if "parquet" in OUTPUT_FORMATS else None
+    jsonl_storage = storage if "jsonl" in OUTPUT_FORMATS else None
+    with JsonlGzipWriter(jsonl_storage, get_partition_path(date_str)) as writer:
+        for b in records:
+            writer.write_record(b)
+            if rows is not None:
+                rows.append(b)
+        uploaded = writer.count > 0 and writer.hexdigest() != previous_hash
+        if not uploaded:
+            writer.abort()
+    if uploaded and rows:
+        write_parquet(storage, get_parquet_path(date_str), rows)
+    return dict(count=writer.count, hash=writer.hexdigest(), uploaded=uploaded)
+
+
+def is_complete(record: Dict) -> bool:
+    """保存済みのレコードに、書籍説明とCコードがそろっているかを判定する関数。"""
+    return bool(record.get("description")) and bool(record.get("c_code"))
+
+
+def merge_partition(
+    entries,
+    existing: Dict[str, Dict],
+    cache: EnrichmentCache,
+    refresh: Iterable[str] = (),
+):
+    """保存済みのパーティションとフィードを突き合わせ、差分だけ追加情報を取得してマージする関数。
+
+    ISBNが新しいエントリーと、フィード由来の項目（タイトルや出版日など）が変わったエントリー、
+    refreshで指定したエントリーだけをhandle_entriesで処理し、それ以外は保存済みのレコードをそのまま使います。
+
+    :param entries: RSSフィードのエントリーのリスト
+    :param existing: ISBNをキー、保存済みのレコードを値とする辞書
+    :param cache: 追加情報のキャッシュ
+    :param refresh: 変わっていなくても追加情報を取得し直すISBN
+    :return: フィードの順に並んだレコードのリストと、追加・削除・変更・再取得したISBNの辞書のタプル
+    :rtype: tuple
+    """
+    refresh = set(refresh)
+    changes = dict(added=[], removed=[], changed=[], refreshed=[])
+    targets = []
+    isbns = []
+    for entry in entries:
+        bd = parse_entry(entry)
+        isbns.append(bd.isbn)
+        old = existing.get(bd.isbn)
+        if old is None:
+            changes["added"].append(bd.isbn)
+        elif any(old.get(k) != v for k, v in bd._asdict().items() if k in FEED_FIELDS):
+            changes["changed"].append(bd.isbn)
+        elif bd.isbn in refresh:
+            changes["refreshed"].append(bd.isbn)
+        else:
+            continue
+        targets.append(entry)
+    changes["removed"] = sorted(set(existing) - set(isbns))
+    enriched = {b["isbn"]: b for b in handle_entries_in_batches(targets, cache)}
+    records = [enriched.get(isbn) or existing[isbn] for isbn in isbns]
+    return records, changes
+
+
+def save_change_log(bucket_name: str, date_str: str, changes: Dict):
+    """差分取得で追加・削除・変更されたISBNの一覧を保存する関数。
+
+    :param bucket_name: GCSバケット名
+    :param date_str: パーティションの日付（ISO形式の文字列）
+    :param changes: 追加(added)・削除(removed)・変更(changed)・再取得(refreshed)したISBNの辞書
+    """
+    fetched_at = datetime.now(pytz.timezone("Asia/Tokyo")).strftime("%Y%m%dT%H%M%S")
+    path = f"manifests/new_books/changes/date={date_str}/{fetched_at}.json.gz"
+    with GzipWriter(get_storage(bucket_name), path) as writer:
+        writer.write(json.dumps(dict(changes, fetched_at=fetched_at)).encode("utf-8"))
+
+
+def response_manifest(response: Dict) -> Dict:
+    """フィードの応答から、マニフェストに保存する項目を取り出す関数。"""
+    return dict(
+        etag=response.get("etag"),
+        modified=response.get("modified"),
+        entry_hash=hash_entries(response["entries"]),
+    )
+
+
+def fetch_and_save(
+    target_date: date,
+    bucket_name: str,
+    use_cache: bool = True,
+    force: bool = False,
+    delta: bool = False,
+):
     """指定された日付の書籍情報を取得し、GCSに保存する関数。
 
+    前回保存時のマニフェストを使い、以下の場合は早めに処理を終えます（skippedに理由を返す）。
+
+    - フィードが304 Not Modifiedを返した場合（feed_not_modified）
+    - フィードのエントリー集合が前回と同じ場合。追加情報の取得も行わない（entries_unchanged）
+    - 作成したレコードが前回と同じ場合。アップロードしない（records_unchanged）
+
+    ただし前の2つは、保存済みのレコードがすべて書籍説明とCコードを持っている場合だけです。
+    後からOpenBDに登録される情報を取り込むため、欠けているレコードはキャッシュを使わずに取得し直します。
+
     :param target_date: 取得したい書籍情報の日付
     :param bucket_name: 保存先のGCSバケット名
+    :param use_cache: 追加情報のキャッシュを使うかどうか
+    :param force: マニフェストを無視して必ず取得・保存するかどうか
+    :param delta: 保存済みのパーティションを読み込み、新しいISBNと変更されたISBNだけを
+        処理してマージするかどうか
     :return: 処理結果の情報（取得した書籍数と日付を含む辞書）
     """
     date_str = target_date.isoformat()
-    feed_data = tempfile.NamedTemporaryFile("wb")
-    count = 0
-    with gzip.open(feed_data.name, "wb") as f:
-        for b in fetch_feed(target_date):
-            f.write((json.dumps(b) + "\n").encode("utf-8"))
-            count += 1
-    feed_data.flush()
-    feed_data.seek(0)
-    remote_path = f"new_books/date={date_str}/hanmoto.jsonl.gz"
-    if count > 0:
-        upload_gcs(bucket_name, remote_path, feed_data.name)
-    print(dict(date=date_str, count=count))
-    return dict(count=count, date=date_str)
+    today_str = get_today().isoformat()
+    manifest = {} if force else load_manifest(bucket_name, date_str)
+    if (manifest.get("uploaded_at") or "") < (
+        get_today() - timedelta(days=MANIFEST_MAX_AGE_DAYS)
+    ).isoformat():
+        manifest = {}
+    response = fetch_feed_conditional(
+        target_date, manifest.get("etag"), manifest.get("modified")
+    )
+    not_modified = response.get("status") == 304
+    new_manifest = None if not_modified else response_manifest(response)
+    refresh = None
+    if not_modified or new_manifest["entry_hash"] == manifest.get("entry_hash"):
+        path = get_partition_path(date_str)
+        existing = {b["isbn"]: b for b in download_gcs_jsonl(bucket_name, path)}
+        refresh = [isbn for isbn, b in existing.items() if not is_complete(b)]
+        if not refresh:
+            if not_modified:
+                return skip_result(date_str, manifest, "feed_not_modified")
+            save_manifest(bucket_name, date_str, {**manifest, **new_manifest})
+            return skip_result(date_str, manifest, "entries_unchanged")
+        print("Refreshing incomplete records:", len(refresh))
+        if not_modified:
+            response = fetch_feed_conditional(target_date, None, None)
+            new_manifest = response_manifest(response)
+    entries = response["entries"]
+    cache = load_cache(bucket_name) if use_cache else EnrichmentCache()
+    changes = None
+    if refresh is not None:
+        cache.discard(refresh)
+        records, changes = merge_partition(entries, existing, cache, refresh)
+        if not delta:
+            changes = None
+    elif delta:
+        path = get_partition_path(date_str)
+        existing = {b["isbn"]: b for b in download_gcs_jsonl(bucket_name, path)}
+        records, changes = merge_partition(entries, existing, cache)
+    else:
+        records = handle_entries_in_batches(entries, cache)
+    saved = save_partition(bucket_name, date_str, records, manifest.get("record_hash"))
+    count = saved["count"]
+    uploaded_at = today_str if saved["uploaded"] else manifest.get("uploaded_at")
+    new_manifest.update(record_hash=saved["hash"], count=count, uploaded_at=uploaded_at)
+    save_manifest(bucket_name, date_str, new_manifest)
+    if use_cache:
+        save_cache(bucket_name, cache)
+    cache_stats = dict(hits=cache.hits, misses=cache.misses)
+    skipped = "records_unchanged" if count > 0 and not saved["uploaded"] else False
+    result = dict(count=count, date=date_str, cache=cache_stats, skipped=skipped)
+    if changes is not None:
+        if any(changes.values()):
+            save_change_log(bucket_name, date_str, changes)
+        result["changes"] = {k: len(v) for k, v in changes.items()}
+    print(result)
+    return result
+
+
+def skip_result(date_str: str, manifest: Dict, reason: str) -> Dict:
+    """処理をスキップした場合の結果を作る関数。
+
+    :param date_str: パーティションの日付（ISO形式の文字列）
+    :param manifest: 前回保存時のマニフェスト
+    :param reason: スキップした理由
+    :return: 処理結果の情報
+    :rtype: dict
+    """
+    result = dict(count=manifest.get("count", 0), date=date_str, skipped=reason)
+    print(result)
+    return result
+
+
+def fetch_and_save_range(
+    start_date: date, end_date: date, bucket_name: str, use_cache: bool = True
+):
+    """指定された期間の書籍情報をまとめて取得し、出版日ごとにGCSに保存する関数。
+
+    期間全体のフィードを取得して重複を除いてから一度に追加情報を取得し、
+    出版日ごとのパーティションに分けて保存します。
+
+    :param start_date: 期間の開始日
+    :param end_date: 期間の終了日（この日を含む）
+    :param bucket_name: 保存先のGCSバケット名
+    :param use_cache: 追加情報のキャッシュを使うかどうか
+    :return: 処理結果の情報（合計の書籍数と日付ごとの書籍数を含む辞書）
+    """
+    cache = load_cache(bucket_name) if use_cache else EnrichmentCache()
+    entries = fetch_feed_by_range(start_date, end_date)
+    by_date = defaultdict(list)
+    for b in handle_entries_in_batches(entries, cache):
+        by_date[b["publish_date"]].append(b)
+    counts = {}
+    for date_str in sorted(by_date):
+        if not start_date.isoformat() <= date_str <= end_date.isoformat():
+            print("Skip out of range date:", date_str, len(by_date[date_str]))
+            continue
+        saved = save_partition(bucket_name, date_str, by_date[date_str])
+        save_manifest(
+            bucket_name,
+            date_str,
+            dict(
+                record_hash=saved["hash"],
+                count=saved["count"],
+                uploaded_at=get_today().isoformat(),
+            ),
+        )
+        counts[date_str] = saved["count"]
+    if use_cache:
+        save_cache(bucket_name, cache)
+    cache_stats = dict(hits=cache.hits, misses=cache.misses)
+    result = dict(
+        count=sum(counts.values()),
+        start_date=start_date.isoformat(),
+        end_date=end_date.isoformat(),
+        dates=counts,
+        cache=cache_stats,
+    )
+    print(result)
+    return result
 
 
 @functions_framework.http
 def handle_request(request):
     """Cloud Functionsのエントリーポイント。HTTPリクエストを処理し、書籍情報を取得・保存する。
 
+    start_daysとend_daysが指定された場合は、その期間をまとめて取得する。
+
+    :param request: HTTPリクエストオブジェクト
+    :return: 処理結果のJSON応答
+    """
+    mark("first_request")
+    try:
+        return run_request(request)
+    finally:
+        mark("first_response")
+        report()
+
+
+def run_request(request):
+    """HTTPリクエストの内容に応じて、書籍情報を取得・保存する関数。
+
     :param request: HTTPリクエストオブジェクト
     :return: 処理結果のJSON応答
     """
     bucket_name = os.environ.get("BUCKET_NAME")
     json_data = request.get_json()
     print(json_data)
+    use_cache = json_data.get("use_cache", True)
+    force = json_data.get("force", False)
+    delta = json_data.get("delta", False)
+    today = get_today()
+    if "start_days" in json_data or "end_days" in json_data:
+        start_days = json_data.get("start_days", 0)
+        end_days = json_data.get("end_days", start_days)
+        if start_days > end_days:
+            return "start_days must be less than or equal to end_days", 400
+        result = fetch_and_save_range(
+            today + timedelta(days=start_days),
+            today + timedelta(days=end_days),
+            bucket_name,
+            use_cache=use_cache,
+        )
+        return dict(result="ok", **result)
     days = json_data.get("days", 0)
-    target_date = get_today() + timedelta(days=days)
-    result = fetch_and_save(target_date, bucket_name)
+    target_date = today + timedelta(days=days)
+    result = fetch_and_save(
+        target_date, bucket_name, use_cache=use_cache, force=force, delta=delta
+    )
     return dict(result="ok", **result)
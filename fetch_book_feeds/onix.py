@@ -0,0 +1,80 @@
+"""
+OpenBDのレスポンスからONIXの必要な項目だけを取り出すモジュール。
+
+orjsonが使える場合はorjsonでデコードし、レコードごとに使う項目（タイトル、内容紹介、
+著者、Cコード、キーワード、レーベル、シリーズ）だけを直接参照します。
+結果はmain.parse_openbdと同じ辞書です。
+"""
+
+from typing import Dict, List
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data: bytes) -> List:
+    """OpenBDのレスポンスをデコードする関数。
+
+    :param bytes data: レスポンスのボディ
+    :return: デコードしたレコードのリスト
+    :rtype: list
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def parse_record(record: Dict) -> Dict:
+    """OpenBDの書籍レコードから必要な情報だけを抽出する関数。
+
+    :param dict record: OpenBDの書籍レコード
+    :return: タイトル、説明、著者、キーワード、Cコード、レーベル、シリーズなどを含む辞書
+    :rtype: dict
+    """
+    onix = record["onix"]
+    detail = onix["DescriptiveDetail"]
+    title = detail["TitleDetail"]["TitleElement"]["TitleText"]["content"]
+
+    description = ""
+    for text in onix["CollateralDetail"].get("TextContent", ()):
+        if text["TextType"] == "03":
+            description = text["Text"]
+            break
+
+    subjects = detail.get("Subject")
+    keyword = ""
+    c_code = ""
+    if subjects:
+        for sub in subjects:
+            scheme = sub["SubjectSchemeIdentifier"]
+            if scheme == "20":
+                keyword = sub["SubjectHeadingText"]
+            elif scheme == "78":
+                c_code = sub["SubjectCode"]
+
+    label = None
+    series = None
+    collection = detail.get("Collection")
+    if collection is not None and collection.get("CollectionType") == "10":
+        title_detail = collection.get("TitleDetail")
+        if title_detail is not None:
+            for elm in title_detail.get("TitleElement", ()):
+                level = elm["TitleElementLevel"]
+                if level == "02":
+                    label = elm["TitleText"]["content"]
+                elif level == "03":
+                    series = elm["TitleText"]["content"]
+
+    return dict(
+        title=title,
+        description=description,
+        authors=detail["Contributor"],
+        subjects=subjects,
+        keyword=keyword,
+        c_code=c_code,
+        label=label,
+        series=series,
+    )
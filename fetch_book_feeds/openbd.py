@@ -0,0 +1,112 @@
+"""
+OpenBD APIのクライアント。
+
+ISBNのリストをチャンクに分割し、コネクションプールを共有したセッションで
+並列にPOSTします。失敗したチャンクだけをリトライし、レスポンスは届いた順に解析します。
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List
+import os
+import random
+import requests
+import time
+
+from crawler import create_session
+from onix import loads
+
+
+OPENBD_URL = os.environ.get("OPENBD_URL", "https://api.openbd.jp/v1/get")
+DEFAULT_CHUNK_SIZE = int(os.environ.get("OPENBD_CHUNK_SIZE", "100"))
+DEFAULT_WORKERS = int(os.environ.get("OPENBD_WORKERS", "4"))
+DEFAULT_TIMEOUT = float(os.environ.get("OPENBD_TIMEOUT", "30"))
+DEFAULT_RETRIES = int(os.environ.get("OPENBD_RETRIES", "2"))
+
+
+def chunked(items: List[str], size: int) -> List[List[str]]:
+    """リストを指定サイズごとのチャンクに分割する関数。
+
+    :param items: 分割するリスト
+    :param int size: チャンクのサイズ
+    :return: チャンクのリスト
+    """
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+class OpenBDClient:
+    """OpenBD APIからISBNごとの書籍情報を取得するクライアント。
+
+    :param parse: OpenBDのレコードを受け取って辞書を返す関数
+    :param int chunk_size: 1リクエストに含めるISBNの数
+    :param int workers: 並列に送るリクエスト数
+    :param float timeout: 1リクエストあたりのタイムアウト秒数
+    :param int retries: 失敗したチャンクをリトライする回数
+    """
+
+    def __init__(
+        self,
+        parse: Callable,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        workers: int = DEFAULT_WORKERS,
+        timeout: float = DEFAULT_TIMEOUT,
+        retries: int = DEFAULT_RETRIES,
+        url: str = OPENBD_URL,
+    ):
+        self.parse = parse
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.url = url
+        self.session = create_session(workers)
+
+    def fetch_chunk(self, isbns: List[str]) -> Dict:
+        """1チャンク分のISBNをPOSTで問い合わせ、解析結果を返す関数。
+
+        :param isbns: ISBNのリスト
+        :return: ISBNをキー、解析結果を値とする辞書。OpenBDに登録がないISBNの値はNone
+        :rtype: dict
+        :raises requests.exceptions.RequestException: 通信やステータスコードのエラー
+        """
+        response = self.session.post(
+            self.url, data={"isbn": ",".join(isbns)}, timeout=self.timeout
+        )
+        response.raise_for_status()
+        return_value = dict.fromkeys(isbns)
+        for d in loads(response.content):
+            if d is None:
+                continue
+            isbn = d["onix"]["RecordReference"]
+            return_value[isbn] = self.parse(d)
+        return return_value
+
+    def fetch(self, isbns: List[str]) -> Dict:
+        """複数のISBNに対応する書籍情報を取得する関数。
+
+        :param isbns: ISBNのリスト
+        :return: ISBNをキー、解析結果を値とする辞書。OpenBDに登録がないISBNの値はNoneで、
+            リトライしても取得に失敗したISBNは含まない
+        :rtype: dict
+        """
+        pending = chunked(list(dict.fromkeys(isbns)), self.chunk_size)
+        return_value = {}
+        for attempt in range(self.retries + 1):
+            if not pending:
+                break
+            if attempt > 0:
+                time.sleep(2 ** (attempt - 1) + random.random())
+            failed = []
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = {
+                    executor.submit(self.fetch_chunk, chunk): chunk for chunk in pending
+                }
+                for future in as_completed(futures):
+                    try:
+                        return_value.update(future.result())
+                    except (requests.exceptions.RequestException, ValueError) as e:
+                        print("Failed to fetch openBD chunk:", e)
+                        failed.append(futures[future])
+            pending = failed
+        if pending:
+            print("Gave up openBD chunks:", sum(len(c) for c in pending), "ISBNs")
+        return return_value
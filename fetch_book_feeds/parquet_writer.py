@@ -0,0 +1,104 @@
+"""
+書籍データをParquet形式で保存するモジュール。
+
+BigQueryの外部テーブル(external_new_books_parquet)から読み込むための、型付きの列指向ファイルを作ります。
+author_dataはContributorの構造をそのままネストした列として保存し、
+行はpublish_date, c_codeの順に並べて、行グループの統計情報で読み飛ばせるようにします。
+pyarrowは、Parquetでの出力が有効な場合にだけ読み込みます。
+"""
+
+from datetime import date
+from typing import Dict, List
+import os
+
+
+ROW_GROUP_SIZE = int(os.environ.get("PARQUET_ROW_GROUP_SIZE", "10000"))
+SORT_KEYS = ("publish_date", "c_code")
+
+
+def get_schema():
+    """new_booksのParquetスキーマを返す関数。
+
+    terraform/scripts/new_books.jsonのスキーマに合わせています。
+
+    :return: pyarrowのスキーマ
+    :rtype: pyarrow.Schema
+    """
+    import pyarrow as pa
+
+    person_name = pa.struct([("collationkey", pa.string()), ("content", pa.string())])
+    contributor = pa.struct(
+        [
+            ("SequenceNumber", pa.string()),
+            ("ContributorRole", pa.list_(pa.string())),
+            ("PersonName", person_name),
+            ("BiographicalNote", pa.string()),
+        ]
+    )
+    return pa.schema(
+        [
+            ("id", pa.string()),
+            ("raw_title", pa.string()),
+            ("title", pa.string()),
+            ("authors", pa.string()),
+            ("publisher", pa.string()),
+            ("publish_date", pa.date32()),
+            ("link", pa.string()),
+            ("isbn", pa.string()),
+            ("description", pa.string()),
+            ("keywords", pa.string()),
+            ("c_code", pa.string()),
+            ("label", pa.string()),
+            ("series", pa.string()),
+            ("author_data", pa.list_(contributor)),
+        ]
+    )
+
+
+def to_parquet_bytes(records: List[Dict]) -> bytes:
+    """書籍データをpublish_date, c_codeの順に並べてParquet形式に変換する関数。
+
+    :param records: 書籍データ（HanmotoData.to_dictの戻り値）のリスト
+    :return: Parquetファイルの内容
+    :rtype: bytes
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = sorted(records, key=lambda r: tuple(r.get(k) or "" for k in SORT_KEYS))
+    rows = [
+        dict(r, publish_date=date.fromisoformat(r["publish_date"]))
+        if r.get("publish_date")
+        else r
+        for r in rows
+    ]
+    schema = get_schema()
+    table = pa.Table.from_pylist(rows, schema=schema)
+    sink = pa.BufferOutputStream()
+    pq.write_table(
+        table,
+        sink,
+        compression="snappy",
+        row_group_size=ROW_GROUP_SIZE,
+        sorting_columns=[
+            pq.SortingColumn(schema.get_field_index(k)) for k in SORT_KEYS
+        ],
+    )
+    return sink.getvalue().to_pybytes()
+
+
+def write_parquet(storage, path: str, records: List[Dict]):
+    """書籍データをParquet形式でストレージに保存する関数。
+
+    :param storage: 書き込み先のバックエンド
+    :param str path: バケット内のパス
+    :param records: 書籍データのリスト
+    """
+    data = to_parquet_bytes(records)
+    sink = storage.open_write(path, content_encoding=None)
+    try:
+        sink.write(data)
+    except Exception:
+        storage.abort(sink)
+        raise
+    sink.close()
@@ -0,0 +1,5 @@
+from pathlib import Path
+import sys
+
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "fetch_book_feeds"))
@@ -0,0 +1,41 @@
+import io
+
+from gcs_io import GCSStorage
+
+
+class FakeBlobWriter(io.BufferedIOBase):
+    """BlobWriterと同じく、closeでアップロードを確定するファイルオブジェクト。"""
+
+    def __init__(self, events):
+        self.events = events
+        self.data = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.data.write(data)
+
+    def close(self):
+        if not self.closed:
+            self.events.append("finalized")
+        super().close()
+
+    def terminate(self):
+        self.events.append("terminated")
+        super().close()
+
+
+class FakeBlob:
+    def __init__(self, events):
+        self.events = events
+        self.content_encoding = None
+
+    def open(self, mode, **kwargs):
+        return FakeBlobWriter(self.events)
+
+
+def fake_gcs_storage(events):
+    storage = GCSStorage("bucket")
+    storage.blob = lambda path: FakeBlob(events)
+    return storage
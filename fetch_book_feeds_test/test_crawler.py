@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+import time
+
+import pytest
+import requests
+
+from crawler import FetchFailed, HanmotoCrawler, TokenBucket
+from enrich_cache import EnrichmentCache
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(rate=20)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    elapsed = time.monotonic() - start
+    # 最初の1件はすぐ取得でき、残り4件は0.05秒ずつ待つ
+    assert 0.18 <= elapsed < 0.5
+
+
+def test_map():
+    crawler = HanmotoCrawler(rate=100, workers=3)
+    result = crawler.map(lambda x: x * 2, ["a", "b", "a", "c"])
+    assert {"a": "aa", "b": "bb", "c": "cc"} == result
+
+
+def test_get_limiter_per_host():
+    crawler = HanmotoCrawler()
+    a = crawler.get_limiter("https://www.hanmoto.com/bd/isbn/1")
+    b = crawler.get_limiter("https://www.hanmoto.com/bd/isbn/2")
+    c = crawler.get_limiter("https://api.openbd.jp/v1/get")
+    assert a is b
+    assert a is not c
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = responses
+
+    def get(self, url, timeout):
+        response = self.responses[url.rsplit("/", 1)[-1]]
+        if isinstance(response, Exception):
+            raise response
+        return SimpleNamespace(
+            status_code=response, ok=response < 400, text=f"page {response}"
+        )
+
+
+def test_failed_fetches_are_not_cached(monkeypatch):
+    monkeypatch.setattr("crawler.time.sleep", lambda s: None)
+    crawler = HanmotoCrawler(rate=1000, workers=2, retries=1)
+    crawler.session = FakeSession(
+        {"ok": 200, "missing": 404, "down": 503, "slow": requests.exceptions.Timeout()}
+    )
+    with pytest.raises(FetchFailed):
+        crawler.get("https://example.com/down")
+    cache = EnrichmentCache()
+    keys = ["ok", "missing", "down", "slow"]
+
+    def fetch(keys):
+        return crawler.map(lambda k: crawler.get(f"https://e/{k}"), keys)
+
+    assert {"ok": "page 200"} == cache.lookup("hanmoto", keys, fetch)
+    # 404だけがネガティブキャッシュされ、リトライで失敗したものは次回また取得する
+    assert (True, None) == cache.get("hanmoto", "missing")
+    assert (False, None) == cache.get("hanmoto", "down")
+    assert (False, None) == cache.get("hanmoto", "slow")
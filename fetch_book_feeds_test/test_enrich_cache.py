@@ -0,0 +1,47 @@
+from enrich_cache import EnrichmentCache
+
+
+def test_lookup_fetches_only_misses():
+    cache = EnrichmentCache()
+    calls = []
+
+    def fetch(isbns):
+        calls.append(list(isbns))
+        return {
+            isbn: None if isbn == "2" else {"c_code": "0093"}
+            for isbn in isbns
+            if isbn != "5"
+        }
+
+    result = cache.lookup("openbd", ["1", "2", "3"], fetch)
+    assert ["1", "3"] == sorted(result)
+    result = cache.lookup("openbd", ["1", "2", "3", "4", "5"], fetch)
+    assert ["1", "3", "4"] == sorted(result)
+    result = cache.lookup("openbd", ["5"], fetch)
+    # 値がなかった"2"はネガティブキャッシュされるので再取得しないが、
+    # 戻り値に含まれなかった"5"は失敗扱いなので再取得する
+    assert [["1", "2", "3"], ["4", "5"], ["5"]] == calls
+    assert 3 == cache.hits
+    assert 6 == cache.misses
+
+
+def test_ttl():
+    cache = EnrichmentCache(ttl=100, negative_ttl=10)
+    cache.put("openbd", "1", {"c_code": "0093"}, now=0)
+    cache.put("openbd", "2", None, now=0)
+    assert (True, {"c_code": "0093"}) == cache.get("openbd", "1", now=50)
+    assert (False, None) == cache.get("openbd", "2", now=50)
+    assert (False, None) == cache.get("openbd", "1", now=150)
+
+
+def test_dumps_loads():
+    cache = EnrichmentCache()
+    cache.put("hanmoto", "1", {"ccode": "0093", "description": "説明"})
+    cache.put("hanmoto", "2", None)
+    restored = EnrichmentCache.loads(cache.dumps())
+    assert (True, {"ccode": "0093", "description": "説明"}) == restored.get(
+        "hanmoto", "1"
+    )
+    assert (True, None) == restored.get("hanmoto", "2")
+    assert not restored.dirty
+    assert {} == EnrichmentCache.loads("").entries
@@ -0,0 +1,23 @@
+from pathlib import Path
+
+import pytest
+
+from extractor import extract, extract_bs4, extract_scan
+
+
+# 版元ドットコムの書籍詳細ページの構造を真似た合成のページ
+FIXTURES = Path(__file__).parent.parent / "benchmarks" / "fixtures" / "hanmoto"
+
+
+@pytest.mark.parametrize("path", sorted(FIXTURES.glob("*.html")), ids=lambda p: p.name)
+def test_scan_matches_bs4(path):
+    html = path.read_text(encoding="utf-8")
+    assert extract_bs4(html) == extract_scan(html)
+
+
+def test_extract():
+    html = (FIXTURES / "novel.html").read_text(encoding="utf-8")
+    result = extract(html)
+    assert "0093" == result["ccode"]
+    assert result["description"]
+    assert {"ccode": None, "description": None} == extract("<html></html>")
@@ -0,0 +1,64 @@
+import gc
+import gzip
+import json
+
+import pytest
+
+from fake_gcs import fake_gcs_storage
+from gcs_io import JsonlGzipWriter, LocalStorage, get_storage
+
+
+def test_write_and_read(tmp_path):
+    storage = LocalStorage(str(tmp_path), "bucket")
+    path = "new_books/date=2025-01-01/hanmoto.jsonl.gz"
+    with JsonlGzipWriter(storage, path) as writer:
+        writer.write_record({"isbn": "1", "title": "本"})
+        writer.write_record({"isbn": "2", "title": "本2"})
+    assert 2 == writer.count
+    with gzip.open(tmp_path / "bucket" / path, "rt") as f:
+        assert ["1", "2"] == [json.loads(line)["isbn"] for line in f]
+    assert storage.read_text(path).count("\n") == 2
+    assert "" == storage.read_text("not_found.jsonl.gz")
+
+
+def test_empty_writer_creates_nothing(tmp_path):
+    storage = LocalStorage(str(tmp_path), "bucket")
+    with JsonlGzipWriter(storage, "a/b.jsonl.gz") as writer:
+        pass
+    assert 0 == writer.count
+    assert not (tmp_path / "bucket" / "a" / "b.jsonl.gz").exists()
+
+
+def test_abort_on_error(tmp_path):
+    storage = LocalStorage(str(tmp_path), "bucket")
+    path = "a/b.jsonl.gz"
+    with JsonlGzipWriter(storage, path) as writer:
+        writer.write_record({"isbn": "1"})
+    with pytest.raises(RuntimeError):
+        with JsonlGzipWriter(storage, path) as writer:
+            writer.write_record({"isbn": "2"})
+            raise RuntimeError()
+    # 書きかけのファイルで既存のファイルを上書きしない
+    assert '{"isbn": "1"}\n' == storage.read_text(path)
+    assert ["b.jsonl.gz"] == [p.name for p in (tmp_path / "bucket" / "a").iterdir()]
+
+
+def test_get_storage(monkeypatch, tmp_path):
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path))
+    assert isinstance(get_storage("bucket"), LocalStorage)
+
+
+def test_gcs_abort_does_not_finalize():
+    events = []
+    storage = fake_gcs_storage(events)
+    with pytest.raises(RuntimeError):
+        with JsonlGzipWriter(storage, "a/b.jsonl.gz") as writer:
+            writer.write_record({"isbn": "1"})
+            raise RuntimeError()
+    del writer
+    gc.collect()
+    assert ["terminated"] == events
+
+    with JsonlGzipWriter(storage, "a/b.jsonl.gz") as writer:
+        writer.write_record({"isbn": "1"})
+    assert ["terminated", "finalized"] == events
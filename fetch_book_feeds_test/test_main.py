@@ -0,0 +1,231 @@
+from datetime import date
+import gzip
+import json
+
+import main
+from fake_gcs import fake_gcs_storage
+
+
+def make_entry(isbn: str, published: str):
+    return dict(
+        title=f"本{isbn} - 著者(著/文) | 出版社",
+        id=f"https://www.hanmoto.com/bd/isbn/{isbn}",
+        link=f"https://www.hanmoto.com/bd/isbn/{isbn}",
+        published=published,
+    )
+
+
+def make_openbd(description: str, c_code: str):
+    return dict(
+        title="本",
+        description=description,
+        authors=[],
+        subjects=None,
+        keyword="",
+        c_code=c_code,
+        label=None,
+        series=None,
+    )
+
+
+def test_get_url():
+    assert (
+        "https://www.hanmoto.com/ci/bd/search/sdate/3day/edate/3day/order/asc/vw/rss20/"
+        == main.get_url(3)
+    )
+    assert (
+        "https://www.hanmoto.com/ci/bd/search/sdate/1day/edate/7day/order/asc/vw/rss20/"
+        == main.get_url(1, 7)
+    )
+
+
+def test_fetch_and_save_range(monkeypatch):
+    entries = [
+        make_entry("1", "Thu, 02 Jan 2025 00:00:00 +0900"),
+        make_entry("2", "Fri, 03 Jan 2025 00:00:00 +0900"),
+        make_entry("3", "Thu, 02 Jan 2025 00:00:00 +0900"),
+        make_entry("1", "Thu, 02 Jan 2025 00:00:00 +0900"),
+    ]
+    saved = {}
+    monkeypatch.setattr(main, "get_today", lambda: date(2025, 1, 1))
+    monkeypatch.setattr(main, "parse_feed", lambda url: {"entries": entries})
+    monkeypatch.setattr(main, "fetch_openbk", lambda isbns: {})
+    monkeypatch.setattr(main, "get_book_info", lambda isbn: None)
+    monkeypatch.setattr(
+        main,
+        "save_partition",
+        lambda bucket, date_str, records: dict(
+            count=saved.setdefault(date_str, len(records)), hash=""
+        ),
+    )
+    monkeypatch.setattr(main, "save_manifest", lambda *args: None)
+    result = main.fetch_and_save_range(
+        date(2025, 1, 2), date(2025, 1, 3), "bucket", use_cache=False
+    )
+    assert {"2025-01-02": 2, "2025-01-03": 1} == saved
+    assert 3 == result["count"]
+
+
+def test_fetch_feed_by_range_splits_truncated_window(monkeypatch):
+    urls = []
+
+    def parse(url):
+        urls.append(url)
+        if "sdate/1day/edate/4day" in url:
+            return {"entries": [make_entry("x", "")] * 3}
+        day = url.split("sdate/")[1].split("day")[0]
+        return {"entries": [make_entry(day, "")]}
+
+    monkeypatch.setattr(main, "get_today", lambda: date(2025, 1, 1))
+    monkeypatch.setattr(main, "parse_feed", parse)
+    monkeypatch.setattr(main, "RANGE_WINDOW_DAYS", 4)
+    monkeypatch.setattr(main, "FEED_MAX_ENTRIES", 3)
+    entries = list(main.fetch_feed_by_range(date(2025, 1, 2), date(2025, 1, 5)))
+    assert 2 == len(entries)
+    assert ["1", "3"] == [e["id"].split("/")[-1] for e in entries]
+    assert 3 == len(urls)
+
+
+def test_fetch_and_save_skip(monkeypatch, tmp_path):
+    entries = [make_entry("1", "Thu, 02 Jan 2025 00:00:00 +0900")]
+    responses = []
+    calls = []
+
+    def parse(url, etag=None, modified=None):
+        if etag == "v2":
+            return {"status": 304, "entries": []}
+        return responses.pop(0)
+
+    def fetch_openbk(isbns):
+        calls.append(isbns)
+        return {isbn: make_openbd("説明", "0093") for isbn in isbns}
+
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "get_today", lambda: date(2025, 1, 1))
+    monkeypatch.setattr(main, "parse_feed", parse)
+    monkeypatch.setattr(main, "fetch_openbk", fetch_openbk)
+    monkeypatch.setattr(main, "get_book_info", lambda isbn: None)
+    target = date(2025, 1, 2)
+
+    responses.append({"status": 200, "etag": "v1", "entries": entries})
+    result = main.fetch_and_save(target, "bucket", use_cache=False)
+    assert (1, False) == (result["count"], result["skipped"])
+    assert 1 == len(calls)
+
+    responses.append({"status": 200, "etag": "v1", "entries": entries})
+    result = main.fetch_and_save(target, "bucket", use_cache=False)
+    assert "entries_unchanged" == result["skipped"]
+    assert 1 == len(calls)
+
+    # 期間指定で保存した場合など、レコードのハッシュ値だけがある場合
+    manifest = main.load_manifest("bucket", "2025-01-02")
+    main.save_manifest(
+        "bucket",
+        "2025-01-02",
+        dict(record_hash=manifest["record_hash"], uploaded_at="2025-01-01"),
+    )
+    responses.append({"status": 200, "etag": "v2", "entries": entries})
+    result = main.fetch_and_save(target, "bucket", use_cache=False)
+    assert "records_unchanged" == result["skipped"]
+    assert 2 == len(calls)
+
+    result = main.fetch_and_save(target, "bucket", use_cache=False)
+    assert ("feed_not_modified", 1) == (result["skipped"], result["count"])
+
+
+def test_fetch_and_save_delta(monkeypatch, tmp_path):
+    published = "Thu, 02 Jan 2025 00:00:00 +0900"
+    calls = []
+
+    def fetch_openbk(isbns):
+        calls.append(sorted(isbns))
+        return {}
+
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "get_today", lambda: date(2025, 1, 1))
+    monkeypatch.setattr(main, "fetch_openbk", fetch_openbk)
+    monkeypatch.setattr(main, "get_book_info", lambda isbn: None)
+    feed = [make_entry("1", published), make_entry("2", published)]
+    monkeypatch.setattr(main, "parse_feed", lambda url, **kwargs: {"entries": feed})
+    target = date(2025, 1, 2)
+    main.fetch_and_save(target, "bucket", use_cache=False, delta=True)
+    assert [["1", "2"]] == calls
+
+    changed = make_entry("2", published)
+    changed["title"] = "改題 - 著者(著/文) | 出版社"
+    feed[:] = [make_entry("1", published), changed, make_entry("3", published)]
+    result = main.fetch_and_save(target, "bucket", use_cache=False, delta=True)
+    assert ["2", "3"] == calls[-1]
+    assert dict(added=1, removed=0, changed=1, refreshed=0) == result["changes"]
+    records = list(
+        main.download_gcs_jsonl("bucket", main.get_partition_path("2025-01-02"))
+    )
+    assert ["1", "2", "3"] == [r["isbn"] for r in records]
+    assert "改題" == records[1]["title"]
+
+    feed[:] = [make_entry("1", published)]
+    result = main.fetch_and_save(target, "bucket", use_cache=False, delta=True)
+    assert dict(added=0, removed=2, changed=0, refreshed=0) == result["changes"]
+    # 削除だけなので追加情報は取得しない
+    assert 2 == len(calls)
+    logs = list(
+        (tmp_path / "bucket" / "manifests" / "new_books" / "changes").glob("*/*")
+    )
+    assert logs
+
+
+def test_save_partition_unchanged_on_gcs(monkeypatch):
+    events = []
+    storage = fake_gcs_storage(events)
+    monkeypatch.setattr(main, "get_storage", lambda bucket: storage)
+    records = [dict(isbn="1", title="本")]
+    saved = main.save_partition("bucket", "2025-01-01", records)
+    assert saved["uploaded"]
+    assert ["finalized"] == events
+    saved = main.save_partition("bucket", "2025-01-01", records, saved["hash"])
+    assert not saved["uploaded"]
+    assert ["finalized", "terminated"] == events
+
+
+def test_fetch_and_save_empty_feed(monkeypatch, tmp_path):
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "get_today", lambda: date(2025, 1, 1))
+    monkeypatch.setattr(main, "parse_feed", lambda url, **kwargs: {"entries": []})
+    for _ in range(2):
+        result = main.fetch_and_save(date(2025, 1, 2), "bucket", use_cache=False)
+        assert 0 == result["count"]
+
+
+def test_fetch_and_save_late_openbd(monkeypatch, tmp_path):
+    entries = [make_entry("1", "Thu, 02 Jan 2025 00:00:00 +0900")]
+    openbd = {"1": make_openbd("", "")}
+    calls = []
+
+    def fetch_openbk(isbns):
+        calls.append(isbns)
+        return {isbn: openbd[isbn] for isbn in isbns}
+
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "get_today", lambda: date(2025, 1, 1))
+    monkeypatch.setattr(
+        main, "parse_feed", lambda url, **kwargs: {"status": 200, "entries": entries}
+    )
+    monkeypatch.setattr(main, "fetch_openbk", fetch_openbk)
+    monkeypatch.setattr(main, "get_book_info", lambda isbn: None)
+    target = date(2025, 1, 2)
+    path = tmp_path / "bucket" / main.get_partition_path("2025-01-02")
+
+    main.fetch_and_save(target, "bucket")
+    # 後からOpenBDに書籍説明とCコードが登録された
+    openbd["1"] = make_openbd("説明", "0093")
+    result = main.fetch_and_save(target, "bucket")
+    assert result["skipped"] is False
+    assert 2 == len(calls)
+    with gzip.open(path, "rt") as f:
+        record = json.loads(f.readline())
+    assert ("説明", "0093") == (record["description"], record["c_code"])
+
+    # そろった後はスキップする
+    result = main.fetch_and_save(target, "bucket")
+    assert "entries_unchanged" == result["skipped"]
+    assert 2 == len(calls)
@@ -0,0 +1,21 @@
+from pathlib import Path
+import json
+
+from main import parse_openbd
+from onix import loads, parse_record
+
+
+# OpenBDのレスポンスの構造に合わせた合成のデータ
+FIXTURES = Path(__file__).parent.parent / "benchmarks" / "fixtures" / "openbd"
+
+
+def test_parse_record_matches_parse_openbd():
+    data = (FIXTURES / "response.json").read_bytes()
+    records = [d for d in loads(data) if d is not None]
+    assert records
+    for record in records:
+        assert parse_openbd(record) == parse_record(record)
+
+
+def test_loads():
+    assert [None, {"a": "本"}] == loads(json.dumps([None, {"a": "本"}]).encode())
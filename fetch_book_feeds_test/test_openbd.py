@@ -0,0 +1,30 @@
+import requests
+
+from openbd import OpenBDClient, chunked
+
+
+def test_chunked():
+    assert [["1", "2"], ["3", "4"], ["5"]] == chunked(["1", "2", "3", "4", "5"], 2)
+    assert [] == chunked([], 2)
+
+
+def test_fetch_retries_failed_chunks(monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda _: None)
+    client = OpenBDClient(parse=lambda d: d, chunk_size=2, retries=1)
+    calls = []
+
+    def fetch_chunk(isbns):
+        calls.append(isbns)
+        if isbns == ["3", "4"] and calls.count(isbns) == 1:
+            raise requests.exceptions.Timeout()
+        if isbns == ["5"]:
+            raise requests.exceptions.ConnectionError()
+        return {isbn: {"isbn": isbn} for isbn in isbns}
+
+    client.fetch_chunk = fetch_chunk
+    result = client.fetch(["1", "2", "3", "4", "5", "1"])
+    assert ["1", "2", "3", "4"] == sorted(result)
+    # 成功したチャンクは再送しない
+    assert 1 == calls.count(["1", "2"])
+    assert 2 == calls.count(["3", "4"])
+    assert 2 == calls.count(["5"])
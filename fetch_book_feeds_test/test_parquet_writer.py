@@ -0,0 +1,57 @@
+from datetime import date
+import io
+
+import pyarrow.parquet as pq
+
+import main
+from parquet_writer import to_parquet_bytes
+
+
+def make_record(isbn: str, publish_date: str, c_code: str):
+    return dict(
+        id=isbn,
+        raw_title=f"本{isbn}",
+        title=f"本{isbn}",
+        authors="著者",
+        publisher="出版社",
+        publish_date=publish_date,
+        link=f"https://www.hanmoto.com/bd/isbn/{isbn}",
+        isbn=isbn,
+        description="",
+        keywords="",
+        c_code=c_code,
+        label=None,
+        series=None,
+        author_data=[
+            {
+                "SequenceNumber": "1",
+                "ContributorRole": ["A01"],
+                "PersonName": {"collationkey": "チョシャ", "content": "著者"},
+            }
+        ],
+    )
+
+
+def test_to_parquet_bytes():
+    records = [
+        make_record("2", "2025-01-02", "0093"),
+        make_record("1", "2025-01-01", "0097"),
+        make_record("3", "2025-01-01", "0093"),
+    ]
+    table = pq.read_table(io.BytesIO(to_parquet_bytes(records)))
+    assert ["3", "1", "2"] == table.column("isbn").to_pylist()
+    assert date(2025, 1, 1) == table.column("publish_date")[0].as_py()
+    author = table.column("author_data")[0].as_py()[0]
+    assert "著者" == author["PersonName"]["content"]
+    assert author["BiographicalNote"] is None
+
+
+def test_save_partition_parquet(monkeypatch, tmp_path):
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "OUTPUT_FORMATS", ["parquet"])
+    records = [make_record("1", "2025-01-01", "0093")]
+    result = main.save_partition("bucket", "2025-01-01", records)
+    assert result["uploaded"]
+    assert not (tmp_path / "bucket" / main.get_partition_path("2025-01-01")).exists()
+    table = pq.read_table(tmp_path / "bucket" / main.get_parquet_path("2025-01-01"))
+    assert ["1"] == table.column("isbn").to_pylist()
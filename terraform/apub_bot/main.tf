@@ -183,6 +183,7 @@ resource "google_cloudfunctions2_function" "book_post" {
         MONGODB_PASSWORD_PATH = "/etc/secrets/mongodb_password"
         SECRET_TOKEN_PATH = "/etc/secrets_token/apub_bot_secret_token"
         POST_URL = "${data.google_cloud_run_service.default.status[0].url}/hook"
+        BUCKET_NAME = data.google_storage_bucket.bucket.name
     }
   }
 }
@@ -204,7 +205,7 @@ resource "google_bigquery_dataset_iam_member" "viewer" {
 resource "google_storage_bucket_iam_member" "binding" {
   bucket  = data.google_storage_bucket.bucket.name
   member = "serviceAccount:${google_service_account.default.email}"
-  role    = "roles/storage.objectViewer"
+  role    = "roles/storage.objectUser"
 }
 
 resource "google_cloud_scheduler_job" "post1" {
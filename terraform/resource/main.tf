@@ -82,6 +82,7 @@ resource "google_cloudfunctions2_function" "function" {
     environment_variables = {
         PROJECT_NAME = var.project_name
         BUCKET_NAME = google_storage_bucket.data_storage.name
+        OUTPUT_FORMATS = "jsonl,parquet"
     }
   }
 }
@@ -157,6 +158,22 @@ resource google_bigquery_table table {
   }
 }
 
+resource google_bigquery_table table_parquet {
+  dataset_id = google_bigquery_dataset.dataset.dataset_id
+  deletion_protection = false
+  table_id = "external_new_books_parquet"
+  external_data_configuration {
+    source_format = "PARQUET"
+    autodetect    = true
+    hive_partitioning_options {
+      mode = "CUSTOM"
+      source_uri_prefix = "gs://${google_storage_bucket.data_storage.name}/new_books_parquet/{date:DATE}/"
+      require_partition_filter = false
+    }
+    source_uris = ["gs://${google_storage_bucket.data_storage.name}/new_books_parquet/*"]
+  }
+}
+
 resource google_bigquery_table table2 {
   dataset_id = google_bigquery_dataset.dataset.dataset_id
   deletion_protection = false
@@ -239,6 +256,14 @@ resource "google_bigquery_table_iam_member" "member" {
   member = "serviceAccount:${google_service_account.default.email}"
 }
 
+resource "google_bigquery_table_iam_member" "parquet" {
+  project = google_bigquery_table.table_parquet.project
+  dataset_id = google_bigquery_table.table_parquet.dataset_id
+  table_id = google_bigquery_table.table_parquet.table_id
+  role = "roles/bigquery.dataViewer"
+  member = "serviceAccount:${google_service_account.default.email}"
+}
+
 data "google_secret_manager_secret" "openai" {
   secret_id = "openai_api_key"
 }